@@ -0,0 +1,164 @@
+"""
+Per-user hourly and daily event counts.
+
+Activity charts and profiler features ask questions such as "how many
+logins did this user have per day last month" or "how much did they move
+per hour". Asked of user_events, each one is a GROUP BY over raw rows.
+user_activity_hourly and user_activity_daily hold the answer ahead of
+time: one row per user, bucket and event type, with the event count and
+the sum of transaction_amount.
+
+partitions.insert_events, which every write path goes through, calls
+add_events() in the same transaction. add_events() folds a batch into one
+UPSERT per (user, bucket, event type), so the tables are always in step
+with the events written. The buckets are UTC hours and days. Rows moved to
+the archive or dropped by retention keep their counts. rebuild() recomputes
+both tables from the hot partitions and any archive files given. It covers
+events written before the tables existed (the migration that creates them
+does not count those) and events deleted by hand.
+"""
+import sqlite3
+from typing import Dict, Iterable, Sequence, Tuple
+
+HOUR_MS = 3600000
+DAY_MS = 86400000
+
+# Table and bucket width for each granularity
+GRANULARITIES = {
+    'hour': ('user_activity_hourly', HOUR_MS),
+    'day': ('user_activity_daily', DAY_MS),
+}
+
+# Longest range, in days, that one activity read may cover
+MAX_RANGE_DAYS = {'hour': 31, 'day': 3660}
+
+ACTIVITY_DDL = [
+    f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            user_email TEXT NOT NULL,
+            bucket_ms INTEGER NOT NULL,
+            event_type TEXT NOT NULL,
+            event_count INTEGER NOT NULL,
+            amount_sum REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_email, bucket_ms, event_type)
+        ) WITHOUT ROWID
+    '''
+    for table, _ in GRANULARITIES.values()
+]
+
+UPSERT_TEMPLATE = '''
+    INSERT INTO {table} (user_email, bucket_ms, event_type, event_count, amount_sum) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user_email, bucket_ms, event_type) DO UPDATE SET
+        event_count = event_count + excluded.event_count,
+        amount_sum = amount_sum + excluded.amount_sum
+'''
+
+# Per-bucket totals for one user, newest buckets last
+ACTIVITY_TEMPLATE = '''
+    SELECT bucket_ms, event_type, event_count, amount_sum
+    FROM {table}
+    WHERE user_email = ? AND bucket_ms >= ? AND bucket_ms < ?
+    ORDER BY bucket_ms, event_type
+'''
+
+# Raw events aggregated into buckets {width} ms wide
+AGGREGATE_TEMPLATE = '''
+    SELECT user_email, time_ms - time_ms % {width}, event_type, COUNT(*), COALESCE(SUM(transaction_amount), 0)
+    FROM user_events
+    GROUP BY 1, 2, 3
+'''
+
+# The same, added to a table inside the file
+REBUILD_TEMPLATE = f'''
+    INSERT INTO {{table}} (user_email, bucket_ms, event_type, event_count, amount_sum)
+    {AGGREGATE_TEMPLATE.strip()}
+    ON CONFLICT (user_email, bucket_ms, event_type) DO UPDATE SET
+        event_count = event_count + excluded.event_count,
+        amount_sum = amount_sum + excluded.amount_sum
+'''
+
+# Positions in a user_events row (partitions.COLUMNS order)
+EMAIL, EVENT_TYPE, AMOUNT, TIME_MS = 1, 2, 5, 8
+
+
+def add_events(conn: sqlite3.Connection, rows: Iterable[Sequence]):
+    """Add user_events rows (partitions.COLUMNS order) to both tables. Runs in the caller's transaction."""
+    totals: Dict[Tuple[str, int, str], list] = {}
+    for row in rows:
+        amount = row[AMOUNT] or 0
+        key = (row[EMAIL], row[TIME_MS] - row[TIME_MS] % HOUR_MS, row[EVENT_TYPE])
+        entry = totals.get(key)
+        if entry is None:
+            totals[key] = [1, amount]
+        else:
+            entry[0] += 1
+            entry[1] += amount
+
+    days: Dict[Tuple[str, int, str], list] = {}
+    for (user_email, hour_ms, event_type), (count, amount) in totals.items():
+        key = (user_email, hour_ms - hour_ms % DAY_MS, event_type)
+        entry = days.setdefault(key, [0, 0])
+        entry[0] += count
+        entry[1] += amount
+
+    for granularity, buckets in (('hour', totals), ('day', days)):
+        conn.executemany(UPSERT_TEMPLATE.format(table=GRANULARITIES[granularity][0]),
+                         [key + tuple(value) for key, value in buckets.items()])
+
+
+def user_activity(conn: sqlite3.Connection, user_email: str, granularity: str, start_ms: int,
+                  end_ms: int) -> list:
+    """A user's (bucket_ms, event_type, event_count, amount_sum) rows in [start_ms, end_ms)."""
+    table, _ = GRANULARITIES[granularity]
+    return conn.execute(ACTIVITY_TEMPLATE.format(table=table), (user_email, start_ms, end_ms)).fetchall()
+
+
+def rebuild(database: str, archive_paths: Sequence[str] = (), busy_timeout: int = 5000) -> Dict[str, int]:
+    """
+    Recompute both tables from the user_events in a hot file plus the given
+    archive files, in one transaction. Returns the row count of each table.
+    """
+    conn = sqlite3.connect(database, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table, width in GRANULARITIES.values():
+                conn.execute(f"DELETE FROM {table}")
+                conn.execute(REBUILD_TEMPLATE.format(table=table, width=width))
+            for path in archive_paths:
+                # Aggregated in the archive file, so only the buckets cross over
+                source = sqlite3.connect(path)
+                try:
+                    if not source.execute("SELECT 1 FROM sqlite_master WHERE name = 'user_events'").fetchone():
+                        continue
+                    for table, width in GRANULARITIES.values():
+                        conn.executemany(UPSERT_TEMPLATE.format(table=table),
+                                         source.execute(AGGREGATE_TEMPLATE.format(width=width)))
+                finally:
+                    source.close()
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                for table, _ in GRANULARITIES.values()}
+    finally:
+        conn.close()
+
+
+def report_uncounted_events(conn: sqlite3.Connection):
+    """
+    Migration step: the tables start empty, and counting the events already
+    stored is a GROUP BY over all of them, too long to hold the migration's
+    lock for. Point at scripts/rebuild_activity.py when there are any.
+    """
+    if conn.execute("SELECT 1 FROM user_events LIMIT 1").fetchone():
+        print("  user activity tables count new events only; "
+              "run scripts/rebuild_activity.py to count the events already stored")
+
+
+def remove_user(conn: sqlite3.Connection, user_email: str):
+    """Drop a user's counts, e.g. after their events were deleted. Runs in the caller's transaction."""
+    for table, _ in GRANULARITIES.values():
+        conn.execute(f"DELETE FROM {table} WHERE user_email = ?", (user_email,))
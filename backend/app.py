@@ -7,6 +7,8 @@ import datetime
 import uuid
 import os
 import random
+import calendar
+import atexit
 from typing import Dict, List, Optional, Any
 from flask import make_response
 import json
@@ -14,96 +16,49 @@ import pandas as pd
 import numpy as np
 from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
+from shards import ShardRouter, shard_path, rebalance, check_layout
+from writes import WritePipeline, MutationError
+from events import EventWriter, parse_batch
+from migrations import migrate, BASELINE_VERSION
+import repository
+import archive
+import partitions
+import event_store
+import activity
+import ids
+import forest
+from rollups import RollupCounter
+from live_sessions import LiveSessions
+import rollups
+import keystroke
+from keystroke import ModelRegistry
+from enrollment import EnrollmentTrainer
 
 
 # Optional: Enable more detailed logging
 import logging
 logging.basicConfig(level=logging.DEBUG)
-# --- KeystrokeAuthenticator Class ---
-class KeystrokeAuthenticator:
-    """
-    A class to authenticate a user based on their keystroke dynamics.
-    This version correctly handles negative latencies and mistake counts.
-    """
-    def __init__(self):
-        self.model = None
-        self.scaler = None
-        self.feature_columns = None
-        self.min_score_ = None
-        self.max_score_ = None
-
-    def fit(self, genuine_user_df: pd.DataFrame):
-        print(f"Training authenticator for a user...")
-        self.feature_columns = genuine_user_df.columns.drop(['subject', 'sessionIndex', 'rep','mistake_counter'], errors='ignore')
-        df_features = genuine_user_df[self.feature_columns].copy()
-
-        print(f"Training on {len(df_features)} samples with {len(self.feature_columns)} features.")
-        
-        self.scaler = StandardScaler()
-        X_scaled = self.scaler.fit_transform(df_features)
-
-        self.model = IsolationForest(contamination='auto', random_state=42)
-        self.model.fit(X_scaled)
-
-        training_scores = self.model.decision_function(X_scaled)
-        self.min_score_ = training_scores.min()
-        self.max_score_ = training_scores.max()
-
-        print("Training complete. The system is ready.")
-
-    def predict(self, keystroke_data: dict) -> dict:
-        if not self.model:
-            raise RuntimeError("The authenticator has not been fitted yet. Call .fit() first.")
-
-        try:
-            # Create a DataFrame from the dictionary, ensuring column order matches training
-            input_df = pd.DataFrame([keystroke_data])[self.feature_columns]
-        except KeyError as e:
-            raise ValueError(f"Input data is missing a required feature: {e}")
-        except Exception as e:
-            raise ValueError(f"Error processing input data: {e}")
-
-        input_scaled = self.scaler.transform(input_df)
-        raw_score = self.model.decision_function(input_scaled)[0]
-        status = "Anomaly" if raw_score < 0 else "Normal"
-        
-        # Safely calculate confidence
-        score_range = self.max_score_ - self.min_score_
-        if score_range == 0: # Avoid division by zero if all training scores were identical
-             normalized_score = 0.5
-        else:
-            normalized_score = (raw_score - self.min_score_) / score_range
-        
-        normalized_score = np.clip(normalized_score, 0, 1)
-        anomaly_confidence = (1 - normalized_score) * 100
-        
-        return {
-            "status": status,
-            "anomaly_confidence_percent": round(anomaly_confidence, 2),
-            "raw_score": round(raw_score, 4)
-        }
-
-# Global authenticator instance
-authenticator = None
 class UserBehaviorProfiler:
     """
     Analyzes user behavior sessions to detect anomalies based on historical event data.
     """
+    # Define a canonical list of event types to ensure feature consistency
+    canonical_event_types = [
+        'login_success', 'login_failed', 'logout', 'bill_payment', 'recharge', 
+        'own_account_transfer', 'beneficiary_transfer', 'stocks_view', 
+        'stock_buy', 'stock_sell', 'portfolio_view', 'fd_created', 
+        'fd_details_view', 'fd_certificate_download', 'fd_export',
+        'account_statement_view', 'account_statement_export'
+    ]
+
     def __init__(self, session_timeout_minutes=30):
         self.model = None
         self.scaler = None
+        self.forest = None
         self.feature_columns = None
         self.session_timeout = pd.Timedelta(minutes=session_timeout_minutes)
         self.min_score_ = None
         self.max_score_ = None
-        # Define a canonical list of event types to ensure feature consistency
-        self.canonical_event_types = [
-            'login_success', 'login_failed', 'logout', 'bill_payment', 'recharge', 
-            'own_account_transfer', 'beneficiary_transfer', 'stocks_view', 
-            'stock_buy', 'stock_sell', 'portfolio_view', 'fd_created', 
-            'fd_details_view', 'fd_certificate_download', 'fd_export',
-            'account_statement_view', 'account_statement_export'
-        ]
 
     def _preprocess_and_create_sessions(self, df_events: pd.DataFrame) -> Optional[pd.DataFrame]:
         """
@@ -196,8 +151,9 @@ class UserBehaviorProfiler:
 
         self.model = IsolationForest(contamination='auto', random_state=42)
         self.model.fit(X_scaled)
+        self.forest = forest.compile(self.model)
 
-        training_scores = self.model.decision_function(X_scaled)
+        training_scores = self.forest.decision_function(X_scaled)
         self.min_score_ = training_scores.min()
         self.max_score_ = training_scores.max()
 
@@ -229,7 +185,7 @@ class UserBehaviorProfiler:
         input_vector = features_df.reindex(columns=self.feature_columns, fill_value=0)
 
         input_scaled = self.scaler.transform(input_vector)
-        raw_score = self.model.decision_function(input_scaled)[0]
+        raw_score = self.forest.decision_function(input_scaled)[0]
         status = "Anomaly" if raw_score < 0 else "Normal"
 
         # Safely calculate confidence
@@ -251,43 +207,36 @@ class UserBehaviorProfiler:
 behavior_profilers = {}
 def train_model_on_startup():
     """
-    Loads data, trains the model for a specific user, and returns the
-    trained authenticator object. This runs only once when the server starts.
+    Makes sure the enrolled demo account has a keystroke model and trains
+    its behaviour profiler. This runs only once when the server starts.
     """
-    global authenticator
-    
     # --- Configuration ---
     CSV_FILE = 'collected_keystroke_data.csv'
-    ENROLLED_USER = 'Pranav' # We will build the model for this user
-    
-    print(f"--- Server is starting: Loading data and training model for user '{ENROLLED_USER}' ---")
-    
-    try:
-        df = pd.read_csv(CSV_FILE)
-        # Filter the DataFrame to get data for only our enrolled user
-        user_df = df[df['subject'] == ENROLLED_USER].copy()
-
-        if user_df.empty:
-            raise ValueError(f"No data found for subject '{ENROLLED_USER}' in the CSV file.")
+    ENROLLED_USER = 'Pranav' # CSV subject enrolled for the account below
 
-        # Instantiate and train the authenticator
-        authenticator = KeystrokeAuthenticator()
-        authenticator.fit(user_df)
-        
-    except FileNotFoundError:
-        print(f"FATAL ERROR: The data file '{CSV_FILE}' was not found.")
-        authenticator = None # Ensure authenticator is None if training fails
-    except Exception as e:
-        print(f"FATAL ERROR during model training: {e}")
-        authenticator = None
-        # --- Behavioral Model Training ---
+    # Saved models are loaded on each user's first biometric login; only a missing one is trained here
     ENROLLED_USER_EMAIL = 'pranavm2323@gmail.com'
+    if not keystroke_models.enrolled(ENROLLED_USER_EMAIL):
+        print(f"--- Server is starting: Training keystroke model for user '{ENROLLED_USER}' ---")
+        try:
+            keystroke_models.save(ENROLLED_USER_EMAIL, keystroke.fit_from_csv(CSV_FILE, ENROLLED_USER))
+        except FileNotFoundError:
+            print(f"FATAL ERROR: The data file '{CSV_FILE}' was not found.")
+        except Exception as e:
+            print(f"FATAL ERROR during model training: {e}")
+        # --- Behavioral Model Training ---
     print(f"--- Server is starting: Training Behavioral Model for user '{ENROLLED_USER_EMAIL}' ---")
     try:
-        conn = get_db()
-        # Load all historical events for the enrolled user
-        df_events = pd.read_sql_query("SELECT * FROM user_events WHERE user_email = ?", conn, params=(ENROLLED_USER_EMAIL,))
-        conn.close()
+        # Memory-map the user's columnar copy plus the rows written since it was compacted;
+        # fall back to the database if it has not been compacted yet
+        conn = get_db(shards.user_id_for_email(ENROLLED_USER_EMAIL))
+        try:
+            df_events = event_store.read_frame(shard_path(DATABASE, shards.shard_for_email(ENROLLED_USER_EMAIL)),
+                                               ENROLLED_USER_EMAIL, conn)
+            if df_events is None:
+                df_events = pd.read_sql_query("SELECT * FROM user_events WHERE user_email = ? ORDER BY time_ms", conn, params=(ENROLLED_USER_EMAIL,))
+        finally:
+            conn.close()
 
         if df_events.empty:
             raise ValueError(f"No event data found for user '{ENROLLED_USER_EMAIL}'.")
@@ -312,225 +261,123 @@ jwt = JWTManager(app)
 CORS(app, resources={r"/api/*": {"origins": "http://localhost:5173"}}, supports_credentials=True)
 
 # Database setup
-DATABASE = 'banking.db'
+DATABASE = os.environ.get('SQLITE_DATABASE', 'banking.db')
+app.config['SQLITE_SHARD_COUNT'] = int(os.environ.get('SQLITE_SHARD_COUNT', 1))
+app.config['SQLITE_POOL_SIZE'] = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+app.config['SQLITE_READ_POOL_SIZE'] = int(os.environ.get('SQLITE_READ_POOL_SIZE', max(4, (os.cpu_count() or 1) * 2)))
+app.config['SQLITE_MAX_CONNECTION_AGE'] = float(os.environ.get('SQLITE_MAX_CONNECTION_AGE', 3600))
+app.config['WRITE_BATCH_MAX_SIZE'] = int(os.environ.get('WRITE_BATCH_MAX_SIZE', 64))
+app.config['WRITE_BATCH_MAX_WAIT_MS'] = float(os.environ.get('WRITE_BATCH_MAX_WAIT_MS', 2))
+app.config['EVENT_QUEUE_SIZE'] = int(os.environ.get('EVENT_QUEUE_SIZE', 10000))
+app.config['EVENT_BATCH_MAX_SIZE'] = int(os.environ.get('EVENT_BATCH_MAX_SIZE', 500))
+app.config['EVENT_BATCH_MAX_WAIT_MS'] = float(os.environ.get('EVENT_BATCH_MAX_WAIT_MS', 200))
+app.config['EVENT_QUEUE_BLOCK_MS'] = float(os.environ.get('EVENT_QUEUE_BLOCK_MS', 0))
+app.config['EVENT_BATCH_MAX_EVENTS'] = int(os.environ.get('EVENT_BATCH_MAX_EVENTS', 1000))
+app.config['EVENT_ROLLUP_TYPES'] = frozenset(
+    name.strip() for name in os.environ.get('EVENT_ROLLUP_TYPES', 'stocks_view').split(',') if name.strip())
+app.config['EVENT_ROLLUP_FLUSH_SECONDS'] = float(os.environ.get('EVENT_ROLLUP_FLUSH_SECONDS', 10))
+app.config['LIVE_SESSION_MAX_EVENTS'] = int(os.environ.get('LIVE_SESSION_MAX_EVENTS', 500))
+app.config['LIVE_SESSION_TIMEOUT_MINUTES'] = float(os.environ.get('LIVE_SESSION_TIMEOUT_MINUTES', 30))
+app.config['LIVE_SESSION_MAX_USERS'] = int(os.environ.get('LIVE_SESSION_MAX_USERS', 10000))
+app.config['EVENT_RETENTION_MONTHS'] = int(os.environ.get('EVENT_RETENTION_MONTHS', 0))
+app.config['EVENT_STORE_COMPACTION'] = int(os.environ.get('EVENT_STORE_COMPACTION', 1))
+# Off by default: transaction lists, recent transfers and the profile only read the hot file
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 0))
+app.config['ARCHIVE_INTERVAL_SECONDS'] = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 3600))
+app.config['MIGRATION_BATCH_SIZE'] = int(os.environ.get('MIGRATION_BATCH_SIZE', 5000))
+app.config['KEYSTROKE_MODEL_DIR'] = os.environ.get('KEYSTROKE_MODEL_DIR', 'keystroke_models')
+app.config['KEYSTROKE_MODEL_CACHE_MB'] = float(os.environ.get('KEYSTROKE_MODEL_CACHE_MB', 64))
+# Accounts allowed to score samples against other users' keystroke models (offline evaluation); others only get their own
+app.config['KEYSTROKE_EVALUATOR_EMAILS'] = frozenset(
+    email.strip() for email in os.environ.get('KEYSTROKE_EVALUATOR_EMAILS', '').split(',') if email.strip())
+app.config['KEYSTROKE_BATCH_MAX_SAMPLES'] = int(os.environ.get('KEYSTROKE_BATCH_MAX_SAMPLES', 10000))
+# Refit a user's keystroke model once this many accepted login samples are buffered (0 turns buffering off)
+app.config['KEYSTROKE_RETRAIN_MIN_SAMPLES'] = int(os.environ.get('KEYSTROKE_RETRAIN_MIN_SAMPLES', 20))
+app.config['KEYSTROKE_RETRAIN_MAX_SAMPLES'] = int(os.environ.get('KEYSTROKE_RETRAIN_MAX_SAMPLES', 1000))
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 268435456)),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+}
+
+# Users are spread over SQLITE_SHARD_COUNT files. Every shard has a writer pool and a read-only pool;
+# GET handlers read from their own WAL snapshots and never queue behind a writer's commit
+shards = ShardRouter(
+    DATABASE,
+    shard_count=app.config['SQLITE_SHARD_COUNT'],
+    writer_size=app.config['SQLITE_POOL_SIZE'],
+    reader_size=app.config['SQLITE_READ_POOL_SIZE'],
+    max_age=app.config['SQLITE_MAX_CONNECTION_AGE'],
+    pragmas=app.config['SQLITE_PRAGMAS']
+)
+
+# Money-moving handlers submit their writes to their shard's pipeline; one writer thread per shard group-commits them
+write_pipelines = [
+    WritePipeline(
+        pool,
+        max_batch=app.config['WRITE_BATCH_MAX_SIZE'],
+        max_wait=app.config['WRITE_BATCH_MAX_WAIT_MS'] / 1000.0
+    )
+    for pool in shards.writers
+]
+for pipeline in write_pipelines:
+    atexit.register(pipeline.stop)
+
+# Analytics events are queued and written in batches off the request path
+event_writer = EventWriter(
+    lambda email: shards.writers[shards.shard_for_email(email)],
+    max_batch=app.config['EVENT_BATCH_MAX_SIZE'],
+    max_wait=app.config['EVENT_BATCH_MAX_WAIT_MS'] / 1000.0,
+    queue_size=app.config['EVENT_QUEUE_SIZE'],
+    block_timeout=app.config['EVENT_QUEUE_BLOCK_MS'] / 1000.0
+)
+atexit.register(event_writer.stop)
+
+# Event types that are only counted go to per-minute buckets in the common file instead
+event_rollups = RollupCounter(shards.writers[0], flush_interval=app.config['EVENT_ROLLUP_FLUSH_SECONDS'])
+atexit.register(event_rollups.stop)
+
+# Each active user's current session, so the session endpoint rarely needs SQL
+live_sessions = LiveSessions(
+    max_events=app.config['LIVE_SESSION_MAX_EVENTS'],
+    timeout_seconds=app.config['LIVE_SESSION_TIMEOUT_MINUTES'] * 60,
+    max_users=app.config['LIVE_SESSION_MAX_USERS']
+)
+
+# Per-user keystroke models, loaded on first use and kept in memory up to the cache budget
+keystroke_models = ModelRegistry(
+    app.config['KEYSTROKE_MODEL_DIR'],
+    memory_budget=int(app.config['KEYSTROKE_MODEL_CACHE_MB'] * 1024 * 1024)
+)
+
+# Samples from successful biometric logins are buffered and refitted into the user's model in the background
+keystroke_trainer = EnrollmentTrainer(
+    keystroke_models,
+    min_samples=app.config['KEYSTROKE_RETRAIN_MIN_SAMPLES'],
+    max_samples=app.config['KEYSTROKE_RETRAIN_MAX_SAMPLES']
+)
+atexit.register(keystroke_trainer.stop)
 
 def init_db():
-    """Initialize the database with all required tables"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # Users table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id TEXT PRIMARY KEY,
-            email TEXT UNIQUE NOT NULL,
-            password TEXT NOT NULL,
-            first_name TEXT NOT NULL,
-            last_name TEXT NOT NULL,
-            phone TEXT NOT NULL,
-            balance REAL DEFAULT 100000.0,
-            account_number TEXT UNIQUE NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP
-        )
-    ''')
-    
-    # User Events table for tracking all user activities
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS user_events (
-            id TEXT PRIMARY KEY,
-            user_email TEXT NOT NULL,
-            event_type TEXT NOT NULL,
-            time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            page_url TEXT,
-            transaction_amount REAL DEFAULT 0,
-            transaction_type TEXT,
-            additional_data TEXT,
-            FOREIGN KEY (user_email) REFERENCES users (email)
-        )
-    ''')
-    # Billers table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS billers (
-        id TEXT PRIMARY KEY,
-        user_id TEXT NOT NULL,
-        provider_name TEXT NOT NULL, -- e.g., 'KSEB', 'Airtel'
-        category TEXT NOT NULL, -- e.g., 'Electricity Bill', 'Mobile Recharge'
-        consumer_id TEXT NOT NULL, -- The user's specific account/phone number
-        nickname TEXT, -- e.g., 'Home Electricity', 'My Jio Number'
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
-    )
-    ''')
-    # Stocks table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS stocks (
-            symbol TEXT PRIMARY KEY,
-            name TEXT NOT NULL,
-            price REAL NOT NULL,
-            change REAL DEFAULT 0,
-            change_percent REAL DEFAULT 0,
-            volume TEXT,
-            high REAL,
-            low REAL,
-            category TEXT,
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    
-    # Portfolio table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS portfolio (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            symbol TEXT NOT NULL,
-            shares INTEGER NOT NULL,
-            buy_price REAL NOT NULL,
-            total_investment REAL NOT NULL,
-            purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (symbol) REFERENCES stocks (symbol)
-        )
-    ''')
-    
-    # Transactions table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS transactions (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            type TEXT NOT NULL,
-            symbol TEXT,
-            shares INTEGER,
-            amount REAL NOT NULL,
-            price REAL,
-            description TEXT NOT NULL,
-            status TEXT DEFAULT 'PENDING',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            completed_at TIMESTAMP,
-            reference TEXT,
-            counterparty TEXT,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-# In init_db() in app.py
-
-# ... after the other CREATE TABLE statements ...
-
-# AutoPay Rules table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS autopay_rules (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            biller_id TEXT NOT NULL,
-            max_amount REAL NOT NULL,
-            enabled INTEGER DEFAULT 1, -- 1 for true, 0 for false
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (biller_id) REFERENCES billers (id) ON DELETE CASCADE
-        )
-    ''')
-    # Fixed Deposits table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS fixed_deposits (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            amount REAL NOT NULL,
-            interest_rate REAL NOT NULL,
-            tenure INTEGER NOT NULL,
-            start_date TIMESTAMP NOT NULL,
-            maturity_date TIMESTAMP NOT NULL,
-            type TEXT NOT NULL,
-            status TEXT DEFAULT 'ACTIVE',
-            interest_earned REAL DEFAULT 0,
-            maturity_amount REAL NOT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Beneficiaries table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS beneficiaries (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            name TEXT NOT NULL,
-            account_number TEXT NOT NULL,
-            ifsc_code TEXT,
-            bank_name TEXT,
-            account_type TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id)
-        )
-    ''')
-    
-    # Tax payments table
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS tax_payments (
-            id TEXT PRIMARY KEY,
-            user_id TEXT NOT NULL,
-            transaction_id TEXT NOT NULL,
-            tax_type TEXT NOT NULL, -- 'DIRECT', 'GST', 'STATE'
-            -- Direct tax fields
-            pan_tan TEXT,
-            assessment_year TEXT,
-            tax_applicable TEXT,
-            payment_type TEXT,
-            -- GST fields
-            gstin TEXT,
-            cpin TEXT,
-            cgst REAL DEFAULT 0,
-            sgst REAL DEFAULT 0,
-            igst REAL DEFAULT 0,
-            cess REAL DEFAULT 0,
-            -- State tax fields
-            state TEXT,
-            municipality TEXT,
-            service_type TEXT,
-            consumer_id TEXT,
-            -- Common fields
-            amount REAL NOT NULL,
-            status TEXT DEFAULT 'PENDING',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (user_id) REFERENCES users (id),
-            FOREIGN KEY (transaction_id) REFERENCES transactions (id)
-        )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    
-    # Run migrations
-    run_migrations()
+    """Bring every shard's schema up to date and seed a freshly created database"""
+    shard_count = app.config['SQLITE_SHARD_COUNT']
+    applied = migrate(DATABASE, batch_size=app.config['MIGRATION_BATCH_SIZE'])
+    for shard in range(1, shard_count):
+        migrate(shard_path(DATABASE, shard), batch_size=app.config['MIGRATION_BATCH_SIZE'])
     
     # Initialize with sample data
-    initialize_sample_data()
-
-def run_migrations():
-    """Run database migrations for existing databases"""
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # Check if created_at column exists in fixed_deposits table
-    try:
-        cursor.execute("SELECT created_at FROM fixed_deposits LIMIT 1")
-    except sqlite3.OperationalError:
-        # Column doesn't exist, add it
-        print("Adding created_at column to fixed_deposits table...")
-        try:
-            # Add column without default first
-            cursor.execute("ALTER TABLE fixed_deposits ADD COLUMN created_at TIMESTAMP")
-            
-            # Update existing rows with current timestamp
-            cursor.execute("UPDATE fixed_deposits SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL")
-            
-            conn.commit()
-            print("Migration completed successfully!")
-        except sqlite3.OperationalError as e:
-            print(f"Migration failed: {e}")
-            # If the table doesn't exist, that's fine - it will be created with the correct schema
-            pass
+    if BASELINE_VERSION in applied:
+        initialize_sample_data()
+        if shard_count > 1:
+            # The sample accounts are written to the common file; move them to their shards
+            rebalance(DATABASE, shard_count, batch_size=app.config['MIGRATION_BATCH_SIZE'])
     
-    conn.close()
+    check_layout(DATABASE, shard_count)
+    for shard in range(shard_count):
+        # This and next month's event partitions exist before the first request
+        partitions.maintain(shard_path(DATABASE, shard), app.config['EVENT_RETENTION_MONTHS'])
 
 def initialize_sample_data():
     """Initialize database with sample data"""
@@ -544,7 +391,7 @@ def initialize_sample_data():
         return
     
     # Create demo user
-    demo_user_id = str(uuid.uuid4())
+    demo_user_id = ids.new_id()
     cursor.execute('''
         INSERT INTO users (id, email, password, first_name, last_name, phone, balance, account_number)
         VALUES (?, ?, ?, ?, ?, ?, ?, ?)
@@ -627,13 +474,13 @@ def initialize_sample_data():
     
     # Demo portfolio with more realistic holdings
     portfolio_data = [
-        (str(uuid.uuid4()), demo_user_id, 'RELIANCE', 50, 2450.75, 122537.5, '2023-06-15'),
-        (str(uuid.uuid4()), demo_user_id, 'TCS', 25, 3890.25, 97256.25, '2023-08-20'),
-        (str(uuid.uuid4()), demo_user_id, 'HDFCBANK', 30, 1675.5, 50265, '2023-10-10'),
-        (str(uuid.uuid4()), demo_user_id, 'INFY', 40, 1650.25, 66010, '2023-11-05'),
-        (str(uuid.uuid4()), demo_user_id, 'ITC', 100, 420.50, 42050, '2023-12-01'),
-        (str(uuid.uuid4()), demo_user_id, 'WIPRO', 60, 440.75, 26445, '2024-01-15'),
-        (str(uuid.uuid4()), demo_user_id, 'TECHM', 45, 1200.25, 54011.25, '2024-02-10')
+        (ids.new_id(), demo_user_id, 'RELIANCE', 50, 2450.75, 122537.5, '2023-06-15'),
+        (ids.new_id(), demo_user_id, 'TCS', 25, 3890.25, 97256.25, '2023-08-20'),
+        (ids.new_id(), demo_user_id, 'HDFCBANK', 30, 1675.5, 50265, '2023-10-10'),
+        (ids.new_id(), demo_user_id, 'INFY', 40, 1650.25, 66010, '2023-11-05'),
+        (ids.new_id(), demo_user_id, 'ITC', 100, 420.50, 42050, '2023-12-01'),
+        (ids.new_id(), demo_user_id, 'WIPRO', 60, 440.75, 26445, '2024-01-15'),
+        (ids.new_id(), demo_user_id, 'TECHM', 45, 1200.25, 54011.25, '2024-02-10')
     ]
     
     for portfolio in portfolio_data:
@@ -644,16 +491,16 @@ def initialize_sample_data():
     
     # Demo transactions with more variety
     transactions_data = [
-        (str(uuid.uuid4()), demo_user_id, 'TRANSFER_OUT', None, None, 25000, None, 'Transfer to Ravi Kumar', 'COMPLETED', '2024-01-15T14:32:00', '2024-01-15T14:32:00', 'Gift for wedding', 'Ravi Kumar'),
-        (str(uuid.uuid4()), demo_user_id, 'TRANSFER_IN', None, None, 85000, None, 'Salary Credit from TechCorp Solutions', 'COMPLETED', '2024-01-15T09:30:00', '2024-01-15T09:30:00', 'Salary for January 2024', 'TechCorp Solutions Pvt Ltd'),
-        (str(uuid.uuid4()), demo_user_id, 'BUY', 'RELIANCE', 50, 122537.5, 2450.75, 'Bought 50 shares of RELIANCE', 'COMPLETED', '2023-06-15T11:45:00', '2023-06-15T11:45:00', None, None),
-        (str(uuid.uuid4()), demo_user_id, 'BUY', 'TCS', 25, 97256.25, 3890.25, 'Bought 25 shares of TCS', 'COMPLETED', '2023-08-20T14:20:00', '2023-08-20T14:20:00', None, None),
-        (str(uuid.uuid4()), demo_user_id, 'BUY', 'HDFCBANK', 30, 50265, 1675.5, 'Bought 30 shares of HDFCBANK', 'COMPLETED', '2023-10-10T10:15:00', '2023-10-10T10:15:00', None, None),
-        (str(uuid.uuid4()), demo_user_id, 'BUY', 'INFY', 40, 66010, 1650.25, 'Bought 40 shares of INFY', 'COMPLETED', '2023-11-05T16:30:00', '2023-11-05T16:30:00', None, None),
-        (str(uuid.uuid4()), demo_user_id, 'BUY', 'ITC', 100, 42050, 420.5, 'Bought 100 shares of ITC', 'COMPLETED', '2023-12-01T09:45:00', '2023-12-01T09:45:00', None, None),
-        (str(uuid.uuid4()), demo_user_id, 'BUY', 'WIPRO', 60, 26445, 440.75, 'Bought 60 shares of WIPRO', 'COMPLETED', '2024-01-15T13:20:00', '2024-01-15T13:20:00', None, None),
-        (str(uuid.uuid4()), demo_user_id, 'BUY', 'TECHM', 45, 54011.25, 1200.25, 'Bought 45 shares of TECHM', 'COMPLETED', '2024-02-10T11:10:00', '2024-02-10T11:10:00', None, None),
-        (str(uuid.uuid4()), demo_user_id, 'SELL', 'RELIANCE', 10, 26879, 2687.9, 'Sold 10 shares of RELIANCE', 'COMPLETED', '2024-01-14T15:30:00', '2024-01-14T15:30:00', None, None)
+        (ids.new_id(), demo_user_id, 'TRANSFER_OUT', None, None, 25000, None, 'Transfer to Ravi Kumar', 'COMPLETED', '2024-01-15T14:32:00', '2024-01-15T14:32:00', 'Gift for wedding', 'Ravi Kumar'),
+        (ids.new_id(), demo_user_id, 'TRANSFER_IN', None, None, 85000, None, 'Salary Credit from TechCorp Solutions', 'COMPLETED', '2024-01-15T09:30:00', '2024-01-15T09:30:00', 'Salary for January 2024', 'TechCorp Solutions Pvt Ltd'),
+        (ids.new_id(), demo_user_id, 'BUY', 'RELIANCE', 50, 122537.5, 2450.75, 'Bought 50 shares of RELIANCE', 'COMPLETED', '2023-06-15T11:45:00', '2023-06-15T11:45:00', None, None),
+        (ids.new_id(), demo_user_id, 'BUY', 'TCS', 25, 97256.25, 3890.25, 'Bought 25 shares of TCS', 'COMPLETED', '2023-08-20T14:20:00', '2023-08-20T14:20:00', None, None),
+        (ids.new_id(), demo_user_id, 'BUY', 'HDFCBANK', 30, 50265, 1675.5, 'Bought 30 shares of HDFCBANK', 'COMPLETED', '2023-10-10T10:15:00', '2023-10-10T10:15:00', None, None),
+        (ids.new_id(), demo_user_id, 'BUY', 'INFY', 40, 66010, 1650.25, 'Bought 40 shares of INFY', 'COMPLETED', '2023-11-05T16:30:00', '2023-11-05T16:30:00', None, None),
+        (ids.new_id(), demo_user_id, 'BUY', 'ITC', 100, 42050, 420.5, 'Bought 100 shares of ITC', 'COMPLETED', '2023-12-01T09:45:00', '2023-12-01T09:45:00', None, None),
+        (ids.new_id(), demo_user_id, 'BUY', 'WIPRO', 60, 26445, 440.75, 'Bought 60 shares of WIPRO', 'COMPLETED', '2024-01-15T13:20:00', '2024-01-15T13:20:00', None, None),
+        (ids.new_id(), demo_user_id, 'BUY', 'TECHM', 45, 54011.25, 1200.25, 'Bought 45 shares of TECHM', 'COMPLETED', '2024-02-10T11:10:00', '2024-02-10T11:10:00', None, None),
+        (ids.new_id(), demo_user_id, 'SELL', 'RELIANCE', 10, 26879, 2687.9, 'Sold 10 shares of RELIANCE', 'COMPLETED', '2024-01-14T15:30:00', '2024-01-14T15:30:00', None, None)
     ]
     
     for transaction in transactions_data:
@@ -664,9 +511,9 @@ def initialize_sample_data():
     
     # Demo fixed deposits
     fd_data = [
-        (str(uuid.uuid4()), demo_user_id, 500000, 7.5, 24, '2023-06-15', '2025-06-15', 'REGULAR', 'ACTIVE', 45678.9, 575000),
-        (str(uuid.uuid4()), demo_user_id, 150000, 6.9, 36, '2023-03-31', '2026-03-31', 'TAX_SAVING', 'ACTIVE', 12450.75, 186750),
-        (str(uuid.uuid4()), demo_user_id, 1000000, 8.1, 24, '2022-12-01', '2024-12-01', 'SENIOR', 'MATURED', 162000, 1162000)
+        (ids.new_id(), demo_user_id, 500000, 7.5, 24, '2023-06-15', '2025-06-15', 'REGULAR', 'ACTIVE', 45678.9, 575000),
+        (ids.new_id(), demo_user_id, 150000, 6.9, 36, '2023-03-31', '2026-03-31', 'TAX_SAVING', 'ACTIVE', 12450.75, 186750),
+        (ids.new_id(), demo_user_id, 1000000, 8.1, 24, '2022-12-01', '2024-12-01', 'SENIOR', 'MATURED', 162000, 1162000)
     ]
     
     for fd in fd_data:
@@ -678,36 +525,92 @@ def initialize_sample_data():
     conn.commit()
     conn.close()
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
-    return conn
+def get_db(user_id: str = None):
+    """Get this thread's pooled connection to a user's shard, or the common file (close() returns it to the pool)"""
+    return shards.writer(user_id).connection()
+
+def get_read_db(user_id: str = None):
+    """Get this thread's read-only connection to a user's shard, for handlers that never write"""
+    return shards.reader(user_id).connection()
+
+@app.teardown_appcontext
+def release_connections(exception=None):
+    """Hand back connections a handler did not close, e.g. because it raised; any open transaction is rolled back"""
+    shards.release_thread()
+
+def get_write_pipeline(user_id: str) -> WritePipeline:
+    """The group-commit pipeline for a user's shard"""
+    return write_pipelines[shards.shard_for(user_id)]
 
 def track_user_event(user_email: str, event_type: str, page_url: str = None, 
                     transaction_amount: float = 0, transaction_type: str = None, 
                     additional_data: str = None):
-    """Track user events for analytics"""
-    try:
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        event_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO user_events (id, user_email, event_type, page_url, transaction_amount, transaction_type, additional_data)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (event_id, user_email, event_type, page_url, transaction_amount, transaction_type, additional_data))
-        
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        print(f"Error tracking user event: {e}")
+    """
+    Track user events for analytics. The row is queued and written by the event
+    writer and added to the user's live session, or for anonymous EVENT_ROLLUP_TYPES
+    only counted in a per-minute rollup; a user's own events are always stored,
+    because the behaviour profiler counts them per user.
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if user_email == 'anonymous' and event_type in app.config['EVENT_ROLLUP_TYPES']:
+        event_rollups.add(event_type, page_url, to_epoch_ms(now))
+        return
+    row = (ids.new_id(), user_email, event_type, now.strftime('%Y-%m-%d %H:%M:%S'), page_url,
+           transaction_amount, transaction_type, additional_data, to_epoch_ms(now))
+    if event_writer.record(row):
+        live_sessions.record(row)
 
 # Helper functions
 def generate_account_number():
     """Generate a unique account number"""
     return f"000000{str(uuid.uuid4().int)[:9]}"
 
+def challan_number(payment_id: str) -> str:
+    """
+    Challan number for a tax payment. A UUIDv7 id starts with its timestamp, so
+    payments made within a minute of each other share a prefix; those use the
+    random tail. Older random (v4) ids keep the number they were issued with.
+    """
+    code = payment_id[-8:] if payment_id[14:15] == '7' else payment_id[:8]
+    return f"CH{code.upper()}"
+
+def to_epoch_ms(value: datetime.datetime) -> int:
+    """Milliseconds since the Unix epoch. Naive datetimes are UTC, like CURRENT_TIMESTAMP."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+    return int(value.timestamp() * 1000)
+
+def date_to_epoch_ms(date_str: str) -> int:
+    """Midnight UTC of a 'YYYY-MM-DD' date as epoch milliseconds"""
+    return to_epoch_ms(datetime.datetime.strptime(date_str, '%Y-%m-%d'))
+
+def months_ago_ms(months: int) -> int:
+    """Epoch milliseconds for now minus a number of calendar months"""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    year, month = divmod(now.year * 12 + now.month - 1 - months, 12)
+    day = min(now.day, calendar.monthrange(year, month + 1)[1])
+    return to_epoch_ms(now.replace(year=year, month=month + 1, day=day))
+
+def statement_bounds_ms(period: str, start_date: Optional[str], end_date: Optional[str]):
+    """
+    Half-open [start, end) epoch-millisecond range for an account statement period.
+    Either bound is None when the period leaves it open. Raises ValueError for a
+    date that is not YYYY-MM-DD.
+    """
+    if period == 'byDate' and start_date and end_date:
+        try:
+            return date_to_epoch_ms(start_date), date_to_epoch_ms(end_date) + 86400000
+        except (TypeError, ValueError):
+            raise ValueError('start_date and end_date must be dates in YYYY-MM-DD format')
+    if period == 'last6Months':
+        return months_ago_ms(6), None
+    if period == 'financialYear':
+        # Current financial year (April to March)
+        now = datetime.datetime.now()
+        fy_start_year = now.year - 1 if now.month < 4 else now.year
+        return date_to_epoch_ms(f"{fy_start_year}-04-01"), date_to_epoch_ms(f"{fy_start_year + 1}-04-01")
+    return None, None
+
 def update_stock_prices():
     """Simulate real-time stock price updates with more realistic variations"""
     conn = get_db()
@@ -786,32 +689,132 @@ def test():
         'message': 'Backend is running!'
     })
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify({
+        'success': True,
+        'shards': shards.metrics(),
+        'write_pipelines': [pipeline.metrics() for pipeline in write_pipelines],
+        'event_writer': event_writer.metrics(),
+        'event_rollups': event_rollups.metrics(),
+        'live_sessions': live_sessions.metrics(),
+        'keystroke_models': keystroke_models.metrics(),
+        'keystroke_enrollment': keystroke_trainer.metrics()
+    })
+
 # Keystroke authentication endpoint
+def keystroke_model_email(requested: Any, caller_email: str) -> str:
+    """
+    The account whose keystroke model a request scores against: the caller's own
+    unless it names another one, which only KEYSTROKE_EVALUATOR_EMAILS may do.
+    Raises ValueError for an email that is not a string, PermissionError for one
+    the caller may not use.
+    """
+    if requested is None or requested == '':
+        return caller_email
+    if not isinstance(requested, str):
+        raise ValueError("email must be a string")
+    if requested != caller_email and caller_email not in app.config['KEYSTROKE_EVALUATOR_EMAILS']:
+        raise PermissionError("Not allowed to score against another user's keystroke model")
+    return requested
+
+def current_user_email(user_id: str) -> Optional[str]:
+    conn = get_read_db(user_id)
+    try:
+        user = conn.execute("SELECT email FROM users WHERE id = ?", (user_id,)).fetchone()
+    finally:
+        conn.close()
+    return user['email'] if user else None
+
 @app.route('/api/keystroke/predict', methods=['POST'])
+@jwt_required()
 def predict_keystroke():
     """
     Receives a JSON object with keystroke data and returns a prediction.
     """
-    if authenticator is None:
-        return jsonify({"error": "Model is not trained. Check server logs."}), 500
-
     # Get the JSON data from the request
     data = request.get_json()
     if not data:
         return jsonify({"error": "Invalid input: No JSON data received."}), 400
 
+    caller_email = current_user_email(get_jwt_identity())
+    if caller_email is None:
+        return jsonify({"error": "User not found."}), 404
+
     try:
-        # Use the global authenticator object to make a prediction
+        # An optional "email" key picks the user's model; it is not a feature, so predict ignores it
+        email = keystroke_model_email(data.get('email'), caller_email)
+        authenticator = keystroke_models.get(email)
+        if authenticator is None:
+            return jsonify({"error": "No keystroke model is enrolled for this user."}), 404
+
         result = authenticator.predict(data)
         return jsonify(result)
-    
+
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
     except ValueError as e:
         # Handle cases where the input JSON is missing keys or malformed
         return jsonify({"error": str(e)}), 400
     except Exception as e:
         # Handle other unexpected errors
         return jsonify({"error": f"An internal server error occurred: {e}"}), 500
-    
+
+@app.route('/api/keystroke/predict-batch', methods=['POST'])
+@jwt_required()
+def predict_keystroke_batch():
+    """
+    Scores many keystroke samples in one call: {"samples": [...], "email": ...}
+    or a bare JSON array. Samples are scored against the caller's own model;
+    accounts in KEYSTROKE_EVALUATOR_EMAILS may name another user's with a
+    sample's "email" key or the body's. The samples for one user go through
+    their model as a single matrix. Results come back in input order, with
+    {"error": ...} in place of any sample that /api/keystroke/predict would reject.
+    """
+    caller_email = current_user_email(get_jwt_identity())
+    if caller_email is None:
+        return jsonify({"error": "User not found."}), 404
+
+    data = request.get_json(silent=True)
+    samples = data.get('samples') if isinstance(data, dict) else data
+    try:
+        default_email = keystroke_model_email(data.get('email') if isinstance(data, dict) else None, caller_email)
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not isinstance(samples, list) or not samples:
+        return jsonify({"error": "Invalid input: expected a non-empty array of samples."}), 400
+    if len(samples) > app.config['KEYSTROKE_BATCH_MAX_SAMPLES']:
+        return jsonify({"error": f"At most {app.config['KEYSTROKE_BATCH_MAX_SAMPLES']} samples per batch"}), 413
+
+    results: List[Optional[Dict]] = [None] * len(samples)
+    by_email: Dict[str, List[int]] = {}
+    for position, sample in enumerate(samples):
+        if not isinstance(sample, dict):
+            results[position] = {"error": "Each sample must be a JSON object."}
+            continue
+        try:
+            requested = sample.get('email')
+            email = default_email if requested in (None, '') else keystroke_model_email(requested, caller_email)
+        except (ValueError, PermissionError) as e:
+            results[position] = {"error": str(e)}
+            continue
+        by_email.setdefault(email, []).append(position)
+
+    for email, positions in by_email.items():
+        authenticator = keystroke_models.get(email)
+        if authenticator is None:
+            for position in positions:
+                results[position] = {"error": "No keystroke model is enrolled for this user."}
+            continue
+        scored = authenticator.predict_many([samples[position] for position in positions])
+        for position, result in zip(positions, scored):
+            results[position] = result
+
+    errors = sum(1 for result in results if 'error' in result)
+    return jsonify({"results": results, "scored": len(results) - errors, "errors": errors})
+
 @app.route('/api/behavior/analyze-session', methods=['POST'])
 @jwt_required()
 def analyze_user_session():
@@ -827,7 +830,7 @@ def analyze_user_session():
     session_events = data['events']
     
     # Get the user's email to find the correct profiler
-    conn = get_db()
+    conn = get_read_db(user_id)
     cursor = conn.cursor()
     cursor.execute("SELECT email FROM users WHERE id = ?", (user_id,))
     user = cursor.fetchone()
@@ -854,6 +857,87 @@ def analyze_user_session():
     except Exception as e:
         logging.error(f"Error during behavior prediction for {user_email}: {e}", exc_info=True)
         return jsonify({"error": f"An internal server error occurred during analysis: {e}"}), 500
+
+# Events a client can observe for itself. Logins, logouts and money movements are only
+# recorded by the endpoints that perform them.
+CLIENT_EVENT_TYPES = frozenset(['stocks_view', 'portfolio_view', 'fd_details_view', 'account_statement_view'])
+
+def client_event_row(event: Any, user_email: str, now_ms: int):
+    """Validate one client-reported event and build its user_events row; raises ValueError if it is invalid"""
+    if not isinstance(event, dict):
+        raise ValueError('event must be an object')
+    event_type = event.get('event_type')
+    if event_type not in CLIENT_EVENT_TYPES:
+        raise ValueError(f"event_type must be one of {', '.join(sorted(CLIENT_EVENT_TYPES))}: got {event_type!r}")
+
+    amount = event.get('transaction_amount', 0) or 0
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount != 0:
+        raise ValueError('transaction_amount must be 0 for client events')
+    for field in ('page_url', 'transaction_type'):
+        if event.get(field) is not None and not isinstance(event[field], str):
+            raise ValueError(f"{field} must be a string")
+
+    # Client clocks are only trusted within the last day and a few minutes ahead
+    time_ms = event.get('time_ms', now_ms)
+    if isinstance(time_ms, bool) or not isinstance(time_ms, int) or not now_ms - 86400000 <= time_ms <= now_ms + 300000:
+        raise ValueError('time_ms must be epoch milliseconds within the last 24 hours')
+
+    additional_data = event.get('additional_data')
+    if additional_data is not None and not isinstance(additional_data, str):
+        additional_data = json.dumps(additional_data)
+
+    moment = datetime.datetime.fromtimestamp(time_ms / 1000, datetime.timezone.utc)
+    return (ids.new_id(), user_email, event_type, moment.strftime('%Y-%m-%d %H:%M:%S'), event.get('page_url'),
+            float(amount), event.get('transaction_type'), additional_data, time_ms)
+
+@app.route('/api/events/batch', methods=['POST'])
+@jwt_required()
+def ingest_event_batch():
+    """
+    Record a batch of client-side events for the logged-in user. The body is
+    NDJSON (Content-Type: application/x-ndjson) or a JSON array. The batch is
+    all-or-nothing: one invalid event rejects it with per-event errors.
+    """
+    user_id = get_jwt_identity()
+    try:
+        events = parse_batch(request.get_data(as_text=True), request.mimetype)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f"Invalid event batch: {e}"}), 400
+
+    if not events:
+        return jsonify({'success': False, 'error': 'No events in batch'}), 400
+    if len(events) > app.config['EVENT_BATCH_MAX_EVENTS']:
+        return jsonify({'success': False,
+                        'error': f"At most {app.config['EVENT_BATCH_MAX_EVENTS']} events per batch"}), 413
+
+    conn = get_db(user_id)
+    try:
+        user = conn.execute("SELECT email FROM users WHERE id = ?", (user_id,)).fetchone()
+        if not user:
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+
+        now_ms = to_epoch_ms(datetime.datetime.now(datetime.timezone.utc))
+        rows = []
+        errors = []
+        for index, event in enumerate(events):
+            try:
+                rows.append(client_event_row(event, user['email'], now_ms))
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+        if errors:
+            return jsonify({'success': False, 'error': 'Invalid events in batch', 'errors': errors[:50]}), 400
+
+        # Always stored, never rolled up: these are the user's own events and the profiler counts them
+        partitions.insert_events(conn, rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+    for row in rows:
+        live_sessions.record(row)
+
+    return jsonify({'success': True, 'accepted': len(rows)}), 201
+
 @app.errorhandler(Exception)
 def handle_error(error):
     print(f"\n=== Error in API ===")
@@ -880,17 +964,16 @@ def biometric_login():
         password = data['password'].strip()
         keystroke_data = data['keystrokeData']
         
-        conn = get_db()
+        conn = get_db(shards.user_id_for_email(email))
         cursor = conn.cursor()
         
         # --- START OF FIX ---
 
         # 1. Find the user by email ONLY
-        cursor.execute("SELECT * FROM users WHERE email = ?", (email,))
-        user = cursor.fetchone()
+        user = repository.get_user_by_email(conn, email)
         
         # 2. Securely check the password hash
-        if not user or not check_password_hash(user['password'], password):
+        if not user or not check_password_hash(user.password, password):
             conn.close()
             # Track failed login attempt
             track_user_event(email, 'login_failed', '/login', 0, 'biometric', json.dumps({'reason': 'Invalid credentials'}))
@@ -899,9 +982,10 @@ def biometric_login():
         # --- END OF FIX ---
             
         # If password is correct, now proceed with biometric verification
+        authenticator = keystroke_models.get(user.email)
         if authenticator is None:
             conn.close()
-            return jsonify({'success': False, 'error': 'Biometric system not available'}), 500
+            return jsonify({'success': False, 'error': 'Biometric login is not set up for this account'}), 403
         
         try:
             biometric_result = authenticator.predict(keystroke_data)
@@ -910,7 +994,7 @@ def biometric_login():
             if biometric_result.get('status') == 'Anomaly' and biometric_result.get('anomaly_confidence_percent', 0) > 50:
                 conn.close()
                 # Track failed biometric attempt
-                track_user_event(user['email'], 'login_failed', '/login', 0, 'biometric', json.dumps({'reason': 'Biometric mismatch', 'confidence': biometric_result['anomaly_confidence_percent']}))
+                track_user_event(user.email, 'login_failed', '/login', 0, 'biometric', json.dumps({'reason': 'Biometric mismatch', 'confidence': biometric_result['anomaly_confidence_percent']}))
                 return jsonify({
                     'success': False, 
                     'error': 'Biometric verification failed. Your typing pattern does not match.',
@@ -918,33 +1002,26 @@ def biometric_login():
                 }), 401
             
             # Biometric check passed, complete the login
-            cursor.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user['id'],))
+            cursor.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user.id,))
             conn.commit()
             
             # Track successful login
-            track_user_event(user['email'], 'login_success', '/login', 0, 'biometric', json.dumps({'user_id': user['id']}))
+            track_user_event(user.email, 'login_success', '/login', 0, 'biometric', json.dumps({'user_id': user.id}))
 
-            token = create_access_token(identity=user['id'])
+            # Only samples the model is confident about go back into it
+            if biometric_result['status'] == 'Normal':
+                keystroke_trainer.add(user.email, authenticator, keystroke_data)
+
+            token = create_access_token(identity=user.id)
             
             # Fetch the updated user data to return the new last_login time
-            cursor.execute("SELECT * FROM users WHERE id = ?", (user['id'],))
-            updated_user = cursor.fetchone()
+            updated_user = repository.get_user(conn, user.id)
             conn.close()
 
             return jsonify({
                 'success': True,
                 'message': 'Biometric authentication successful',
-                'user': {
-                    'id': updated_user['id'],
-                    'email': updated_user['email'],
-                    'firstName': updated_user['first_name'],
-                    'lastName': updated_user['last_name'],
-                    'phone': updated_user['phone'],
-                    'balance': updated_user['balance'],
-                    'accountNumber': updated_user['account_number'],
-                    'createdAt': updated_user['created_at'],
-                    'lastLogin': updated_user['last_login']
-                },
+                'user': repository.serialize_user(updated_user),
                 'token': token,
                 'biometric_confidence': biometric_result['anomaly_confidence_percent']
             })
@@ -962,7 +1039,7 @@ def biometric_login():
 @jwt_required()
 def delete_biller(biller_id):
     user_id = get_jwt_identity()
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM billers WHERE id = ? AND user_id = ?", (biller_id, user_id))
     conn.commit()
@@ -973,7 +1050,7 @@ def delete_biller(biller_id):
 @jwt_required()
 def get_autopay_rules():
     user_id = get_jwt_identity()
-    conn = get_db()
+    conn = get_read_db(user_id)
     cursor = conn.cursor()
     # Join with billers to get details like nickname and provider
     cursor.execute('''
@@ -994,8 +1071,8 @@ def add_autopay_rule():
     if 'biller_id' not in data or 'max_amount' not in data:
         return jsonify({'success': False, 'error': 'Biller ID and max amount required'}), 400
 
-    rule_id = str(uuid.uuid4())
-    conn = get_db()
+    rule_id = ids.new_id()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     cursor.execute("INSERT INTO autopay_rules (id, user_id, biller_id, max_amount) VALUES (?, ?, ?, ?)",
                    (rule_id, user_id, data['biller_id'], float(data['max_amount'])))
@@ -1011,7 +1088,7 @@ def toggle_autopay_rule(rule_id):
     if 'enabled' not in data:
         return jsonify({'success': False, 'error': 'Enabled status required'}), 400
         
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     cursor.execute("UPDATE autopay_rules SET enabled = ? WHERE id = ? AND user_id = ?", 
                    (1 if data['enabled'] else 0, rule_id, user_id))
@@ -1023,7 +1100,7 @@ def toggle_autopay_rule(rule_id):
 @jwt_required()
 def delete_autopay_rule(rule_id):
     user_id = get_jwt_identity()
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM autopay_rules WHERE id = ? AND user_id = ?", (rule_id, user_id))
     conn.commit()
@@ -1052,37 +1129,41 @@ def register():
             if field not in data:
                 return jsonify({'success': False, 'error': f'Missing required field: {field}'}), 400
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Check if user already exists
-        cursor.execute("SELECT id FROM users WHERE email = ?", (data['email'],))
-        if cursor.fetchone():
-            conn.close()
-            return jsonify({'success': False, 'error': 'User already exists with this email'}), 400
-        
         # Create new user
-        user_id = str(uuid.uuid4())
+        user_id = ids.new_id()
         account_number = generate_account_number()
         
-        cursor.execute('''
-            INSERT INTO users (id, email, password, first_name, last_name, phone, account_number)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            data['email'],
-            generate_password_hash(data['password']),
-            data['firstName'],
-            data['lastName'],
-            data['phone'],
-            account_number
-        ))
+        # Check if user already exists: claiming the email in the common directory is the check across shards
+        try:
+            shards.register(data['email'], user_id)
+        except sqlite3.IntegrityError:
+            return jsonify({'success': False, 'error': 'User already exists with this email'}), 400
         
-        # Get the created user
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
+        conn = get_db(user_id)
+        cursor = conn.cursor()
         
-        conn.commit()
+        try:
+            cursor.execute('''
+                INSERT INTO users (id, email, password, first_name, last_name, phone, account_number)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                user_id,
+                data['email'],
+                generate_password_hash(data['password']),
+                data['firstName'],
+                data['lastName'],
+                data['phone'],
+                account_number
+            ))
+            
+            # Get the created user
+            user = repository.get_user(conn, user_id)
+            
+            conn.commit()
+        except Exception:
+            conn.close()
+            shards.unregister(data['email'], user_id)
+            raise
         conn.close()
         
         # Create access token
@@ -1091,17 +1172,7 @@ def register():
         return jsonify({
             'success': True,
             'message': 'User registered successfully',
-            'user': {
-                'id': user['id'],
-                'email': user['email'],
-                'firstName': user['first_name'],
-                'lastName': user['last_name'],
-                'phone': user['phone'],
-                'balance': user['balance'],
-                'accountNumber': user['account_number'],
-                'createdAt': user['created_at'],
-                'lastLogin': user['last_login']
-            },
+            'user': repository.serialize_user(user),
             'token': token
         }), 201
         
@@ -1118,43 +1189,32 @@ def login():
         if not data or 'email' not in data or 'password' not in data:
             return jsonify({'success': False, 'error': 'Email and password are required'}), 400
         
-        conn = get_db()
+        conn = get_db(shards.user_id_for_email(data['email']))
         cursor = conn.cursor()
         
         # Find user
-        cursor.execute("SELECT * FROM users WHERE email = ?", (data['email'],))
-        user = cursor.fetchone()
+        user = repository.get_user_by_email(conn, data['email'])
         
-        if not user or not check_password_hash(user['password'], data['password']):
+        if not user or not check_password_hash(user.password, data['password']):
             conn.close()
             return jsonify({'success': False, 'error': 'Invalid email or password'}), 401
         
         # Update last login
-        cursor.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user['id'],))
+        cursor.execute("UPDATE users SET last_login = CURRENT_TIMESTAMP WHERE id = ?", (user.id,))
         
         conn.commit()
         conn.close()
         
         # Track login event
-        track_user_event(user['email'], 'login', '/login', 0, None, json.dumps({'user_id': user['id']}))
+        track_user_event(user.email, 'login', '/login', 0, None, json.dumps({'user_id': user.id}))
         
         # Create access token
-        token = create_access_token(identity=user['id'])
+        token = create_access_token(identity=user.id)
         
         return jsonify({
             'success': True,
             'message': 'Login successful',
-            'user': {
-                'id': user['id'],
-                'email': user['email'],
-                'firstName': user['first_name'],
-                'lastName': user['last_name'],
-                'phone': user['phone'],
-                'balance': user['balance'],
-                'accountNumber': user['account_number'],
-                'createdAt': user['created_at'],
-                'lastLogin': user['last_login']
-            },
+            'user': repository.serialize_user(user),
             'token': token
         })
         
@@ -1166,7 +1226,7 @@ def login():
 @jwt_required()
 def get_registered_billers():
     user_id = get_jwt_identity()
-    conn = get_db()
+    conn = get_read_db(user_id)
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM billers WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
     billers = cursor.fetchall()
@@ -1187,8 +1247,8 @@ def add_biller():
     if not all(field in data for field in required_fields):
         return jsonify({'success': False, 'error': 'Missing required fields'}), 400
 
-    biller_id = str(uuid.uuid4())
-    conn = get_db()
+    biller_id = ids.new_id()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     cursor.execute('''
         INSERT INTO billers (id, user_id, provider_name, category, consumer_id, nickname)
@@ -1222,36 +1282,38 @@ def pay_bill():
     if amount <= 0:
         return jsonify({'success': False, 'error': 'Amount must be positive'}), 400
 
-    conn = get_db()
-    cursor = conn.cursor()
+    def apply(conn):
+        cursor = conn.cursor()
 
-    # Get user and biller details in one go
-    cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    cursor.execute("SELECT * FROM billers WHERE id = ? AND user_id = ?", (biller_id, user_id))
-    biller = cursor.fetchone()
+        # Get user and biller details in one go
+        cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
+        cursor.execute("SELECT * FROM billers WHERE id = ? AND user_id = ?", (biller_id, user_id))
+        biller = cursor.fetchone()
 
-    if not biller:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Biller not found or does not belong to user'}), 404
+        if not biller:
+            raise MutationError('Biller not found or does not belong to user', 404)
 
-    if user['balance'] < amount:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Insufficient balance'}), 400
+        if user['balance'] < amount:
+            raise MutationError('Insufficient balance')
 
-    # 1. Create the transaction record
-    transaction_id = str(uuid.uuid4())
-    description = f"Bill payment for {biller['nickname']} ({biller['provider_name']})"
-    cursor.execute('''
-        INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty)
-        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
-    ''', (transaction_id, user_id, 'BILL_PAYMENT', amount, description, 'COMPLETED', biller['provider_name']))
+        # 1. Create the transaction record
+        transaction_id = ids.new_id()
+        description = f"Bill payment for {biller['nickname']} ({biller['provider_name']})"
+        cursor.execute('''
+            INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+        ''', (transaction_id, user_id, 'BILL_PAYMENT', amount, description, 'COMPLETED', biller['provider_name']))
 
-    # 2. Deduct amount from user's balance
-    cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
-    
-    conn.commit()
-    conn.close()
+        # 2. Deduct amount from user's balance
+        cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
+
+        return user, biller
+
+    try:
+        user, biller = get_write_pipeline(user_id).execute(apply)
+    except MutationError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
 
     # Track the event
     track_user_event(user['email'], 'bill_payment', '/bills', amount, 'BILL_PAYMENT', json.dumps({'biller_id': biller_id}))
@@ -1280,31 +1342,34 @@ def process_recharge():
     if amount <= 0:
         return jsonify({'success': False, 'error': 'Amount must be positive'}), 400
 
-    conn = get_db()
-    cursor = conn.cursor()
+    def apply(conn):
+        cursor = conn.cursor()
 
-    # Get user details
-    cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
+        # Get user details
+        cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
 
-    if user['balance'] < amount:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Insufficient balance'}), 400
+        if user['balance'] < amount:
+            raise MutationError('Insufficient balance')
 
-    # Create recharge transaction
-    transaction_id = str(uuid.uuid4())
-    description = f"{plan_type.title()} Recharge - {provider} ({mobile_number})"
-    
-    cursor.execute('''
-        INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty, reference)
-        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
-    ''', (transaction_id, user_id, 'RECHARGE', amount, description, 'COMPLETED', provider, mobile_number))
+        # Create recharge transaction
+        transaction_id = ids.new_id()
+        description = f"{plan_type.title()} Recharge - {provider} ({mobile_number})"
+        
+        cursor.execute('''
+            INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty, reference)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
+        ''', (transaction_id, user_id, 'RECHARGE', amount, description, 'COMPLETED', provider, mobile_number))
 
-    # Deduct amount from user's balance
-    cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
-    
-    conn.commit()
-    conn.close()
+        # Deduct amount from user's balance
+        cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
+
+        return user, transaction_id
+
+    try:
+        user, transaction_id = get_write_pipeline(user_id).execute(apply)
+    except MutationError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
 
     # Track the event
     track_user_event(user['email'], 'recharge', '/recharge', amount, 'RECHARGE', 
@@ -1322,7 +1387,7 @@ def process_recharge():
 @jwt_required()
 def get_beneficiaries():
     user_id = get_jwt_identity()
-    conn = get_db()
+    conn = get_read_db(user_id)
     cursor = conn.cursor()
     cursor.execute("SELECT * FROM beneficiaries WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
     beneficiaries = cursor.fetchall()
@@ -1363,8 +1428,8 @@ def add_beneficiary():
     # Map frontend field to database field
     name = data['account_holder_name']
 
-    beneficiary_id = str(uuid.uuid4())
-    conn = get_db()
+    beneficiary_id = ids.new_id()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     
     # Check if beneficiary already exists
@@ -1413,7 +1478,7 @@ def add_beneficiary():
 @jwt_required()
 def delete_beneficiary(beneficiary_id):
     user_id = get_jwt_identity()
-    conn = get_db()
+    conn = get_db(user_id)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM beneficiaries WHERE id = ? AND user_id = ?", (beneficiary_id, user_id))
     conn.commit()
@@ -1436,27 +1501,28 @@ def transfer_own_account():
     if amount <= 0:
         return jsonify({'success': False, 'error': 'Amount must be positive'}), 400
 
-    conn = get_db()
-    cursor = conn.cursor()
+    def apply(conn):
+        cursor = conn.cursor()
 
-    # Get user details
-    cursor.execute("SELECT email FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
+        # Get user details
+        cursor.execute("SELECT email FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
 
-    # Create transaction record
-    transaction_id = str(uuid.uuid4())
-    description = f"Fund transfer to own account - Testing credit"
-    
-    cursor.execute('''
-        INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty)
-        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
-    ''', (transaction_id, user_id, 'TRANSFER_IN', amount, description, 'COMPLETED', 'Own Account'))
+        # Create transaction record
+        transaction_id = ids.new_id()
+        description = f"Fund transfer to own account - Testing credit"
+        
+        cursor.execute('''
+            INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+        ''', (transaction_id, user_id, 'TRANSFER_IN', amount, description, 'COMPLETED', 'Own Account'))
 
-    # Add amount to user's balance
-    cursor.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (amount, user_id))
-    
-    conn.commit()
-    conn.close()
+        # Add amount to user's balance
+        cursor.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (amount, user_id))
+
+        return user, transaction_id
+
+    user, transaction_id = get_write_pipeline(user_id).execute(apply)
 
     # Track the event
     track_user_event(user['email'], 'own_account_transfer', '/transfers', amount, 'TRANSFER_IN', 
@@ -1488,38 +1554,40 @@ def transfer_to_beneficiary():
     if amount <= 0:
         return jsonify({'success': False, 'error': 'Amount must be positive'}), 400
 
-    conn = get_db()
-    cursor = conn.cursor()
+    def apply(conn):
+        cursor = conn.cursor()
 
-    # Get user and beneficiary details
-    cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    cursor.execute("SELECT * FROM beneficiaries WHERE id = ? AND user_id = ?", (beneficiary_id, user_id))
-    beneficiary = cursor.fetchone()
+        # Get user and beneficiary details
+        cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
+        cursor.execute("SELECT * FROM beneficiaries WHERE id = ? AND user_id = ?", (beneficiary_id, user_id))
+        beneficiary = cursor.fetchone()
 
-    if not beneficiary:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Beneficiary not found'}), 404
+        if not beneficiary:
+            raise MutationError('Beneficiary not found', 404)
 
-    if user['balance'] < amount:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Insufficient balance'}), 400
+        if user['balance'] < amount:
+            raise MutationError('Insufficient balance')
 
-    # Create transaction record
-    transaction_id = str(uuid.uuid4())
-    description = f"{transfer_type} transfer to {beneficiary['name']} ({beneficiary['account_number'][-4:]})"
-    
-    cursor.execute('''
-        INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty, reference)
-        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
-    ''', (transaction_id, user_id, 'TRANSFER_OUT', -amount, description, 'COMPLETED', 
-          beneficiary['name'], remarks))
+        # Create transaction record
+        transaction_id = ids.new_id()
+        description = f"{transfer_type} transfer to {beneficiary['name']} ({beneficiary['account_number'][-4:]})"
+        
+        cursor.execute('''
+            INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty, reference)
+            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
+        ''', (transaction_id, user_id, 'TRANSFER_OUT', -amount, description, 'COMPLETED', 
+              beneficiary['name'], remarks))
 
-    # Deduct amount from user's balance
-    cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
-    
-    conn.commit()
-    conn.close()
+        # Deduct amount from user's balance
+        cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
+
+        return user, beneficiary, transaction_id
+
+    try:
+        user, beneficiary, transaction_id = get_write_pipeline(user_id).execute(apply)
+    except MutationError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
 
     # Track the event
     track_user_event(user['email'], 'beneficiary_transfer', '/transfers', amount, 'TRANSFER_OUT', 
@@ -1539,13 +1607,13 @@ def get_recent_transfers():
     user_id = get_jwt_identity()
     limit = int(request.args.get('limit', 10))
     
-    conn = get_db()
+    conn = get_read_db(user_id)
     cursor = conn.cursor()
     
     cursor.execute('''
         SELECT * FROM transactions 
-        WHERE user_id = ? AND type IN ('TRANSFER_IN', 'TRANSFER_OUT')
-        ORDER BY created_at DESC 
+        WHERE user_key = (SELECT user_key FROM users WHERE id = ?) AND type IN ('TRANSFER_IN', 'TRANSFER_OUT')
+        ORDER BY created_at_ms DESC 
         LIMIT ?
     ''', (user_id, limit))
     transfers = cursor.fetchall()
@@ -1578,118 +1646,33 @@ def get_profile():
     try:
         user_id = get_jwt_identity()
         
-        conn = get_db()
-        cursor = conn.cursor()
+        conn = get_read_db(user_id)
         
         # Get user
-        cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
+        user = repository.get_user(conn, user_id)
         
         if not user:
             conn.close()
             return jsonify({'success': False, 'error': 'User not found'}), 404
         
         # Get portfolio with current values
-        cursor.execute('''
-            SELECT p.*, s.price as current_price, s.name as stock_name
-            FROM portfolio p
-            JOIN stocks s ON p.symbol = s.symbol
-            WHERE p.user_id = ?
-        ''', (user_id,))
-        portfolio = cursor.fetchall()
-        
-        # Calculate portfolio summary
-        total_investment = sum(row['total_investment'] for row in portfolio)
-        total_value = sum(row['shares'] * row['current_price'] for row in portfolio)
-        total_gain_loss = total_value - total_investment
-        total_gain_loss_percent = (total_gain_loss / total_investment * 100) if total_investment > 0 else 0
+        portfolio = repository.list_holdings(conn, user_id)
         
         # Get recent transactions
-        cursor.execute('''
-            SELECT * FROM transactions 
-            WHERE user_id = ? 
-            ORDER BY created_at DESC 
-            LIMIT 10
-        ''', (user_id,))
-        transactions = cursor.fetchall()
+        transactions = repository.list_transactions(conn, user_id, limit=10)
         
         # Get fixed deposits
-        cursor.execute("SELECT * FROM fixed_deposits WHERE user_id = ?", (user_id,))
-        fixed_deposits = cursor.fetchall()
+        fixed_deposits = repository.list_fixed_deposits(conn, user_id)
         
         conn.close()
         
         return jsonify({
             'success': True,
-            'user': {
-                'id': user['id'],
-                'email': user['email'],
-                'firstName': user['first_name'],
-                'lastName': user['last_name'],
-                'phone': user['phone'],
-                'balance': user['balance'],
-                'accountNumber': user['account_number'],
-                'createdAt': user['created_at'],
-                'lastLogin': user['last_login']
-            },
-            'portfolio': [
-                {
-                    'id': row['id'],
-                    'userId': row['user_id'],
-                    'symbol': row['symbol'],
-                    'shares': row['shares'],
-                    'buyPrice': row['buy_price'],
-                    'totalInvestment': row['total_investment'],
-                    'purchaseDate': row['purchase_date'],
-                    'currentPrice': row['current_price'],
-                    'currentValue': row['shares'] * row['current_price'],
-                    'gainLoss': (row['shares'] * row['current_price']) - row['total_investment'],
-                    'gainLossPercent': ((row['shares'] * row['current_price'] - row['total_investment']) / row['total_investment'] * 100) if row['total_investment'] > 0 else 0,
-                    'name': row['stock_name']
-                }
-                for row in portfolio
-            ],
-            'portfolioSummary': {
-                'totalValue': round(total_value, 2),
-                'totalInvestment': round(total_investment, 2),
-                'totalGainLoss': round(total_gain_loss, 2),
-                'totalGainLossPercent': round(total_gain_loss_percent, 2),
-                'holdings': len(portfolio)
-            },
-            'recentTransactions': [
-                {
-                    'id': row['id'],
-                    'userId': row['user_id'],
-                    'type': row['type'],
-                    'symbol': row['symbol'],
-                    'shares': row['shares'],
-                    'amount': row['amount'],
-                    'price': row['price'],
-                    'description': row['description'],
-                    'status': row['status'],
-                    'createdAt': row['created_at'],
-                    'completedAt': row['completed_at'],
-                    'reference': row['reference'],
-                    'counterparty': row['counterparty']
-                }
-                for row in transactions
-            ],
-            'fixedDeposits': [
-                {
-                    'id': row['id'],
-                    'userId': row['user_id'],
-                    'amount': row['amount'],
-                    'interestRate': row['interest_rate'],
-                    'tenure': row['tenure'],
-                    'startDate': row['start_date'],
-                    'maturityDate': row['maturity_date'],
-                    'type': row['type'],
-                    'status': row['status'],
-                    'interestEarned': row['interest_earned'],
-                    'maturityAmount': row['maturity_amount']
-                }
-                for row in fixed_deposits
-            ]
+            'user': repository.serialize_user(user),
+            'portfolio': [repository.serialize_holding(row) for row in portfolio],
+            'portfolioSummary': repository.portfolio_summary(portfolio),
+            'recentTransactions': [repository.serialize_transaction(row) for row in transactions],
+            'fixedDeposits': [repository.serialize_fixed_deposit(row) for row in fixed_deposits]
         })
         
     except Exception as e:
@@ -1705,7 +1688,7 @@ def logout():
         user_id = get_jwt_identity()
         
         # Get user's email for event tracking
-        conn = get_db()
+        conn = get_db(user_id)
         cursor = conn.cursor()
         cursor.execute("SELECT email FROM users WHERE id = ?", (user_id,))
         user = cursor.fetchone()
@@ -1726,7 +1709,7 @@ def logout():
 @app.route('/api/stocks', methods=['GET'])
 def get_all_stocks():
     try:
-        conn = get_db()
+        conn = get_read_db()
         cursor = conn.cursor()
         
         cursor.execute("SELECT * FROM stocks ORDER BY symbol")
@@ -1763,7 +1746,7 @@ def get_all_stocks():
 @app.route('/api/stocks/<symbol>', methods=['GET'])
 def get_stock(symbol):
     try:
-        conn = get_db()
+        conn = get_read_db()
         cursor = conn.cursor()
         
         cursor.execute("SELECT * FROM stocks WHERE symbol = ?", (symbol.upper(),))
@@ -1809,72 +1792,74 @@ def buy_stock():
         if shares <= 0:
             return jsonify({'success': False, 'error': 'Shares must be positive'}), 400
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Get user details for tracking
-        cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        
-        # Get stock price
-        cursor.execute("SELECT * FROM stocks WHERE symbol = ?", (symbol,))
-        stock = cursor.fetchone()
-        
-        if not stock:
-            conn.close()
-            return jsonify({'success': False, 'error': 'Stock not found'}), 404
-        
-        total_cost = shares * stock['price']
-        
-        if user['balance'] < total_cost:
-            conn.close()
-            return jsonify({'success': False, 'error': 'Insufficient balance'}), 400
-        
-        # Create transaction
-        transaction_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO transactions (id, user_id, type, symbol, shares, amount, price, description, status, completed_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (
-            transaction_id,
-            user_id,
-            'BUY',
-            symbol,
-            shares,
-            total_cost,
-            stock['price'],
-            f'Bought {shares} shares of {symbol}',
-            'COMPLETED'
-        ))
-        
-        # Update user balance
-        cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (total_cost, user_id))
-        
-        # Update portfolio
-        cursor.execute("SELECT * FROM portfolio WHERE user_id = ? AND symbol = ?", (user_id, symbol))
-        existing = cursor.fetchone()
-        
-        if existing:
-            # Update existing holding
-            new_shares = existing['shares'] + shares
-            new_investment = existing['total_investment'] + total_cost
-            avg_price = new_investment / new_shares
-            
-            cursor.execute('''
-                UPDATE portfolio 
-                SET shares = ?, buy_price = ?, total_investment = ?
-                WHERE user_id = ? AND symbol = ?
-            ''', (new_shares, avg_price, new_investment, user_id, symbol))
-        else:
-            # Add new holding
-            portfolio_id = str(uuid.uuid4())
+        def apply(conn):
+            cursor = conn.cursor()
+
+            # Get user details for tracking
+            cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
+
+            # Get stock price
+            cursor.execute("SELECT * FROM stocks WHERE symbol = ?", (symbol,))
+            stock = cursor.fetchone()
+
+            if not stock:
+                raise MutationError('Stock not found', 404)
+
+            total_cost = shares * stock['price']
+
+            if user['balance'] < total_cost:
+                raise MutationError('Insufficient balance')
+
+            # Create transaction
+            transaction_id = ids.new_id()
             cursor.execute('''
-                INSERT INTO portfolio (id, user_id, symbol, shares, buy_price, total_investment)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (portfolio_id, user_id, symbol, shares, stock['price'], total_cost))
-        
-        conn.commit()
-        conn.close()
+                INSERT INTO transactions (id, user_id, type, symbol, shares, amount, price, description, status, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (
+                transaction_id,
+                user_id,
+                'BUY',
+                symbol,
+                shares,
+                total_cost,
+                stock['price'],
+                f'Bought {shares} shares of {symbol}',
+                'COMPLETED'
+            ))
+
+            # Update user balance
+            cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (total_cost, user_id))
+
+            # Update portfolio
+            cursor.execute("SELECT * FROM portfolio WHERE user_key = (SELECT user_key FROM users WHERE id = ?) AND symbol = ?", (user_id, symbol))
+            existing = cursor.fetchone()
+
+            if existing:
+                # Update existing holding
+                new_shares = existing['shares'] + shares
+                new_investment = existing['total_investment'] + total_cost
+                avg_price = new_investment / new_shares
+
+                cursor.execute('''
+                    UPDATE portfolio 
+                    SET shares = ?, buy_price = ?, total_investment = ?
+                    WHERE id = ?
+                ''', (new_shares, avg_price, new_investment, existing['id']))
+            else:
+                # Add new holding
+                portfolio_id = ids.new_id()
+                cursor.execute('''
+                    INSERT INTO portfolio (id, user_id, symbol, shares, buy_price, total_investment)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (portfolio_id, user_id, symbol, shares, stock['price'], total_cost))
+
+            return user, stock, total_cost, transaction_id
+
+        try:
+            user, stock, total_cost, transaction_id = get_write_pipeline(user_id).execute(apply)
+        except MutationError as e:
+            return jsonify({'success': False, 'error': e.message}), e.status
         
         # Track stock buy event
         track_user_event(user['email'], 'stock_buy', f'/stocks/{symbol}', total_cost, 'stock_trading', 
@@ -1910,69 +1895,71 @@ def sell_stock():
         if shares <= 0:
             return jsonify({'success': False, 'error': 'Shares must be positive'}), 400
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Get user details for tracking
-        cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        
-        # Get stock price
-        cursor.execute("SELECT * FROM stocks WHERE symbol = ?", (symbol,))
-        stock = cursor.fetchone()
-        
-        if not stock:
-            conn.close()
-            return jsonify({'success': False, 'error': 'Stock not found'}), 404
-        
-        # Check if user has enough shares
-        cursor.execute("SELECT * FROM portfolio WHERE user_id = ? AND symbol = ?", (user_id, symbol))
-        holding = cursor.fetchone()
-        
-        if not holding or holding['shares'] < shares:
-            conn.close()
-            return jsonify({'success': False, 'error': 'Insufficient shares'}), 400
-        
-        total_value = shares * stock['price']
-        
-        # Create transaction
-        transaction_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO transactions (id, user_id, type, symbol, shares, amount, price, description, status, completed_at)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (
-            transaction_id,
-            user_id,
-            'SELL',
-            symbol,
-            shares,
-            total_value,
-            stock['price'],
-            f'Sold {shares} shares of {symbol}',
-            'COMPLETED'
-        ))
-        
-        # Update user balance
-        cursor.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (total_value, user_id))
-        
-        # Update portfolio
-        remaining_shares = holding['shares'] - shares
-        if remaining_shares == 0:
-            # Remove completely
-            cursor.execute("DELETE FROM portfolio WHERE user_id = ? AND symbol = ?", (user_id, symbol))
-        else:
-            # Reduce shares
-            sold_investment = (holding['total_investment'] / holding['shares']) * shares
-            remaining_investment = holding['total_investment'] - sold_investment;
-            
+        def apply(conn):
+            cursor = conn.cursor()
+
+            # Get user details for tracking
+            cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
+
+            # Get stock price
+            cursor.execute("SELECT * FROM stocks WHERE symbol = ?", (symbol,))
+            stock = cursor.fetchone()
+
+            if not stock:
+                raise MutationError('Stock not found', 404)
+
+            # Check if user has enough shares
+            cursor.execute("SELECT * FROM portfolio WHERE user_key = (SELECT user_key FROM users WHERE id = ?) AND symbol = ?", (user_id, symbol))
+            holding = cursor.fetchone()
+
+            if not holding or holding['shares'] < shares:
+                raise MutationError('Insufficient shares')
+
+            total_value = shares * stock['price']
+
+            # Create transaction
+            transaction_id = ids.new_id()
             cursor.execute('''
-                UPDATE portfolio 
-                SET shares = ?, total_investment = ?
-                WHERE user_id = ? AND symbol = ?
-            ''', (remaining_shares, remaining_investment, user_id, symbol))
-        
-        conn.commit()
-        conn.close()
+                INSERT INTO transactions (id, user_id, type, symbol, shares, amount, price, description, status, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (
+                transaction_id,
+                user_id,
+                'SELL',
+                symbol,
+                shares,
+                total_value,
+                stock['price'],
+                f'Sold {shares} shares of {symbol}',
+                'COMPLETED'
+            ))
+
+            # Update user balance
+            cursor.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (total_value, user_id))
+
+            # Update portfolio
+            remaining_shares = holding['shares'] - shares
+            if remaining_shares == 0:
+                # Remove completely
+                cursor.execute("DELETE FROM portfolio WHERE user_key = (SELECT user_key FROM users WHERE id = ?) AND symbol = ?", (user_id, symbol))
+            else:
+                # Reduce shares
+                sold_investment = (holding['total_investment'] / holding['shares']) * shares
+                remaining_investment = holding['total_investment'] - sold_investment;
+
+                cursor.execute('''
+                    UPDATE portfolio 
+                    SET shares = ?, total_investment = ?
+                    WHERE id = ?
+                ''', (remaining_shares, remaining_investment, holding['id']))
+
+            return user, stock, total_value, transaction_id
+
+        try:
+            user, stock, total_value, transaction_id = get_write_pipeline(user_id).execute(apply)
+        except MutationError as e:
+            return jsonify({'success': False, 'error': e.message}), e.status
         
         # Track stock sell event
         track_user_event(user['email'], 'stock_sell', f'/stocks/{symbol}', total_value, 'stock_trading', 
@@ -1999,7 +1986,7 @@ def get_portfolio():
     try:
         user_id = get_jwt_identity()
         
-        conn = get_db()
+        conn = get_read_db(user_id)
         cursor = conn.cursor()
         
         # Get user email for tracking
@@ -2007,52 +1994,21 @@ def get_portfolio():
         user = cursor.fetchone()
         
         # Get portfolio with current values
-        cursor.execute('''
-            SELECT p.*, s.price as current_price, s.name as stock_name
-            FROM portfolio p
-            JOIN stocks s ON p.symbol = s.symbol
-            WHERE p.user_id = ?
-        ''', (user_id,))
-        portfolio = cursor.fetchall()
+        portfolio = repository.list_holdings(conn, user_id)
         
         # Calculate summary
-        total_investment = sum(row['total_investment'] for row in portfolio)
-        total_value = sum(row['shares'] * row['current_price'] for row in portfolio)
-        total_gain_loss = total_value - total_investment
-        total_gain_loss_percent = (total_gain_loss / total_investment * 100) if total_investment > 0 else 0
+        summary = repository.portfolio_summary(portfolio)
         
         conn.close()
         
         # Track portfolio view event
         track_user_event(user['email'], 'portfolio_view', '/portfolio', 0, 'portfolio_view', 
-                        json.dumps({'total_value': total_value, 'total_investment': total_investment, 'holdings': len(portfolio)}))
+                        json.dumps({'total_value': summary['totalValue'], 'total_investment': summary['totalInvestment'], 'holdings': len(portfolio)}))
         
         return jsonify({
             'success': True,
-            'portfolio': [
-                {
-                    'id': row['id'],
-                    'userId': row['user_id'],
-                    'symbol': row['symbol'],
-                    'shares': row['shares'],
-                    'buyPrice': row['buy_price'],
-                    'totalInvestment': row['total_investment'],
-                    'purchaseDate': row['purchase_date'],
-                    'currentPrice': row['current_price'],
-                    'currentValue': row['shares'] * row['current_price'],
-                    'gainLoss': (row['shares'] * row['current_price']) - row['total_investment'],
-                    'gainLossPercent': ((row['shares'] * row['current_price'] - row['total_investment']) / row['total_investment'] * 100) if row['total_investment'] > 0 else 0,
-                    'name': row['stock_name']
-                }
-                for row in portfolio
-            ],
-            'summary': {
-                'totalValue': round(total_value, 2),
-                'totalInvestment': round(total_investment, 2),
-                'totalGainLoss': round(total_gain_loss, 2),
-                'totalGainLossPercent': round(total_gain_loss_percent, 2),
-                'holdings': len(portfolio)
-            }
+            'portfolio': [repository.serialize_holding(row) for row in portfolio],
+            'summary': summary
         })
         
     except Exception as e:
@@ -2068,44 +2024,13 @@ def get_transactions():
         offset = int(request.args.get('offset', 0))
         transaction_type = request.args.get('type', '')
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        query = "SELECT * FROM transactions WHERE user_id = ?"
-        params = [user_id]
-        
-        if transaction_type:
-            query += " AND type = ?"
-            params.append(transaction_type)
-        
-        query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
-        params.extend([limit, offset])
-        
-        cursor.execute(query, params)
-        transactions = cursor.fetchall()
-        
+        conn = get_read_db(user_id)
+        transactions = repository.list_transactions(conn, user_id, limit, offset, transaction_type)
         conn.close()
         
         return jsonify({
             'success': True,
-            'transactions': [
-                {
-                    'id': row['id'],
-                    'userId': row['user_id'],
-                    'type': row['type'],
-                    'symbol': row['symbol'],
-                    'shares': row['shares'],
-                    'amount': row['amount'],
-                    'price': row['price'],
-                    'description': row['description'],
-                    'status': row['status'],
-                    'createdAt': row['created_at'],
-                    'completedAt': row['completed_at'],
-                    'reference': row['reference'],
-                    'counterparty': row['counterparty']
-                }
-                for row in transactions
-            ]
+            'transactions': [repository.serialize_transaction(row) for row in transactions]
         })
         
     except Exception as e:
@@ -2127,7 +2052,7 @@ def get_current_session_events():
     try:
         user_id = get_jwt_identity()
         
-        conn = get_db()
+        conn = get_read_db(user_id)
         cursor = conn.cursor()
         
         # 1. Get user's email for the query
@@ -2139,30 +2064,27 @@ def get_current_session_events():
         
         user_email = user['email']
 
-        # 2. Find the timestamp of the most recent 'login_success' event for this user
-        cursor.execute("""
-            SELECT MAX(time) 
-            FROM user_events 
-            WHERE user_email = ? AND event_type = 'login_success'
-        """, (user_email,))
-        last_login_time_row = cursor.fetchone()
+        # 2. Served from memory while this process has seen the session since its login
+        session_events = live_sessions.current(user_email)
+        if session_events is not None:
+            conn.close()
+            return jsonify({'success': True, 'session_events': session_events})
+
+        # 3. Otherwise find the timestamp of the most recent 'login_success' event for this user,
+        #    searching the newest monthly partition first
+        last_login_time = partitions.last_event_ms(conn, user_email, 'login_success')
 
         # If the user has never logged in (or events were cleared), return empty
-        if not last_login_time_row or not last_login_time_row[0]:
+        if not last_login_time:
             conn.close()
             return jsonify({'success': True, 'session_events': []})
-
-        last_login_time = last_login_time_row[0]
         
-        # 3. Fetch all events that occurred since the last login
-        query = """
-            SELECT id, event_type, time, page_url, transaction_amount, additional_data
-            FROM user_events 
-            WHERE user_email = ? AND time >= ?
-            ORDER BY time ASC
-        """
-        cursor.execute(query, (user_email, last_login_time))
-        session_events = [dict(row) for row in cursor.fetchall()]
+        # 4. Fetch all events that occurred since the last login, from the partitions that can hold them,
+        #    and keep them in memory for the next call
+        session_events = [dict(row) for row in partitions.events_since(conn, user_email, last_login_time)]
+        live_sessions.seed(user_email, last_login_time, session_events)
+        for event in session_events:
+            del event['time_ms']
         
         conn.close()
             
@@ -2174,6 +2096,58 @@ def get_current_session_events():
     except Exception as e:
         logging.error(f"Error getting current session: {e}", exc_info=True)
         return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/behavior/activity', methods=['GET'])
+@jwt_required()
+def get_activity():
+    """
+    Event counts and transaction amounts for the logged-in user per hour or
+    per day (?granularity=hour|day) over the last ?days days, read from the
+    activity rollups rather than raw events.
+    """
+    try:
+        user_id = get_jwt_identity()
+        granularity = request.args.get('granularity', 'day')
+        if granularity not in activity.GRANULARITIES:
+            return jsonify({'success': False, 'error': 'granularity must be hour or day'}), 400
+        try:
+            days = int(request.args.get('days', 30))
+        except ValueError:
+            return jsonify({'success': False, 'error': 'days must be a whole number'}), 400
+        max_days = activity.MAX_RANGE_DAYS[granularity]
+        if not 1 <= days <= max_days:
+            return jsonify({'success': False, 'error': f"days must be between 1 and {max_days}"}), 400
+
+        conn = get_read_db(user_id)
+        user = conn.execute("SELECT email FROM users WHERE id = ?", (user_id,)).fetchone()
+        if not user:
+            conn.close()
+            return jsonify({'success': False, 'error': 'User not found'}), 404
+
+        end_ms = to_epoch_ms(datetime.datetime.now(datetime.timezone.utc))
+        rows = activity.user_activity(conn, user['email'], granularity, end_ms - days * activity.DAY_MS, end_ms)
+        conn.close()
+
+        buckets = []
+        for bucket_ms, event_type, event_count, amount_sum in rows:
+            if not buckets or buckets[-1]['bucket_ms'] != bucket_ms:
+                buckets.append({
+                    'bucket_ms': bucket_ms,
+                    'start': datetime.datetime.fromtimestamp(bucket_ms / 1000, datetime.timezone.utc).isoformat(),
+                    'event_count': 0,
+                    'amount_sum': 0.0,
+                    'events': {}
+                })
+            bucket = buckets[-1]
+            bucket['event_count'] += event_count
+            bucket['amount_sum'] += amount_sum
+            bucket['events'][event_type] = event_count
+
+        return jsonify({'success': True, 'granularity': granularity, 'buckets': buckets})
+
+    except Exception as e:
+        logging.error(f"Error getting activity: {e}", exc_info=True)
+        return jsonify({'success': False, 'error': str(e)}), 500
     
 
 
@@ -2193,32 +2167,13 @@ def get_fixed_deposits():
     try:
         user_id = get_jwt_identity()
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM fixed_deposits WHERE user_id = ? ORDER BY created_at DESC", (user_id,))
-        fixed_deposits = cursor.fetchall()
-        
+        conn = get_read_db(user_id)
+        fixed_deposits = repository.list_fixed_deposits(conn, user_id)
         conn.close()
         
         return jsonify({
             'success': True,
-            'fixedDeposits': [
-                {
-                    'id': row['id'],
-                    'userId': row['user_id'],
-                    'amount': row['amount'],
-                    'interestRate': row['interest_rate'],
-                    'tenure': row['tenure'],
-                    'startDate': row['start_date'],
-                    'maturityDate': row['maturity_date'],
-                    'type': row['type'],
-                    'status': row['status'],
-                    'interestEarned': row['interest_earned'],
-                    'maturityAmount': row['maturity_amount']
-                }
-                for row in fixed_deposits
-            ]
+            'fixedDeposits': [repository.serialize_fixed_deposit(row) for row in fixed_deposits]
         })
         
     except Exception as e:
@@ -2261,43 +2216,47 @@ def create_fixed_deposit():
         start_date = datetime.datetime.now()
         maturity_date = start_date + datetime.timedelta(days=tenure * 30)
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Get user details for tracking
-        cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        
-        if user['balance'] < amount:
-            conn.close()
-            return jsonify({'success': False, 'error': 'Insufficient balance'}), 400
-        
-        # Create fixed deposit
-        fd_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO fixed_deposits (id, user_id, amount, interest_rate, tenure, start_date, maturity_date, type, maturity_amount)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (fd_id, user_id, amount, interest_rate, tenure, start_date, maturity_date, fd_type, maturity_amount))
-        
-        # Deduct amount from user balance
-        cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
-        
-        # Create transaction
-        transaction_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at)
-            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ''', (
-            transaction_id,
-            user_id,
-            'DEPOSIT',
-            amount,
-            f'Fixed Deposit created - {fd_type} for {tenure} months',
-            'COMPLETED'
-        ))
-        
-        conn.commit()
-        conn.close()
+        def apply(conn):
+            cursor = conn.cursor()
+
+            # Get user details for tracking
+            cursor.execute("SELECT balance, email FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
+
+            if user['balance'] < amount:
+                raise MutationError('Insufficient balance')
+
+            # Create fixed deposit
+            fd_id = ids.new_id()
+            cursor.execute('''
+                INSERT INTO fixed_deposits (id, user_id, amount, interest_rate, tenure, start_date, maturity_date, type, maturity_amount)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (fd_id, user_id, amount, interest_rate, tenure, start_date.isoformat(' '), maturity_date.isoformat(' '),
+                  fd_type, maturity_amount))
+
+            # Deduct amount from user balance
+            cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
+
+            # Create transaction
+            transaction_id = ids.new_id()
+            cursor.execute('''
+                INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+            ''', (
+                transaction_id,
+                user_id,
+                'DEPOSIT',
+                amount,
+                f'Fixed Deposit created - {fd_type} for {tenure} months',
+                'COMPLETED'
+            ))
+
+            return user, fd_id
+
+        try:
+            user, fd_id = get_write_pipeline(user_id).execute(apply)
+        except MutationError as e:
+            return jsonify({'success': False, 'error': e.message}), e.status
         
         # Track FD creation event
         track_user_event(user['email'], 'fd_created', '/fixed-deposits', amount, 'fd_creation', 
@@ -2328,7 +2287,7 @@ def get_fd_details(fd_id):
     try:
         user_id = get_jwt_identity()
         
-        conn = get_db()
+        conn = get_read_db(user_id)
         cursor = conn.cursor()
         
         # Get user email for event tracking
@@ -2380,7 +2339,7 @@ def get_fd_certificate(fd_id):
     try:
         user_id = get_jwt_identity()
         
-        conn = get_db()
+        conn = get_read_db(user_id)
         cursor = conn.cursor()
         
         # Get user email for event tracking
@@ -2436,7 +2395,7 @@ def export_fixed_deposits():
     try:
         user_id = get_jwt_identity()
         
-        conn = get_db()
+        conn = get_read_db(user_id)
         cursor = conn.cursor()
         
         # Get user email for event tracking
@@ -2449,7 +2408,7 @@ def export_fixed_deposits():
             FROM fixed_deposits fd
             JOIN users u ON fd.user_id = u.id
             WHERE fd.user_id = ?
-            ORDER BY fd.created_at DESC
+            ORDER BY fd.created_at_ms DESC
         """, (user_id,))
         fixed_deposits = cursor.fetchall()
         
@@ -2518,38 +2477,41 @@ def create_transfer():
         if amount <= 0:
             return jsonify({'success': False, 'error': 'Amount must be positive'}), 400
         
-        conn = get_db()
-        cursor = conn.cursor()
-        
-        # Check user balance
-        cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
-        user = cursor.fetchone()
-        
-        if user['balance'] < amount:
-            conn.close()
-            return jsonify({'success': False, 'error': 'Insufficient balance'}), 400
-        
-        # Create transfer transaction
-        transaction_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, reference, counterparty)
-            VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
-        ''', (
-            transaction_id,
-            user_id,
-            'TRANSFER_OUT',
-            amount,
-            f'Transfer to {recipient}',
-            'COMPLETED',
-            reference,
-            recipient
-        ))
-        
-        # Deduct amount from user balance
-        cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
-        
-        conn.commit()
-        conn.close()
+        def apply(conn):
+            cursor = conn.cursor()
+
+            # Check user balance
+            cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
+            user = cursor.fetchone()
+
+            if user['balance'] < amount:
+                raise MutationError('Insufficient balance')
+
+            # Create transfer transaction
+            transaction_id = ids.new_id()
+            cursor.execute('''
+                INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, reference, counterparty)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
+            ''', (
+                transaction_id,
+                user_id,
+                'TRANSFER_OUT',
+                amount,
+                f'Transfer to {recipient}',
+                'COMPLETED',
+                reference,
+                recipient
+            ))
+
+            # Deduct amount from user balance
+            cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
+
+            return transaction_id
+
+        try:
+            transaction_id = get_write_pipeline(user_id).execute(apply)
+        except MutationError as e:
+            return jsonify({'success': False, 'error': e.message}), e.status
         
         return jsonify({
             'success': True,
@@ -2576,75 +2538,52 @@ def get_account_statement():
         statement_period = request.args.get('period', 'byDate')
         records_per_page = request.args.get('records_per_page', 'ALL')
         
-        conn = get_db()
+        try:
+            start_ms, end_ms = statement_bounds_ms(statement_period, start_date, end_date)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        conn = get_read_db(user_id)
         cursor = conn.cursor()
         
         # Get user email for tracking
         cursor.execute("SELECT email FROM users WHERE id = ?", (user_id,))
         user = cursor.fetchone()
         
-        # Build query based on period
-        query = """
-            SELECT t.*, u.account_number 
-            FROM transactions t
-            JOIN users u ON t.user_id = u.id
-            WHERE t.user_id = ?
-        """
-        params = [user_id]
-        
-        if statement_period == 'byDate' and start_date and end_date:
-            query += " AND DATE(t.created_at) BETWEEN ? AND ?"
-            params.extend([start_date, end_date])
-        elif statement_period == 'last6Months':
-            query += " AND t.created_at >= datetime('now', '-6 months')"
-        elif statement_period == 'financialYear':
-            # Current financial year (April to March)
-            current_year = datetime.datetime.now().year
-            if datetime.datetime.now().month < 4:
-                fy_start = f"{current_year-1}-04-01"
-                fy_end = f"{current_year}-03-31"
-            else:
-                fy_start = f"{current_year}-04-01"
-                fy_end = f"{current_year+1}-03-31"
-            query += " AND DATE(t.created_at) BETWEEN ? AND ?"
-            params.extend([fy_start, fy_end])
-        
-        query += " ORDER BY t.created_at DESC"
-        
+        limit = -1
         if records_per_page != 'ALL':
             try:
                 limit = int(records_per_page)
-                query += " LIMIT ?"
-                params.append(limit)
             except ValueError:
                 pass
         
-        cursor.execute(query, params)
-        transactions = cursor.fetchall()
+        # Older periods also read the monthly archive files
+        transactions = archive.list_statement_transactions(conn, shards.path_for(user_id), user_id,
+                                                           start_ms, end_ms, limit)
         
         # Calculate running balance
         balance = 125430.50  # Starting balance
         statement_entries = []
         
         for transaction in transactions:
-            if transaction['type'] in ['TRANSFER_IN', 'DEPOSIT']:
-                balance += transaction['amount']
+            if transaction.type in ['TRANSFER_IN', 'DEPOSIT']:
+                balance += transaction.amount
                 debit = '-'
-                credit = f"₹{transaction['amount']:,.2f}"
+                credit = f"₹{transaction.amount:,.2f}"
             else:
-                balance -= transaction['amount']
-                debit = f"₹{transaction['amount']:,.2f}"
+                balance -= transaction.amount
+                debit = f"₹{transaction.amount:,.2f}"
                 credit = '-'
             
             statement_entries.append({
-                'date': transaction['created_at'],
-                'description': transaction['description'],
+                'date': transaction.created_at,
+                'description': transaction.description,
                 'debit': debit,
                 'credit': credit,
                 'balance': f"₹{balance:,.2f}",
-                'type': transaction['type'],
-                'amount': transaction['amount'],
-                'status': transaction['status']
+                'type': transaction.type,
+                'amount': transaction.amount,
+                'status': transaction.status
             })
         
         conn.close()
@@ -2679,8 +2618,12 @@ def export_account_statement():
         start_date = data.get('start_date')
         end_date = data.get('end_date')
         statement_period = data.get('period', 'byDate')
+        try:
+            start_ms, end_ms = statement_bounds_ms(statement_period, start_date, end_date)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        conn = get_db()
+        conn = get_read_db(user_id)
         cursor = conn.cursor()
         
         # Get user details for tracking
@@ -2688,33 +2631,8 @@ def export_account_statement():
         user = cursor.fetchone()
         
         # Get statement data (same logic as above)
-        query = """
-            SELECT t.*, u.account_number 
-            FROM transactions t
-            JOIN users u ON t.user_id = u.id
-            WHERE t.user_id = ?
-        """
-        params = [user_id]
-        
-        if statement_period == 'byDate' and start_date and end_date:
-            query += " AND DATE(t.created_at) BETWEEN ? AND ?"
-            params.extend([start_date, end_date])
-        elif statement_period == 'last6Months':
-            query += " AND t.created_at >= datetime('now', '-6 months')"
-        elif statement_period == 'financialYear':
-            current_year = datetime.datetime.now().year
-            if datetime.datetime.now().month < 4:
-                fy_start = f"{current_year-1}-04-01"
-                fy_end = f"{current_year}-03-31"
-            else:
-                fy_start = f"{current_year}-04-01"
-                fy_end = f"{current_year+1}-03-31"
-            query += " AND DATE(t.created_at) BETWEEN ? AND ?"
-            params.extend([fy_start, fy_end])
-        
-        query += " ORDER BY t.created_at DESC"
-        cursor.execute(query, params)
-        transactions = cursor.fetchall()
+        transactions = archive.list_statement_transactions(conn, shards.path_for(user_id), user_id,
+                                                           start_ms, end_ms)
         
         conn.close()
         
@@ -2729,11 +2647,11 @@ def export_account_statement():
             'format': export_format,
             'transactions': [
                 {
-                    'date': t['created_at'],
-                    'description': t['description'],
-                    'type': t['type'],
-                    'amount': t['amount'],
-                    'status': t['status']
+                    'date': t.created_at,
+                    'description': t.description,
+                    'type': t.type,
+                    'amount': t.amount,
+                    'status': t.status
                 }
                 for t in transactions
             ]
@@ -2769,19 +2687,17 @@ def pay_direct_tax():
     if amount <= 0:
         return jsonify({'success': False, 'error': 'Amount must be greater than 0'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Check user balance
-    cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    if not user or user['balance'] < amount:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Insufficient balance'}), 400
-    
-    try:
+    def apply(conn):
+        cursor = conn.cursor()
+        
+        # Check user balance
+        cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
+        if not user or user['balance'] < amount:
+            raise MutationError('Insufficient balance')
+        
         # Create transaction
-        transaction_id = str(uuid.uuid4())
+        transaction_id = ids.new_id()
         cursor.execute('''
             INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty, reference)
             VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
@@ -2795,7 +2711,7 @@ def pay_direct_tax():
         cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
         
         # Create tax payment record
-        tax_payment_id = str(uuid.uuid4())
+        tax_payment_id = ids.new_id()
         cursor.execute('''
             INSERT INTO tax_payments (id, user_id, transaction_id, tax_type, pan_tan, assessment_year, 
                                     tax_applicable, payment_type, amount, status, created_at)
@@ -2804,23 +2720,23 @@ def pay_direct_tax():
             tax_payment_id, user_id, transaction_id, 'DIRECT', data['pan'], 
             data['assessmentYear'], data['taxType'], data['paymentType'], amount, 'COMPLETED'
         ))
-        
-        conn.commit()
-        track_user_event(data['email'], 'tax_payment_direct', '/tax/direct', amount, 'tax_payment', 
-                         json.dumps({'pan': data['pan'], 'assessmentYear': data['assessmentYear']}))
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'message': 'Direct tax payment successful',
-            'transaction_id': transaction_id,
-            'tax_payment_id': tax_payment_id
-        })
-        
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        return jsonify({'success': False, 'error': str(e)}), 500
+
+        return transaction_id, tax_payment_id
+
+    try:
+        transaction_id, tax_payment_id = get_write_pipeline(user_id).execute(apply)
+    except MutationError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
+
+    track_user_event(data['email'], 'tax_payment_direct', '/tax/direct', amount, 'tax_payment', 
+                     json.dumps({'pan': data['pan'], 'assessmentYear': data['assessmentYear']}))
+    
+    return jsonify({
+        'success': True,
+        'message': 'Direct tax payment successful',
+        'transaction_id': transaction_id,
+        'tax_payment_id': tax_payment_id
+    })
 
 @app.route('/api/tax/gst', methods=['POST'])
 @jwt_required()
@@ -2837,19 +2753,17 @@ def pay_gst():
     if amount <= 0:
         return jsonify({'success': False, 'error': 'Amount must be greater than 0'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Check user balance
-    cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    if not user or user['balance'] < amount:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Insufficient balance'}), 400
-    
-    try:
+    def apply(conn):
+        cursor = conn.cursor()
+        
+        # Check user balance
+        cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
+        if not user or user['balance'] < amount:
+            raise MutationError('Insufficient balance')
+        
         # Create transaction
-        transaction_id = str(uuid.uuid4())
+        transaction_id = ids.new_id()
         cursor.execute('''
             INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty, reference)
             VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
@@ -2863,7 +2777,7 @@ def pay_gst():
         cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
         
         # Create tax payment record
-        tax_payment_id = str(uuid.uuid4())
+        tax_payment_id = ids.new_id()
         cursor.execute('''
             INSERT INTO tax_payments (id, user_id, transaction_id, tax_type, gstin, cpin, 
                                     cgst, sgst, igst, cess, amount, status, created_at)
@@ -2873,21 +2787,20 @@ def pay_gst():
             data.get('cgst', 0), data.get('sgst', 0), data.get('igst', 0), data.get('cess', 0),
             amount, 'COMPLETED'
         ))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'message': 'GST payment successful',
-            'transaction_id': transaction_id,
-            'tax_payment_id': tax_payment_id
-        })
-        
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        return jsonify({'success': False, 'error': str(e)}), 500
+
+        return transaction_id, tax_payment_id
+
+    try:
+        transaction_id, tax_payment_id = get_write_pipeline(user_id).execute(apply)
+    except MutationError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
+    
+    return jsonify({
+        'success': True,
+        'message': 'GST payment successful',
+        'transaction_id': transaction_id,
+        'tax_payment_id': tax_payment_id
+    })
 
 @app.route('/api/tax/state', methods=['POST'])
 @jwt_required()
@@ -2904,19 +2817,17 @@ def pay_state_tax():
     if amount <= 0:
         return jsonify({'success': False, 'error': 'Amount must be greater than 0'}), 400
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    # Check user balance
-    cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    if not user or user['balance'] < amount:
-        conn.close()
-        return jsonify({'success': False, 'error': 'Insufficient balance'}), 400
-    
-    try:
+    def apply(conn):
+        cursor = conn.cursor()
+        
+        # Check user balance
+        cursor.execute("SELECT balance FROM users WHERE id = ?", (user_id,))
+        user = cursor.fetchone()
+        if not user or user['balance'] < amount:
+            raise MutationError('Insufficient balance')
+        
         # Create transaction
-        transaction_id = str(uuid.uuid4())
+        transaction_id = ids.new_id()
         cursor.execute('''
             INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at, counterparty, reference)
             VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
@@ -2930,7 +2841,7 @@ def pay_state_tax():
         cursor.execute("UPDATE users SET balance = balance - ? WHERE id = ?", (amount, user_id))
         
         # Create tax payment record
-        tax_payment_id = str(uuid.uuid4())
+        tax_payment_id = ids.new_id()
         cursor.execute('''
             INSERT INTO tax_payments (id, user_id, transaction_id, tax_type, state, municipality, 
                                     service_type, consumer_id, amount, status, created_at)
@@ -2939,21 +2850,20 @@ def pay_state_tax():
             tax_payment_id, user_id, transaction_id, 'STATE', data['state'], 
             data['municipality'], data['service'], data['consumerId'], amount, 'COMPLETED'
         ))
-        
-        conn.commit()
-        conn.close()
-        
-        return jsonify({
-            'success': True,
-            'message': 'State tax payment successful',
-            'transaction_id': transaction_id,
-            'tax_payment_id': tax_payment_id
-        })
-        
-    except Exception as e:
-        conn.rollback()
-        conn.close()
-        return jsonify({'success': False, 'error': str(e)}), 500
+
+        return transaction_id, tax_payment_id
+
+    try:
+        transaction_id, tax_payment_id = get_write_pipeline(user_id).execute(apply)
+    except MutationError as e:
+        return jsonify({'success': False, 'error': e.message}), e.status
+    
+    return jsonify({
+        'success': True,
+        'message': 'State tax payment successful',
+        'transaction_id': transaction_id,
+        'tax_payment_id': tax_payment_id
+    })
 
 @app.route('/api/tax/history', methods=['GET'])
 @jwt_required()
@@ -2961,23 +2871,13 @@ def get_tax_history():
     """Get tax payment history"""
     user_id = get_jwt_identity()
     
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT tp.*, t.created_at as payment_date, t.description, t.counterparty
-        FROM tax_payments tp
-        JOIN transactions t ON tp.transaction_id = t.id
-        WHERE tp.user_id = ?
-        ORDER BY tp.created_at DESC
-    ''', (user_id,))
-    
-    tax_payments = cursor.fetchall()
+    conn = get_read_db(user_id)
+    tax_payments = archive.list_tax_payments(conn, shards.path_for(user_id), user_id)
     conn.close()
     
     return jsonify({
         'success': True,
-        'tax_payments': [dict(row) for row in tax_payments]
+        'tax_payments': [repository.serialize_tax_payment(row) for row in tax_payments]
     })
 
 @app.route('/api/tax/download-challan/<string:tax_payment_id>', methods=['GET'])
@@ -2986,7 +2886,7 @@ def download_challan(tax_payment_id):
     """Generate and download tax payment challan"""
     user_id = get_jwt_identity()
     
-    conn = get_db()
+    conn = get_read_db(user_id)
     cursor = conn.cursor()
     
     # Get tax payment details with user info
@@ -3007,7 +2907,7 @@ def download_challan(tax_payment_id):
     
     # Generate challan data
     challan_data = {
-        'challan_number': f"CH{payment['id'][:8].upper()}",
+        'challan_number': challan_number(payment['id']),
         'payment_date': payment['payment_date'],
         'tax_type': payment['tax_type'],
         'amount': payment['amount'],
@@ -3058,7 +2958,7 @@ def export_tax_history():
     user_id = get_jwt_identity()
     export_format = request.args.get('format', 'json').lower()
     
-    conn = get_db()
+    conn = get_read_db(user_id)
     cursor = conn.cursor()
     
     # Get user details
@@ -3066,15 +2966,7 @@ def export_tax_history():
     user = cursor.fetchone()
     
     # Get all tax payments
-    cursor.execute('''
-        SELECT tp.*, t.created_at as payment_date, t.description, t.counterparty
-        FROM tax_payments tp
-        JOIN transactions t ON tp.transaction_id = t.id
-        WHERE tp.user_id = ?
-        ORDER BY tp.created_at DESC
-    ''', (user_id,))
-    
-    tax_payments = cursor.fetchall()
+    tax_payments = archive.list_tax_payments(conn, shards.path_for(user_id), user_id)
     conn.close()
     
     export_data = {
@@ -3085,16 +2977,16 @@ def export_tax_history():
             'account_number': user['account_number']
         },
         'total_payments': len(tax_payments),
-        'total_amount': sum(float(p['amount']) for p in tax_payments),
+        'total_amount': sum(float(p.amount) for p in tax_payments),
         'payments': [
             {
-                'challan_number': f"CH{p['id'][:8].upper()}",
-                'payment_date': p['payment_date'],
-                'tax_type': p['tax_type'],
-                'description': p['description'],
-                'amount': p['amount'],
-                'status': p['status'],
-                'transaction_id': p['transaction_id']
+                'challan_number': challan_number(p.id),
+                'payment_date': p.payment_date,
+                'tax_type': p.tax_type,
+                'description': p.description,
+                'amount': p.amount,
+                'status': p.status,
+                'transaction_id': p.transaction_id
             }
             for p in tax_payments
         ]
@@ -3122,6 +3014,38 @@ def start_background_tasks():
     
     thread = threading.Thread(target=update_prices, daemon=True)
     thread.start()
+    
+    def maintain():
+        while True:
+            maintain_storage()
+            time.sleep(app.config['ARCHIVE_INTERVAL_SECONDS'])
+    
+    threading.Thread(target=maintain, name='storage-maintenance', daemon=True).start()
+
+def maintain_storage():
+    """Event partitions and retention, the archive tier and the columnar event store, for every shard file"""
+    now_ms = int(datetime.datetime.now(datetime.timezone.utc).timestamp() * 1000)
+    retention_months = app.config['EVENT_RETENTION_MONTHS']
+    for path in shards.paths:
+        try:
+            dropped = partitions.maintain(path, retention_months)
+            if dropped:
+                print(f"Dropped expired event partitions {dropped} from {path}")
+            if app.config['ARCHIVE_AFTER_DAYS'] > 0:
+                cutoff_ms = now_ms - app.config['ARCHIVE_AFTER_DAYS'] * 86400000
+                moved = archive.archive_old_rows(path, cutoff_ms, batch_size=app.config['MIGRATION_BATCH_SIZE'])
+                if any(moved.values()):
+                    print(f"Archived {moved} from {path}")
+            expired_before = None
+            if retention_months > 0:
+                expired_before = partitions.add_months(partitions.month_start_ms(now_ms), -retention_months)
+                archive.drop_archived_events(path, expired_before)
+                if path == shards.paths[0]:
+                    rollups.prune(path, app.config['EVENT_ROLLUP_TYPES'], expired_before)
+            if app.config['EVENT_STORE_COMPACTION']:
+                event_store.compact(path, before_ms=expired_before)
+        except Exception as e:
+            print(f"Error maintaining {path}: {e}")
 
 if __name__ == '__main__':
     # Initialize database
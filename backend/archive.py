@@ -0,0 +1,441 @@
+"""
+Hot/cold archive tier for transactions and user_events.
+
+Both tables only ever grow, and every statement or session query pays for
+the full depth of their B-trees. A background archiver moves rows older than
+ARCHIVE_AFTER_DAYS out of each hot database file into one archive file per
+calendar month (archive/banking-2024-01.db, archive/banking.shard1-2024-01.db,
+and so on). That keeps the hot files small enough to stay in the page cache.
+
+Events are partitioned by month (partitions.py), so they move a whole
+partition at a time, which is then dropped from the hot file.
+
+Each hot file records in archive_state the point before which rows may have
+moved. Readers compare a requested range with that watermark and only open
+the monthly files when the range reaches back past it.
+"""
+import datetime
+import glob
+import heapq
+import json
+import os
+import pathlib
+import sqlite3
+import time
+from typing import Dict, List, Optional
+
+import partitions
+import repository
+from partitions import month_start_ms, next_month_ms
+from repository import Transaction, TaxPayment
+
+# Archived tables and their epoch-millisecond timestamp column; user_events moves a whole partition at a time
+ARCHIVED_TABLES = {
+    'transactions': 'created_at_ms',
+}
+
+# Indexes the archive files need for the queries run against them
+ARCHIVE_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS arc.idx_transactions_user_created_ms ON transactions (user_id, created_at_ms)",
+    "CREATE INDEX IF NOT EXISTS arc.idx_user_events_email_time_ms ON user_events (user_email, time_ms)",
+]
+
+ARCHIVED_BEFORE_SQL = "SELECT archived_before_ms FROM archive_state WHERE table_name = ?"
+
+OLDEST_TAX_PAYMENT_SQL = "SELECT MIN(created_at_ms) FROM tax_payments WHERE user_id = ?"
+
+# repository.TAX_PAYMENTS_SQL, keeping payments whose transaction has been moved out of the hot file
+TAX_PAYMENTS_WITH_ARCHIVED_SQL = f'''
+    SELECT {', '.join(f'tp.{name}' for name in TaxPayment._fields[:-3])},
+           t.created_at, t.description, t.counterparty, t.id IS NULL
+    FROM tax_payments tp
+    LEFT JOIN transactions t ON tp.transaction_id = t.id
+    WHERE tp.user_id = ?
+    ORDER BY tp.created_at_ms DESC
+'''
+
+# repository.STATEMENT_SQL for archive files, which have no users table to look the user key up in
+ARCHIVED_STATEMENT_SQL = f'''
+    SELECT {repository.TRANSACTION_COLUMNS} FROM transactions
+    WHERE user_id = ? AND created_at_ms >= ? AND created_at_ms < ?
+    ORDER BY created_at_ms DESC LIMIT ?
+'''
+
+ARCHIVED_TRANSACTION_DETAILS_SQL = '''
+    SELECT id, created_at, description, counterparty FROM transactions
+    WHERE id IN (SELECT value FROM json_each(?))
+'''
+
+
+# ---------- Files ----------
+
+def archive_path(database: str, month_ms: int) -> str:
+    """Archive file for a hot database file and a month, e.g. archive/banking-2024-01.db."""
+    directory, name = os.path.split(os.path.abspath(database))
+    stem, ext = os.path.splitext(name)
+    month = datetime.datetime.fromtimestamp(month_ms / 1000, datetime.timezone.utc).strftime('%Y-%m')
+    return os.path.join(directory, 'archive', f"{stem}-{month}{ext}")
+
+
+def archive_files(database: str, start_ms: int, end_ms: int) -> List[str]:
+    """Existing archive files for months overlapping [start_ms, end_ms), newest first."""
+    directory, name = os.path.split(os.path.abspath(database))
+    stem, ext = os.path.splitext(name)
+    pattern = os.path.join(glob.escape(os.path.join(directory, 'archive')), f"{glob.escape(stem)}-[0-9][0-9][0-9][0-9]-[0-9][0-9]{ext}")
+    first = archive_path(database, month_start_ms(max(start_ms, 0)))
+    last = archive_path(database, month_start_ms(end_ms - 1))
+    # Names sort by month, so the range test is a string comparison
+    return sorted((path for path in glob.glob(pattern) if first <= path <= last), reverse=True)
+
+
+def _file_month_ms(path: str) -> int:
+    """Month an archive file covers, from its -YYYY-MM suffix."""
+    stem = os.path.splitext(os.path.basename(path))[0]
+    moment = datetime.datetime.strptime(stem[-7:], '%Y-%m').replace(tzinfo=datetime.timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def archived_before(conn: sqlite3.Connection, table: str) -> Optional[int]:
+    """Watermark: rows of table older than this may be in the archive files. None if nothing was archived."""
+    try:
+        row = conn.execute(ARCHIVED_BEFORE_SQL, (table,)).fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+
+def _open_archive(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(f"{pathlib.Path(path).as_uri()}?mode=ro", uri=True)
+
+
+# ---------- Reads ----------
+
+def list_statement_transactions(conn: sqlite3.Connection, database: str, user_id: str,
+                                start_ms: Optional[int] = None, end_ms: Optional[int] = None,
+                                limit: int = -1) -> List[Transaction]:
+    """
+    repository.list_statement_transactions across the hot file and, when the
+    range reaches back past the watermark, the monthly archives.
+    """
+    hot = repository.list_statement_transactions(conn, user_id, start_ms, end_ms, limit)
+    watermark = archived_before(conn, 'transactions')
+    start = repository.MIN_EPOCH_MS if start_ms is None else start_ms
+    end = repository.MAX_EPOCH_MS if end_ms is None else end_ms
+    if watermark is None or start >= watermark or 0 < limit <= len(hot):
+        return hot
+
+    sources = [hot]
+    wanted = limit - len(hot) if limit > 0 else -1
+    for path in archive_files(database, start, min(end, watermark)):
+        archive = _open_archive(path)
+        try:
+            cursor = archive.cursor()
+            cursor.row_factory = None
+            rows = list(map(Transaction._make, cursor.execute(ARCHIVED_STATEMENT_SQL, (user_id, start, end, limit))))
+        finally:
+            archive.close()
+        sources.append(rows)
+        if wanted > 0:
+            wanted -= len(rows)
+            if wanted <= 0:
+                break
+
+    # Each source is already newest first. A row can briefly be in both tiers while it is being moved.
+    merged = []
+    seen = set()
+    for record in heapq.merge(*sources, key=lambda t: t.created_at_ms, reverse=True):
+        if record.id not in seen:
+            seen.add(record.id)
+            merged.append(record)
+            if len(merged) == limit:
+                break
+    return merged
+
+
+def list_tax_payments(conn: sqlite3.Connection, database: str, user_id: str) -> List[TaxPayment]:
+    """
+    repository.list_tax_payments, also covering payments whose transaction has
+    been archived (their payment date, description and counterparty come from
+    the archive file).
+    """
+    watermark = archived_before(conn, 'transactions')
+    oldest = None if watermark is None else conn.execute(OLDEST_TAX_PAYMENT_SQL, (user_id,)).fetchone()[0]
+    if oldest is None or oldest >= watermark:
+        return repository.list_tax_payments(conn, user_id)
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    rows = cursor.execute(TAX_PAYMENTS_WITH_ARCHIVED_SQL, (user_id,)).fetchall()
+    transaction_ids = [row[2] for row in rows if row[-1]]
+
+    # A transaction is written just before its tax payment, so start one month earlier
+    details = {}
+    for path in archive_files(database, month_start_ms(oldest) - 1, watermark):
+        archive = _open_archive(path)
+        try:
+            for transaction_id, created_at, description, counterparty in archive.execute(
+                    ARCHIVED_TRANSACTION_DETAILS_SQL, (json.dumps(transaction_ids),)):
+                details[transaction_id] = (created_at, description, counterparty)
+        finally:
+            archive.close()
+
+    # Same order as the hot query; a payment whose transaction is in neither tier is left out, as the JOIN would
+    return [TaxPayment._make(row[:-4] + details[row[2]]) if row[-1] else TaxPayment._make(row[:-1])
+            for row in rows if not row[-1] or row[2] in details]
+
+
+# ---------- Archiver ----------
+
+def _table_sql(conn: sqlite3.Connection, table: str) -> str:
+    return conn.execute("SELECT sql FROM main.sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()[0]
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _prepare_archive(conn: sqlite3.Connection):
+    """Create the archived tables in the attached arc file with the hot file's definitions."""
+    conn.execute(partitions.PARTITION_DDL.format(name=f"arc.{partitions.TABLE}"))
+    for table in ARCHIVED_TABLES:
+        if not _columns(conn, 'arc', table):
+            ddl = _table_sql(conn, table)
+            conn.execute(ddl.replace(f"CREATE TABLE {table}", f"CREATE TABLE IF NOT EXISTS arc.{table}", 1))
+        else:
+            # Columns added to the hot table by later migrations
+            existing = set(_columns(conn, 'arc', table))
+            for row in conn.execute(f"PRAGMA main.table_info({table})").fetchall():
+                if row[1] not in existing:
+                    conn.execute(f"ALTER TABLE arc.{table} ADD COLUMN {row[1]} {row[2]}")
+    for statement in ARCHIVE_INDEXES:
+        conn.execute(statement)
+
+
+def _set_watermark(conn: sqlite3.Connection, table: str, before_ms: int):
+    conn.execute('''
+        INSERT INTO archive_state (table_name, archived_before_ms) VALUES (?, ?)
+        ON CONFLICT (table_name) DO UPDATE SET archived_before_ms = MAX(archived_before_ms, excluded.archived_before_ms)
+    ''', (table, before_ms))
+
+
+def _move_month(conn: sqlite3.Connection, table: str, column: str, low: int, high: int,
+                batch_size: int, pause: float, source: Optional[str] = None) -> int:
+    """
+    Move rows with low <= column < high from main.source (default: the same
+    table) into arc.table, one batch at a time.
+
+    SQLite only commits atomically per file in WAL mode, so a batch is two
+    transactions: the copy is committed to the archive file first, then the
+    rows are deleted from the hot file, but only those whose id the archive
+    now holds. A crash in between leaves the batch in both files, which
+    readers already tolerate, and the next run converges.
+    """
+    source = source or table
+    columns = ', '.join(_columns(conn, 'main', source))
+    moved = 0
+    while True:
+        conn.execute("BEGIN")
+        try:
+            rowids = [row[0] for row in conn.execute(
+                f"SELECT rowid FROM main.{source} WHERE {column} >= ? AND {column} < ? LIMIT ?",
+                (low, high, batch_size))]
+            batch = json.dumps(rowids)
+            if rowids:
+                # OR REPLACE lets a re-run after a crash converge
+                conn.execute(f"INSERT OR REPLACE INTO arc.{table} ({columns}) "
+                             f"SELECT {columns} FROM main.{source} WHERE rowid IN (SELECT value FROM json_each(?))",
+                             (batch,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if rowids:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(f"DELETE FROM main.{source} WHERE rowid IN (SELECT value FROM json_each(?)) "
+                             f"AND id IN (SELECT id FROM arc.{table})", (batch,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        moved += len(rowids)
+        if len(rowids) < batch_size:
+            return moved
+        if pause:
+            # Give the app's writers a turn at the lock between batches
+            time.sleep(pause)
+
+
+def archive_old_rows(database: str, older_than_ms: int, batch_size: int = 5000, pause: float = 0.005,
+                     busy_timeout: int = 5000) -> Dict[str, int]:
+    """
+    Move every archived table's rows older than older_than_ms from a hot
+    database file into its monthly archive files. Returns rows moved per table.
+
+    The watermark is raised before any row moves. A reader that overlaps
+    with the move then already looks in the archives, and finds each row in
+    at least one tier.
+    """
+    conn = sqlite3.connect(database, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    moved = {}
+    try:
+        for table, column in ARCHIVED_TABLES.items():
+            _set_watermark(conn, table, older_than_ms)
+            moved[table] = 0
+            while True:
+                oldest = conn.execute(f"SELECT MIN({column}) FROM {table} WHERE {column} < ?",
+                                      (older_than_ms,)).fetchone()[0]
+                if oldest is None:
+                    break
+                month = month_start_ms(oldest)
+                path = archive_path(database, month)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                conn.execute("ATTACH DATABASE ? AS arc", (path,))
+                try:
+                    _prepare_archive(conn)
+                    moved[table] += _move_month(conn, table, column, month,
+                                                min(next_month_ms(month), older_than_ms), batch_size, pause)
+                finally:
+                    conn.execute("DETACH DATABASE arc")
+
+        # Events only move in whole months, then their emptied partition is dropped
+        events_before = month_start_ms(older_than_ms)
+        _set_watermark(conn, partitions.TABLE, events_before)
+        moved[partitions.TABLE] = 0
+        for name, low, high in partitions.list_partitions(conn):
+            if high > events_before:
+                break
+            path = archive_path(database, low)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            conn.execute("ATTACH DATABASE ? AS arc", (path,))
+            try:
+                _prepare_archive(conn)
+                moved[partitions.TABLE] += _move_month(conn, partitions.TABLE, 'time_ms', low, high,
+                                                       batch_size, pause, source=name)
+            finally:
+                conn.execute("DETACH DATABASE arc")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # A late event may have landed after the last batch; leave the partition for the next run
+                if conn.execute(f"SELECT 1 FROM {name} LIMIT 1").fetchone() is None:
+                    partitions.drop_partitions(conn, [name])
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.close()
+    return moved
+
+
+def drop_archived_events(database: str, before_ms: int) -> List[str]:
+    """Event retention for the archive files: drop user_events from every month file before before_ms."""
+    dropped = []
+    for path in archive_files(database, 0, before_ms):
+        if next_month_ms(_file_month_ms(path)) > before_ms:
+            continue
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            if _columns(conn, 'main', partitions.TABLE):
+                conn.execute(f"DROP TABLE {partitions.TABLE}")
+                conn.execute("VACUUM")
+                dropped.append(path)
+        finally:
+            conn.close()
+    return dropped
+
+
+def move_user_archives(source: str, dest: str, users: List[tuple], batch_size: int = 500) -> int:
+    """
+    Move the archived rows of users (user_id, email pairs) from the monthly
+    archives of hot file source into the matching archives of hot file dest,
+    for shards.rebalance. Returns the rows moved.
+
+    dest's watermarks are raised to source's first, so readers of the moved
+    users look in dest's archives. Each month then moves like the archiver
+    does: the copy is committed to dest's archive before the rows dest now
+    holds are deleted from source's. Run it before the users' hot rows move,
+    so a re-run after a crash still finds them on source and converges.
+    """
+    paths = archive_files(source, 0, int(time.time() * 1000))
+    if not paths or not users:
+        return 0
+
+    hot = sqlite3.connect(source)
+    try:
+        watermarks = {table: archived_before(hot, table) for table in [*ARCHIVED_TABLES, partitions.TABLE]}
+    finally:
+        hot.close()
+
+    conn = sqlite3.connect(dest, isolation_level=None)
+    moved = 0
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for table, before_ms in watermarks.items():
+                if before_ms is not None:
+                    _set_watermark(conn, table, before_ms)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        for path in paths:
+            target = archive_path(dest, _file_month_ms(path))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            conn.execute("ATTACH DATABASE ? AS arc", (target,))
+            conn.execute("ATTACH DATABASE ? AS src", (path,))
+            try:
+                _prepare_archive(conn)
+                for start in range(0, len(users), batch_size):
+                    moved += _move_user_rows(conn, users[start:start + batch_size])
+            finally:
+                conn.execute("DETACH DATABASE src")
+                conn.execute("DETACH DATABASE arc")
+    finally:
+        conn.close()
+    return moved
+
+
+def _move_user_rows(conn: sqlite3.Connection, users: List[tuple]) -> int:
+    """Copy a batch of users' rows from the attached src archive into arc and commit, then delete the copied originals."""
+    owners = {
+        'transactions': ('user_id', json.dumps([user_id for user_id, _ in users])),
+        partitions.TABLE: ('user_email', json.dumps([email for _, email in users])),
+    }
+    moved = 0
+    copied = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table, (key, values) in owners.items():
+            # Retention may have dropped a month's events from the archive
+            src_columns = _columns(conn, 'src', table)
+            if not src_columns:
+                continue
+            arc_columns = set(_columns(conn, 'arc', table))
+            columns = [c for c in src_columns if c in arc_columns]
+            # User keys are per hot file and archive reads go by user_id, so the source file's key is not carried over
+            selected = ['NULL' if c == 'user_key' else c for c in columns]
+            # OR REPLACE lets a re-run after a crash converge
+            moved += conn.execute(
+                f"INSERT OR REPLACE INTO arc.{table} ({', '.join(columns)}) "
+                f"SELECT {', '.join(selected)} FROM src.{table} WHERE {key} IN (SELECT value FROM json_each(?))",
+                (values,)).rowcount
+            copied.append((table, key, values))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for table, key, values in copied:
+            conn.execute(f"DELETE FROM src.{table} WHERE {key} IN (SELECT value FROM json_each(?)) "
+                         f"AND id IN (SELECT id FROM arc.{table})", (values,))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return moved
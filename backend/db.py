@@ -0,0 +1,263 @@
+"""
+SQLite connection management for the banking backend.
+
+Opening a connection costs a file open, a schema parse and a cold page cache,
+so instead of connecting on every request we keep a small pool of tuned
+connections and bind one to each worker thread while it is in use.
+
+Reads and writes use separate pools. In WAL mode a reader works from its own
+snapshot and never waits on a writer's commit, so GET handlers check out
+read-only connections (mode=ro, query_only) while everything that changes
+data goes through the writer pool.
+"""
+import pathlib
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Any
+
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,       # negative means KiB, so ~64 MB of page cache
+    'mmap_size': 268435456,     # 256 MB
+    'busy_timeout': 5000,       # ms
+    'temp_store': 'MEMORY',
+}
+
+# Pragmas that write to the database file and so cannot be set on a read-only connection
+WRITER_ONLY_PRAGMAS = {'journal_mode'}
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    A sqlite3 connection whose close() hands it back to its pool.
+
+    Handlers keep calling conn.close() exactly as before; the pool decides
+    whether the underlying connection is reused or really closed.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pool = None
+        self.created_at = time.monotonic()
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    def discard(self):
+        """Really close the underlying connection."""
+        super().close()
+
+
+class ConnectionPool:
+    """
+    A bounded pool of SQLite connections with thread affinity.
+
+    The first connection() call on a thread checks a connection out of the
+    pool and binds it to that thread; nested calls on the same thread (for
+    example track_user_event inside a handler) get the same connection back.
+    It returns to the pool when the outermost caller closes it, or when
+    release_thread() is called at the end of the request.
+
+    With read_only=True connections are opened with mode=ro and query_only,
+    so any INSERT/UPDATE/DELETE on them fails instead of taking the write lock.
+
+    attach maps schema names to other database files that every connection
+    ATTACHes, and temp_views maps names to SELECTs that are created as TEMP
+    views. TEMP is searched before main, so a temp view can stand in for a
+    table that really lives in an attached file.
+    """
+    def __init__(self, database: str, max_size: int = 8, max_age: float = 3600.0,
+                 checkout_timeout: float = 30.0, pragmas: Optional[Dict[str, Any]] = None,
+                 read_only: bool = False, attach: Optional[Dict[str, str]] = None,
+                 temp_views: Optional[Dict[str, str]] = None):
+        self.database = database
+        self.read_only = read_only
+        self.attach = dict(attach or {})
+        self.temp_views = dict(temp_views or {})
+        self.max_size = max_size
+        self.max_age = max_age
+        self.checkout_timeout = checkout_timeout
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas:
+            self.pragmas.update(pragmas)
+        if read_only:
+            for name in WRITER_ONLY_PRAGMAS:
+                self.pragmas.pop(name, None)
+
+        self._idle = []
+        self._all = set()
+        self._reserved = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._local = threading.local()
+
+        # Metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._created = 0
+        self._recycled = 0
+
+    @staticmethod
+    def _read_only_uri(path: str) -> str:
+        return f"{pathlib.Path(path).absolute().as_uri()}?mode=ro"
+
+    def _connect(self) -> PooledConnection:
+        if self.read_only:
+            conn = sqlite3.connect(self._read_only_uri(self.database), uri=True,
+                                   factory=PooledConnection, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.database, factory=PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        # Pragmas first: changing temp_store throws away anything already in TEMP
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        for schema, path in self.attach.items():
+            target = self._read_only_uri(path) if self.read_only else path
+            conn.execute(f"ATTACH DATABASE ? AS {schema}", (target,))
+        for name, select in self.temp_views.items():
+            conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS {name} AS {select}")
+        if self.read_only:
+            conn.execute("PRAGMA query_only = 1")
+        conn.pool = self
+        return conn
+
+    def connection(self) -> PooledConnection:
+        """Return the connection bound to the current thread, checking one out if needed."""
+        bound = getattr(self._local, 'conn', None)
+        if bound is not None:
+            self._local.depth += 1
+            return bound
+
+        conn = self._checkout()
+        self._local.conn = conn
+        self._local.depth = 1
+        return conn
+
+    def _take_idle(self) -> Optional[PooledConnection]:
+        now = time.monotonic()
+        while self._idle:
+            conn = self._idle.pop()
+            if now - conn.created_at <= self.max_age:
+                return conn
+            self._retire(conn)
+        return None
+
+    def _checkout(self) -> PooledConnection:
+        started = time.monotonic()
+        deadline = started + self.checkout_timeout
+        waited = False
+
+        with self._cond:
+            while True:
+                conn = self._take_idle()
+                if conn is not None or len(self._all) + self._reserved < self.max_size:
+                    break
+                waited = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"Timed out after {self.checkout_timeout}s waiting for a connection to {self.database}")
+                self._cond.wait(remaining)
+
+            if conn is None:
+                self._reserved += 1
+
+        if conn is None:
+            # Open outside the lock so other threads can keep checking out idle connections
+            try:
+                conn = self._connect()
+            finally:
+                with self._cond:
+                    self._reserved -= 1
+            with self._cond:
+                self._all.add(conn)
+                self._created += 1
+
+        wait = time.monotonic() - started
+        with self._cond:
+            self._checkouts += 1
+            if waited:
+                self._waits += 1
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+        return conn
+
+    def release(self, conn: PooledConnection):
+        """Called from PooledConnection.close(); returns the connection once its outermost user is done."""
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.depth -= 1
+            if self._local.depth > 0:
+                return
+            self._local.conn = None
+
+        # Never hand a half-finished transaction to the next request
+        healthy = True
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            healthy = False
+
+        with self._cond:
+            if healthy and not self._closed:
+                self._idle.append(conn)
+            else:
+                self._retire(conn)
+            self._cond.notify()
+
+    def release_thread(self) -> bool:
+        """
+        Return the current thread's connection to the pool however many
+        callers still hold it, for a handler that raised before close().
+        Returns whether one was bound.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return False
+        self._local.depth = 1
+        self.release(conn)
+        return True
+
+    def _retire(self, conn: PooledConnection):
+        self._all.discard(conn)
+        self._recycled += 1
+        try:
+            conn.discard()
+        except sqlite3.Error:
+            pass
+
+    def close_all(self):
+        """Close idle connections now and in-use ones as they are released."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._retire(self._idle.pop())
+
+    def metrics(self) -> Dict[str, Any]:
+        """Pool size, checkout-wait and connection-age statistics."""
+        now = time.monotonic()
+        with self._cond:
+            ages = [now - conn.created_at for conn in self._all]
+            return {
+                'database': self.database,
+                'read_only': self.read_only,
+                'max_size': self.max_size,
+                'open': len(self._all),
+                'idle': len(self._idle),
+                'in_use': len(self._all) - len(self._idle),
+                'created': self._created,
+                'recycled': self._recycled,
+                'checkouts': self._checkouts,
+                'checkout_waits': self._waits,
+                'checkout_wait_avg_ms': round(self._wait_total / self._waits * 1000, 3) if self._waits else 0.0,
+                'checkout_wait_max_ms': round(self._wait_max * 1000, 3),
+                'connection_age_max_s': round(max(ages), 1) if ages else 0.0,
+                'connection_age_avg_s': round(sum(ages) / len(ages), 1) if ages else 0.0,
+            }
@@ -0,0 +1,167 @@
+"""
+Incremental keystroke enrollment.
+
+A user's keystroke model is first fitted from the enrollment CSV; after
+that, every sample from a successful biometric login that the model scored
+as Normal is appended to a buffer file beside the model (<hash>.buffer in
+the model directory: raw float64 rows in the model's feature order), so
+buffered samples survive a restart. Samples scored as an anomaly are never
+buffered, even when the login went through, so a borderline typist cannot
+drag the model towards their own pattern.
+
+Once a user has min_samples buffered rows, a background thread refits their
+model on the rows it was fitted on plus the buffer (the most recent
+max_samples of them) and saves it with ModelRegistry.save. The new model is
+built entirely off the request path and becomes visible in one step: the
+file is renamed into place and the cached model replaced under the
+registry's lock. A prediction that already holds the old model finishes
+with it. The rows the refit used are then dropped from the buffer; rows
+that arrived during the fit stay for the next one.
+"""
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from keystroke import KeystrokeAuthenticator, ModelRegistry
+
+
+class EnrollmentTrainer:
+    """Per-user buffers of accepted keystroke samples and the thread that refits on them."""
+    def __init__(self, registry: ModelRegistry, min_samples: int = 20, max_samples: int = 1000):
+        self.registry = registry
+        self.min_samples = min_samples
+        self.max_samples = max_samples
+        self._queue = queue.Queue()
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        self._buffer_lock = threading.Lock()
+        self._thread = None
+
+        # Metrics
+        self._buffered = 0
+        self._refits = 0
+        self._failures = 0
+        self._last_refit_ms = None
+        self._last_version = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='keystroke-enrollment', daemon=True)
+                self._thread.start()
+
+    def add(self, user_email: str, authenticator: KeystrokeAuthenticator, keystroke_data: dict) -> bool:
+        """Buffer an accepted sample; schedules a refit once min_samples are waiting. Never raises."""
+        if self.min_samples <= 0:
+            return False
+        try:
+            row = authenticator.row(keystroke_data)
+            path = self.registry.path(user_email, '.buffer')
+            with self._buffer_lock:
+                with open(path, 'ab') as f:
+                    f.write(row.tobytes())
+                waiting = os.path.getsize(path) // row.nbytes
+        except (ValueError, OSError) as e:
+            print(f"Error buffering keystroke sample: {e}")
+            return False
+
+        with self._lock:
+            self._buffered += 1
+            if waiting < self.min_samples or user_email in self._scheduled:
+                return True
+            self._scheduled.add(user_email)
+        if self._thread is None:
+            self.start()
+        self._queue.put(user_email)
+        return True
+
+    def refit(self, user_email: str) -> Optional[int]:
+        """Refit a user's model on its training rows plus their buffer; returns the new version, if any."""
+        started = time.perf_counter()
+        current = self.registry.get(user_email)
+        path = self.registry.path(user_email, '.buffer')
+        if current is None:
+            return None
+        with self._buffer_lock:
+            try:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return None
+
+        width = len(current.feature_columns)
+        if len(data) % (8 * width):
+            # Rows of another width: the model was re-enrolled with different features since
+            print(f"Discarding keystroke buffer {path}: it does not match the model's {width} features")
+            self._consume(path, len(data))
+            return None
+        rows = np.frombuffer(data, dtype=np.float64).reshape(-1, width)
+        if len(rows) < self.min_samples:
+            return None
+
+        training = self.registry.training(user_email)
+        if training is not None and training.shape[1] == width:
+            rows = np.vstack([training, rows])
+        authenticator = KeystrokeAuthenticator()
+        authenticator.fit(pd.DataFrame(rows[-self.max_samples:], columns=current.feature_columns))
+        version = self.registry.save(user_email, authenticator)
+        self._consume(path, len(data))
+
+        with self._lock:
+            self._refits += 1
+            self._last_refit_ms = (time.perf_counter() - started) * 1000
+            self._last_version = version
+        return version
+
+    def _consume(self, path: str, size: int):
+        """Drop the first size bytes of a buffer, keeping rows appended since they were read."""
+        with self._buffer_lock:
+            with open(path, 'rb') as f:
+                f.seek(size)
+                rest = f.read()
+            if rest:
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(rest)
+                os.replace(path + '.tmp', path)
+            else:
+                os.remove(path)
+
+    def stop(self):
+        """Stop the worker after the refit in progress, if any. Buffers stay on disk."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            user_email = self._queue.get()
+            if user_email is None:
+                return
+            try:
+                self.refit(user_email)
+            except Exception as e:
+                print(f"Error refitting keystroke model: {e}")
+                with self._lock:
+                    self._failures += 1
+            finally:
+                with self._lock:
+                    self._scheduled.discard(user_email)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Buffering and refit statistics."""
+        with self._lock:
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'min_samples': self.min_samples,
+                'buffered': self._buffered,
+                'scheduled': len(self._scheduled),
+                'refits': self._refits,
+                'failures': self._failures,
+                'last_refit_ms': round(self._last_refit_ms, 1) if self._last_refit_ms is not None else None,
+                'last_version': self._last_version,
+            }
@@ -0,0 +1,365 @@
+"""
+Columnar per-user copies of user_events for model training.
+
+Training the behaviour profiler only needs three columns of a user's
+history, but reading it with SELECT * through pandas builds a Python object
+for every field of every row, including the additional_data JSON text. A
+periodic compaction pass exports those columns into one directory per user
+under event_store/<database stem>/, next to the database file:
+
+    time_ms.npy             int64, epoch milliseconds, sorted
+    event_type.npy          int16 codes into event_types.json
+    transaction_amount.npy  float64, NaN where the row had none
+
+read_frame() memory-maps the three files and wraps them in a DataFrame,
+in time order, without parsing any text, so UserBehaviorProfiler.fit reads a user's
+history at close to the cost of paging it in. Given a connection, it also
+reads the user's rows added since the last pass from the database.
+
+Compaction is incremental. state.json remembers the rowid and id of the
+last row exported from each hot partition, so a pass only reads rows added
+since the last one. Partitions have no AUTOINCREMENT, so once their highest
+rows are deleted SQLite hands those rowids out again; while the remembered
+row is still there that cannot happen, and when it is gone or has another
+id, the partition's month is read again in full and replaces every user's
+copy of that month. A user's files are rewritten in a scratch directory and swapped in,
+so a reader never sees half of a rewrite; during the swap itself it finds
+no copy and falls back to the database. rebuild()
+re-exports everything, including archived months. Run it after a shard
+rebalance or after deleting events by hand (remove_user does that for one
+user). The store is a cache of the
+database and can be removed at any time.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import archive
+import partitions
+
+COLUMN_DTYPES = {
+    'time_ms': np.int64,
+    'event_type': np.int16,
+    'transaction_amount': np.float64,
+}
+
+EXPORT_TEMPLATE = '''
+    SELECT rowid, id, user_email, event_type, time_ms, transaction_amount
+    FROM {partition}
+    WHERE rowid > ?
+    ORDER BY rowid
+    LIMIT ?
+'''
+
+WATERMARK_TEMPLATE = "SELECT id FROM {partition} WHERE rowid = ?"
+
+TAIL_TEMPLATE = '''
+    SELECT user_email, event_type, time_ms, transaction_amount
+    FROM {partition}
+    WHERE user_email = ? AND rowid > ?
+'''
+
+ARCHIVED_EVENTS_SQL = "SELECT user_email, event_type, time_ms, transaction_amount FROM user_events"
+
+
+def store_path(database: str) -> str:
+    """Store directory for a database file, e.g. event_store/banking for banking.db."""
+    directory, name = os.path.split(os.path.abspath(database))
+    return os.path.join(directory, 'event_store', os.path.splitext(name)[0])
+
+
+def user_key(user_email: str) -> str:
+    """Directory name for a user; emails are hashed so they never appear in file names."""
+    return hashlib.sha256(user_email.encode('utf-8')).hexdigest()[:32]
+
+
+def _read_json(path: str, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _write_json(path: str, value):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(value, f)
+    os.replace(path + '.tmp', path)
+
+
+# ---------- Reading ----------
+
+def _load_directory(directory: str, mmap_mode: Optional[str] = 'r') -> Optional[Dict[str, np.ndarray]]:
+    try:
+        return {column: np.load(os.path.join(directory, f"{column}.npy"), mmap_mode=mmap_mode)
+                for column in COLUMN_DTYPES}
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def load_columns(database: str, user_email: str) -> Optional[Dict[str, np.ndarray]]:
+    """A user's columns, memory-mapped read-only, or None if the store has no copy."""
+    return _load_directory(os.path.join(store_path(database), user_key(user_email)))
+
+
+def read_frame(database: str, user_email: str,
+               conn: Optional[sqlite3.Connection] = None) -> Optional[pd.DataFrame]:
+    """
+    A user's events as the DataFrame UserBehaviorProfiler.fit expects
+    (user_email, event_type, time, transaction_amount), or None if they
+    have not been compacted yet. With conn, a connection to database, the
+    rows written since the last pass are read from it and added. Do not
+    call it with conn while a pass is writing the store: the user's files
+    and state.json are not swapped in together.
+    """
+    columns = load_columns(database, user_email)
+    if columns is None:
+        return None
+    root = store_path(database)
+    event_types = _read_json(os.path.join(root, 'event_types.json'), [])
+    if conn is not None:
+        exported = _read_json(os.path.join(root, 'state.json'), {'partitions': {}})['partitions']
+        export = _Export(list(event_types))
+        replaced = []
+        for name, start_ms, end_ms, after, _, stale in _watermarks(conn, exported):
+            if stale:
+                replaced.append((start_ms, end_ms))
+            export.add(conn.execute(TAIL_TEMPLATE.format(partition=name), (user_email, after)).fetchall())
+        if export.rows or replaced:
+            columns = _merge(columns, export.columns(user_email), replaced)
+            event_types = export.event_types
+    if len(columns['time_ms']) == 0:
+        return None
+    return pd.DataFrame({
+        'user_email': user_email,
+        'event_type': pd.Categorical.from_codes(np.asarray(columns['event_type']), categories=event_types),
+        # Whole seconds, like the time column the profiler otherwise reads
+        'time': (columns['time_ms'] // 1000 * 1000000000).view('datetime64[ns]'),
+        'transaction_amount': columns['transaction_amount'],
+    })
+
+
+# ---------- Writing ----------
+
+class _Export:
+    """Exported rows grouped by user as numpy chunks, with event types encoded against the store's list."""
+    def __init__(self, event_types: List[str]):
+        self.event_types = event_types
+        self.codes = {name: code for code, name in enumerate(event_types)}
+        self.users = {}
+        self.rows = 0
+
+    def add(self, rows: List[tuple]):
+        """Add rows of (user_email, event_type, time_ms, transaction_amount)."""
+        if not rows:
+            return
+        emails, event_types, time_ms, amounts = zip(*rows)
+        type_codes, type_names = pd.factorize(pd.Series(event_types, dtype=object))
+        for name in type_names:
+            if name not in self.codes:
+                self.codes[name] = len(self.event_types)
+                self.event_types.append(name)
+        mapping = np.array([self.codes[name] for name in type_names], dtype=COLUMN_DTYPES['event_type'])
+
+        chunk = {
+            'time_ms': np.array(time_ms, dtype=COLUMN_DTYPES['time_ms']),
+            'event_type': mapping[type_codes],
+            'transaction_amount': np.array([np.nan if amount is None else amount for amount in amounts],
+                                           dtype=COLUMN_DTYPES['transaction_amount']),
+        }
+        user_codes, user_names = pd.factorize(pd.Series(emails, dtype=object))
+        order = np.argsort(user_codes, kind='stable')
+        bounds = np.searchsorted(user_codes[order], np.arange(len(user_names) + 1))
+        for code, user_email in enumerate(user_names):
+            rows_for_user = order[bounds[code]:bounds[code + 1]]
+            self.users.setdefault(user_email, []).append({name: values[rows_for_user] for name, values in chunk.items()})
+        self.rows += len(rows)
+
+    def columns(self, user_email: str) -> Dict[str, np.ndarray]:
+        chunks = self.users.get(user_email, [])
+        return {name: np.concatenate([chunk[name] for chunk in chunks]) if chunks else np.empty(0, dtype)
+                for name, dtype in COLUMN_DTYPES.items()}
+
+
+def _merge(existing: Optional[Dict[str, np.ndarray]], columns: Dict[str, np.ndarray],
+           replaced: List[Tuple[int, int]] = ()) -> Dict[str, np.ndarray]:
+    """
+    existing plus new columns, sorted by time. Existing rows in a replaced
+    [start_ms, end_ms) range are dropped: columns holds that range in full.
+    """
+    if existing is not None:
+        keep = np.ones(len(existing['time_ms']), dtype=bool)
+        for start_ms, end_ms in replaced:
+            keep &= (existing['time_ms'] < start_ms) | (existing['time_ms'] >= end_ms)
+        columns = {name: np.concatenate([existing[name][keep], columns[name]]) for name in COLUMN_DTYPES}
+    order = np.argsort(columns['time_ms'], kind='stable')
+    return {name: values[order] for name, values in columns.items()}
+
+
+def _write_user(directory: str, columns: Dict[str, np.ndarray], before_ms: Optional[int] = None,
+                replaced: List[Tuple[int, int]] = ()):
+    """
+    Merge new columns into the files in directory, sorted by time and
+    without rows before before_ms or the existing rows in replaced ranges,
+    and swap the result in.
+    """
+    columns = _merge(_load_directory(directory, mmap_mode=None), columns, replaced)
+    if before_ms is not None:
+        columns = {name: values[columns['time_ms'] >= before_ms] for name, values in columns.items()}
+
+    if len(columns['time_ms']) == 0:
+        _swap(directory, None)
+        return
+
+    scratch = directory + '.tmp'
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    for name in COLUMN_DTYPES:
+        np.save(os.path.join(scratch, f"{name}.npy"), columns[name])
+    _swap(directory, scratch)
+
+
+def _swap(directory: str, replacement: Optional[str]):
+    """Replace directory with replacement (None removes it); open memory maps of the old files stay valid."""
+    retired = directory + '.old'
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.isdir(directory):
+        os.rename(directory, retired)
+    if replacement is not None:
+        os.rename(replacement, directory)
+    shutil.rmtree(retired, ignore_errors=True)
+
+
+def remove_user(database: str, user_email: str):
+    """Drop a user's copy, e.g. after their events were deleted from the database."""
+    _swap(os.path.join(store_path(database), user_key(user_email)), None)
+
+
+Watermark = Tuple[str, int, int, int, Optional[str], bool]
+
+
+def _watermarks(conn: sqlite3.Connection, exported: Dict[str, list]) -> List[Watermark]:
+    """
+    (name, start_ms, end_ms, rowid, id, stale) for every hot partition:
+    rows after rowid are not in the store yet. stale means the row the last
+    pass stopped at is gone or replaced, so its rowid may have been reused;
+    the partition is then read from the start and replaces the store's copy
+    of its month. A bare rowid (state from before ids were kept) counts as
+    stale.
+    """
+    marks = []
+    for name, start_ms, end_ms in partitions.list_partitions(conn):
+        last = exported.get(name) or [0, None]
+        last_rowid, last_id = (last, None) if isinstance(last, int) else last
+        stale = False
+        if last_rowid:
+            row = conn.execute(WATERMARK_TEMPLATE.format(partition=name), (last_rowid,)).fetchone()
+            stale = row is None or row[0] != last_id
+        if stale:
+            last_rowid, last_id = 0, None
+        marks.append((name, start_ms, end_ms, last_rowid, last_id, stale))
+    return marks
+
+
+def _export_partitions(conn: sqlite3.Connection, export: _Export, marks: List[Watermark],
+                       batch_size: int) -> Dict[str, list]:
+    """Read rows after each partition's watermark; returns the new [rowid, id] watermarks."""
+    high_water = {}
+    for name, _, _, last, last_id, _ in marks:
+        while True:
+            rows = conn.execute(EXPORT_TEMPLATE.format(partition=name), (last, batch_size)).fetchall()
+            if not rows:
+                break
+            export.add([row[2:] for row in rows])
+            last, last_id = rows[-1][0], rows[-1][1]
+        high_water[name] = [last, last_id]
+    return high_water
+
+
+def compact(database: str, before_ms: Optional[int] = None, batch_size: int = 50000,
+            busy_timeout: int = 5000) -> Dict[str, int]:
+    """
+    Export rows added since the last pass into the per-user files. With
+    before_ms, events older than that are also dropped from the store, the
+    same retention the database applies.
+    """
+    root = store_path(database)
+    os.makedirs(root, exist_ok=True)
+    state = _read_json(os.path.join(root, 'state.json'), {'partitions': {}, 'trimmed_before_ms': None})
+    export = _Export(_read_json(os.path.join(root, 'event_types.json'), []))
+
+    conn = sqlite3.connect(database)
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    try:
+        marks = _watermarks(conn, state['partitions'])
+        high_water = _export_partitions(conn, export, marks, batch_size)
+    finally:
+        conn.close()
+    replaced = [(start_ms, end_ms) for _, start_ms, end_ms, _, _, stale in marks if stale]
+
+    # New event types first, so no user file ever holds a code the list does not have
+    _write_json(os.path.join(root, 'event_types.json'), export.event_types)
+
+    users = set(export.users)
+    trim = before_ms is not None and before_ms > (state.get('trimmed_before_ms') or 0)
+    cutoff = before_ms if trim else None
+    if trim or replaced:
+        # Retention moved on, or a month was re-read: rewrite every user, not only the ones with new rows
+        keys = {user_key(user_email): user_email for user_email in users}
+        for entry in os.listdir(root):
+            if os.path.isdir(os.path.join(root, entry)) and '.' not in entry and entry not in keys:
+                _write_user(os.path.join(root, entry), export.columns(''), cutoff, replaced)
+    if trim:
+        state['trimmed_before_ms'] = before_ms
+    for user_email in users:
+        _write_user(os.path.join(root, user_key(user_email)), export.columns(user_email), cutoff, replaced)
+
+    state['partitions'] = high_water
+    _write_json(os.path.join(root, 'state.json'), state)
+    return {'rows': export.rows, 'users': len(users)}
+
+
+def rebuild(database: str, batch_size: int = 50000, busy_timeout: int = 5000) -> Dict[str, int]:
+    """Re-export every event, hot and archived, into a fresh store and swap it in."""
+    root = store_path(database)
+    scratch = root + '.rebuild'
+    shutil.rmtree(scratch, ignore_errors=True)
+    os.makedirs(scratch)
+    export = _Export([])
+
+    for path in archive.archive_files(database, 0, int(time.time() * 1000)):
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            cursor = conn.execute(ARCHIVED_EVENTS_SQL)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                export.add(rows)
+        except sqlite3.OperationalError:
+            # Retention already dropped this month's events
+            pass
+        finally:
+            conn.close()
+
+    conn = sqlite3.connect(database)
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    try:
+        high_water = _export_partitions(conn, export, _watermarks(conn, {}), batch_size)
+    finally:
+        conn.close()
+
+    _write_json(os.path.join(scratch, 'event_types.json'), export.event_types)
+    for user_email in export.users:
+        _write_user(os.path.join(scratch, user_key(user_email)), export.columns(user_email))
+    _write_json(os.path.join(scratch, 'state.json'), {'partitions': high_water, 'trimmed_before_ms': None})
+
+    _swap(root, scratch)
+    return {'rows': export.rows, 'users': len(export.users)}
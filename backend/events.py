@@ -0,0 +1,194 @@
+"""
+Asynchronous, batched ingestion of user_events.
+
+track_user_event used to open a connection, insert one row and commit inside
+the request, which put a second sync on the critical path of every payment
+and page view. Handlers now only put the row on a bounded in-memory queue. A
+background flusher drains it and writes each batch with executemany, in one
+transaction per shard file. A batch is flushed once it reaches max_batch rows
+or max_wait seconds after its first row, whichever comes first. At shutdown
+everything still queued is flushed.
+
+When the queue is full, record() waits up to block_timeout seconds for room
+(backpressure) and then drops the event and counts it, so analytics can slow
+a request down by a bounded amount but never fail it.
+"""
+import json
+import queue
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from partitions import insert_events
+
+# Position of user_email in a row, used to route it to its shard
+EMAIL_INDEX = 1
+
+_STOP = object()
+
+
+def parse_batch(body: str, mimetype: str) -> List[Any]:
+    """
+    Decode a client event batch: NDJSON (application/x-ndjson, one event per
+    line) or a JSON array. Raises ValueError if the body is neither.
+    """
+    if mimetype in ('application/x-ndjson', 'application/jsonl', 'application/json-seq'):
+        items = []
+        for number, line in enumerate(body.splitlines(), start=1):
+            line = line.strip().lstrip('\x1e')
+            if line:
+                try:
+                    items.append(json.loads(line))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"line {number}: {e.msg}")
+        return items
+
+    try:
+        items = json.loads(body)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"invalid JSON: {e.msg}")
+    if not isinstance(items, list):
+        raise ValueError("expected a JSON array of events")
+    return items
+
+
+class EventWriter:
+    """
+    A bounded queue of user_events rows and the thread that writes them.
+
+    Rows are tuples in partitions.COLUMNS order. route maps a user email
+    to the connection pool of the file that holds that user's events.
+    """
+    def __init__(self, route: Callable[[str], Any], max_batch: int = 500, max_wait: float = 0.2,
+                 queue_size: int = 10000, block_timeout: float = 0.0):
+        self.route = route
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.block_timeout = block_timeout
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._enqueued = 0
+        self._dropped = 0
+        self._written = 0
+        self._failed = 0
+        self._batches = 0
+        self._batch_max = 0
+        self._flush_total = 0.0
+        self._flush_max = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='event-writer', daemon=True)
+                self._thread.start()
+
+    def record(self, row: Tuple) -> bool:
+        """Queue one event row; False if it was dropped because the queue stayed full."""
+        self.start()
+        try:
+            if self.block_timeout > 0:
+                self._queue.put(row, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+            return False
+        with self._lock:
+            self._enqueued += 1
+        return True
+
+    def flush(self, timeout: Optional[float] = 5.0) -> bool:
+        """Wait until every event queued before this call has been written."""
+        if self._thread is None or not self._thread.is_alive():
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        """Write everything already queued, then stop the flusher thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _collect(self) -> Tuple[List[Tuple], List[threading.Event], bool]:
+        """Block for one row, then gather more until the batch is full or max_wait has passed."""
+        batch = []
+        waiters = []
+        item = self._queue.get()
+        deadline = time.monotonic() + self.max_wait
+        while True:
+            if item is _STOP:
+                return batch, waiters, True
+            if isinstance(item, threading.Event):
+                # A flush() call: write what we have now rather than waiting out max_wait
+                waiters.append(item)
+                return batch, waiters, False
+            batch.append(item)
+            if len(batch) >= self.max_batch:
+                return batch, waiters, False
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                return batch, waiters, False
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, waiters, stopping = self._collect()
+            if batch:
+                self._write(batch)
+            for waiter in waiters:
+                waiter.set()
+
+    def _write(self, batch: List[Tuple]):
+        by_pool = {}
+        for row in batch:
+            pool = self.route(row[EMAIL_INDEX])
+            by_pool.setdefault(id(pool), (pool, []))[1].append(row)
+
+        started = time.monotonic()
+        written = 0
+        for pool, rows in by_pool.values():
+            conn = pool.connection()
+            try:
+                insert_events(conn, rows)
+                conn.commit()
+                written += len(rows)
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"Error writing {len(rows)} user events: {e}")
+            finally:
+                conn.close()
+        elapsed = time.monotonic() - started
+
+        with self._lock:
+            self._batches += 1
+            self._written += written
+            self._failed += len(batch) - written
+            self._batch_max = max(self._batch_max, len(batch))
+            self._flush_total += elapsed
+            self._flush_max = max(self._flush_max, elapsed)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Queue depth, drop counter and batch statistics."""
+        with self._lock:
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'queued': self._queue.qsize(),
+                'enqueued': self._enqueued,
+                'written': self._written,
+                'dropped': self._dropped,
+                'failed': self._failed,
+                'batches': self._batches,
+                'batch_size_avg': round((self._written + self._failed) / self._batches, 2) if self._batches else 0.0,
+                'batch_size_max': self._batch_max,
+                'flush_avg_ms': round(self._flush_total / self._batches * 1000, 3) if self._batches else 0.0,
+                'flush_max_ms': round(self._flush_max * 1000, 3),
+            }
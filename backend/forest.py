@@ -0,0 +1,116 @@
+"""
+IsolationForest scoring in plain NumPy.
+
+IsolationForest.decision_function validates its input and then walks its
+100 trees one Python-level call at a time, which dominates the cost of
+scoring a single keystroke sample or session. compile() flattens a fitted
+forest into a few contiguous arrays, every tree's nodes one after another:
+
+    feature    int32    input column each split tests (0 at leaves)
+    threshold  float64  go left when x[feature] <= threshold
+    left       int32    index of the left child; a leaf points at itself
+    right      int32    index of the right child; a leaf points at itself
+    value      float64  at a leaf, the path length sklearn adds for it
+    roots      int32    index of each tree's root
+
+CompiledForest.decision_function then moves every (tree, sample) pair one
+level down per step, for all trees and samples at once, for as many steps
+as the deepest tree has levels. It follows sklearn's arithmetic exactly
+(float32 inputs, per-tree path lengths added in tree order), so its scores
+are bit-for-bit those of decision_function. Scoring needs only NumPy, and
+arrays() / from_arrays() round-trip the forest through np.savez.
+"""
+from typing import Dict
+
+import numpy as np
+
+ARRAY_NAMES = ('feature', 'threshold', 'left', 'right', 'value', 'roots')
+
+
+class CompiledForest:
+    """A fitted IsolationForest as flat arrays, scored without sklearn."""
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray, right: np.ndarray,
+                 value: np.ndarray, roots: np.ndarray, depth: int, denominator: float, offset: float):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.roots = roots
+        self.depth = int(depth)
+        self.denominator = float(denominator)
+        self.offset = float(offset)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in ARRAY_NAMES)
+
+    def leaves(self, X: np.ndarray) -> np.ndarray:
+        """Leaf index of every sample in every tree, shape (trees, samples)."""
+        # sklearn's trees compare float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])
+        nodes = np.repeat(self.roots[:, None], X.shape[0], axis=1)
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return nodes
+
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        """IsolationForest.score_samples for a 2-D array of scaled samples."""
+        # cumsum adds tree by tree, in the order sklearn's loop does
+        depths = np.cumsum(self.value[self.leaves(X)], axis=0)[-1]
+        # A forest fitted on one sample has no depth to normalise by; sklearn uses 1 there
+        ratio = depths / self.denominator if self.denominator != 0 else np.ones_like(depths)
+        return -(2 ** (-ratio))
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """IsolationForest.decision_function for a 2-D array of scaled samples."""
+        return self.score_samples(X) - self.offset
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """The forest as named arrays, e.g. for np.savez."""
+        arrays = {name: getattr(self, name) for name in ARRAY_NAMES}
+        arrays['scalars'] = np.array([self.depth, self.denominator, self.offset], dtype=np.float64)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays) -> 'CompiledForest':
+        depth, denominator, offset = arrays['scalars']
+        return cls(*(np.asarray(arrays[name]) for name in ARRAY_NAMES), depth, denominator, offset)
+
+
+def compile(model) -> CompiledForest:
+    """Flatten a fitted sklearn IsolationForest."""
+    from sklearn.ensemble._iforest import _average_path_length
+
+    # With every feature in play, sklearn applies the trees to the input as it is
+    subsample_features = model._max_features != model.n_features_in_
+    features, thresholds, lefts, rights, values, roots = [], [], [], [], [], []
+    depth = 0
+    start = 0
+    for index, (estimator, columns) in enumerate(zip(model.estimators_, model.estimators_features_)):
+        tree = estimator.tree_
+        count = tree.node_count
+        is_leaf = tree.children_left == -1
+        nodes = np.arange(start, start + count, dtype=np.int32)
+
+        feature = np.where(is_leaf, 0, tree.feature)
+        if subsample_features:
+            feature = np.asarray(columns)[feature]
+        features.append(feature.astype(np.int32))
+        thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+        lefts.append(np.where(is_leaf, nodes, tree.children_left + start).astype(np.int32))
+        rights.append(np.where(is_leaf, nodes, tree.children_right + start).astype(np.int32))
+        # The same expression sklearn evaluates for the leaf a sample lands in
+        value = (model._decision_path_lengths[index] + model._average_path_length_per_tree[index] - 1.0)
+        values.append(np.where(is_leaf, value, 0.0))
+        roots.append(start)
+        depth = max(depth, tree.max_depth)
+        start += count
+
+    denominator = len(model.estimators_) * _average_path_length([model._max_samples])[0]
+    return CompiledForest(
+        np.concatenate(features), np.concatenate(thresholds).astype(np.float64),
+        np.concatenate(lefts), np.concatenate(rights), np.concatenate(values).astype(np.float64),
+        np.array(roots, dtype=np.int32), depth, denominator, model.offset_)
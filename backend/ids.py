@@ -0,0 +1,52 @@
+"""
+Time-ordered row ids.
+
+Primary keys used to come from uuid.uuid4(), so each insert landed at a
+random position in the table's B-tree (and in every index that carries the
+id), splitting pages all over the file. new_id() returns a UUIDv7 (RFC 9562)
+in the same 36-character text form instead: the first 48 bits are the Unix
+time in milliseconds, so ids sort by creation time and new rows are
+appended at the right-hand edge of the index.
+
+Within one process ids are also strictly increasing. The 12 bits after the
+timestamp are a counter that starts at a random value each millisecond;
+if it runs out, the timestamp is advanced by one. The remaining 62 bits
+are random.
+"""
+import os
+import threading
+import time
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+# The counter starts below 2**11, leaving at least 2048 ids per millisecond before it borrows
+COUNTER_START_BITS = 11
+COUNTER_MAX = 0xFFF
+
+
+def format_id(timestamp_ms: int, counter: int, random_bits: int) -> str:
+    """UUIDv7 text for a millisecond timestamp, a 12-bit counter and 62 random bits."""
+    value = '%012x7%03x%016x' % (timestamp_ms & 0xFFFFFFFFFFFF, counter & COUNTER_MAX,
+                                 (2 << 62) | (random_bits & ((1 << 62) - 1)))
+    return f"{value[:8]}-{value[8:12]}-{value[12:16]}-{value[16:20]}-{value[20:]}"
+
+
+def new_id() -> str:
+    """A new time-ordered id, greater than every id this process handed out before."""
+    global _last_ms, _counter
+    random_bits = int.from_bytes(os.urandom(10), 'big')
+    now_ms = time.time_ns() // 1000000
+    with _lock:
+        if now_ms > _last_ms:
+            _last_ms = now_ms
+            _counter = random_bits >> (80 - COUNTER_START_BITS)
+        else:
+            # Same millisecond, or the clock went back: keep counting from the last id
+            _counter += 1
+            if _counter > COUNTER_MAX:
+                _last_ms += 1
+                _counter = random_bits >> (80 - COUNTER_START_BITS)
+        return format_id(_last_ms, _counter, random_bits)
+
@@ -0,0 +1,386 @@
+"""
+Keystroke-dynamics authentication: the per-user model and the registry
+that keeps one for every enrolled user.
+
+Each enrolled user's scaler and IsolationForest are saved as plain arrays
+(the forest compiled by forest.compile), together with the unscaled rows
+they were fitted on, in one .npz file under the model directory. The file
+is named after a hash of the user's email, so the email never appears in a
+file name. Loading and scoring need only NumPy; scikit-learn is imported
+only to fit a model. The file carries a version stamp that goes up by one
+every time the user's model is saved. ModelRegistry loads a model the
+first time it is asked for it, typically on the user's first biometric
+login, and keeps recently used models in memory up to a byte budget,
+evicting the least recently used first. Nothing is trained or loaded at
+startup, so boot time does not depend on how many users are enrolled.
+"""
+import collections
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+import forest
+
+# Layout of the saved state; files written with another format are ignored
+FORMAT_VERSION = 2
+
+# Columns of the enrollment CSV that are not features
+NON_FEATURE_COLUMNS = ['subject', 'sessionIndex', 'rep', 'mistake_counter']
+
+
+class KeystrokeAuthenticator:
+    """
+    A class to authenticate a user based on their keystroke dynamics.
+    This version correctly handles negative latencies and mistake counts.
+    """
+    def __init__(self):
+        # The sklearn objects exist only on a model fitted in this process
+        self.model = None
+        self.scaler = None
+        self.forest = None
+        self.mean_ = None
+        self.scale_ = None
+        # Unscaled rows the model was fitted on; saved with it so it can be refitted with new samples
+        self.training_ = None
+        self.feature_columns = None
+        self.min_score_ = None
+        self.max_score_ = None
+        # Set by ModelRegistry.save; 0 for a model that was never saved
+        self.version = 0
+        self.samples = 0
+        self.sklearn_version = None
+
+    def fit(self, genuine_user_df: pd.DataFrame):
+        import sklearn
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+
+        print(f"Training authenticator for a user...")
+        self.feature_columns = genuine_user_df.columns.drop(NON_FEATURE_COLUMNS, errors='ignore')
+        df_features = genuine_user_df[self.feature_columns].copy()
+
+        print(f"Training on {len(df_features)} samples with {len(self.feature_columns)} features.")
+
+        self.scaler = StandardScaler()
+        X_scaled = self.scaler.fit_transform(df_features)
+
+        self.model = IsolationForest(contamination='auto', random_state=42)
+        self.model.fit(X_scaled)
+
+        training_scores = self.model.decision_function(X_scaled)
+        self.min_score_ = training_scores.min()
+        self.max_score_ = training_scores.max()
+        self.samples = len(df_features)
+        self.training_ = df_features.to_numpy(dtype=np.float64)
+        self.sklearn_version = sklearn.__version__
+        self.mean_ = self.scaler.mean_
+        self.scale_ = self.scaler.scale_
+        self.forest = forest.compile(self.model)
+        self._prepare()
+
+        print("Training complete. The system is ready.")
+
+    def _prepare(self):
+        """Fix the feature order and scaler arrays predict uses, once per fitted model."""
+        self._features = tuple(self.feature_columns)
+        self._mean = np.asarray(self.mean_, dtype=np.float64)
+        self._scale = np.asarray(self.scale_, dtype=np.float64)
+
+    def row(self, keystroke_data: dict) -> np.ndarray:
+        """One sample as an unscaled float64 row in the fitted column order."""
+        try:
+            row = np.fromiter(map(keystroke_data.__getitem__, self._features), dtype=np.float64,
+                              count=len(self._features))
+        except KeyError as e:
+            raise ValueError(f"Input data is missing a required feature: {e}")
+        except Exception as e:
+            raise ValueError(f"Error processing input data: {e}")
+        if not np.isfinite(row).all():
+            raise ValueError("Input data contains NaN or infinite values")
+        return row
+
+    def vector(self, keystroke_data: dict) -> np.ndarray:
+        """
+        One sample as a float64 row in the fitted column order, scaled the way
+        StandardScaler.transform does it ((x - mean) / scale, in place), without
+        building a DataFrame.
+        """
+        row = self.row(keystroke_data)
+        np.subtract(row, self._mean, out=row)
+        np.divide(row, self._scale, out=row)
+        return row.reshape(1, -1)
+
+    def predict(self, keystroke_data: dict) -> dict:
+        if self.forest is None:
+            raise RuntimeError("The authenticator has not been fitted yet. Call .fit() first.")
+
+        input_scaled = self.vector(keystroke_data)
+        raw_score = self.forest.decision_function(input_scaled)[0]
+        return self._result(raw_score)
+
+    def predict_many(self, samples: List[dict]) -> List[dict]:
+        """
+        predict for a list of samples, scaled and scored as one matrix. Each
+        sample gets exactly what predict would return for it; a sample predict
+        would reject gets {"error": ...} instead, without failing the others.
+        """
+        if self.forest is None:
+            raise RuntimeError("The authenticator has not been fitted yet. Call .fit() first.")
+
+        results: List[Optional[dict]] = [None] * len(samples)
+        rows, positions = [], []
+        for position, sample in enumerate(samples):
+            try:
+                rows.append(self.row(sample))
+                positions.append(position)
+            except ValueError as e:
+                results[position] = {"error": str(e)}
+        if rows:
+            X = np.vstack(rows)
+            np.subtract(X, self._mean, out=X)
+            np.divide(X, self._scale, out=X)
+            for position, raw_score in zip(positions, self.forest.decision_function(X)):
+                results[position] = self._result(raw_score)
+        return results
+
+    def _result(self, raw_score: float) -> dict:
+        status = "Anomaly" if raw_score < 0 else "Normal"
+
+        # Safely calculate confidence
+        score_range = self.max_score_ - self.min_score_
+        if score_range == 0: # Avoid division by zero if all training scores were identical
+             normalized_score = 0.5
+        else:
+            normalized_score = (raw_score - self.min_score_) / score_range
+
+        normalized_score = np.clip(normalized_score, 0, 1)
+        anomaly_confidence = (1 - normalized_score) * 100
+
+        return {
+            "status": status,
+            "anomaly_confidence_percent": round(anomaly_confidence, 2),
+            "raw_score": round(raw_score, 4)
+        }
+
+    @property
+    def nbytes(self) -> int:
+        return self.forest.nbytes + self._mean.nbytes + self._scale.nbytes
+
+    def state(self) -> Dict[str, np.ndarray]:
+        """Everything predict needs, as named arrays for np.savez."""
+        meta = {
+            'feature_columns': list(self.feature_columns),
+            'min_score': float(self.min_score_),
+            'max_score': float(self.max_score_),
+            'samples': self.samples,
+            'sklearn_version': self.sklearn_version,
+        }
+        state = {
+            'meta': np.array(json.dumps(meta)),
+            'mean': self._mean,
+            'scale': self._scale,
+            **{f"forest_{name}": array for name, array in self.forest.arrays().items()},
+        }
+        if self.training_ is not None:
+            state['training'] = self.training_
+        return state
+
+    @classmethod
+    def from_state(cls, state: Dict[str, np.ndarray], version: int = 0) -> 'KeystrokeAuthenticator':
+        meta = json.loads(str(state['meta']))
+        authenticator = cls()
+        authenticator.feature_columns = pd.Index(meta['feature_columns'])
+        authenticator.mean_ = state['mean']
+        authenticator.scale_ = state['scale']
+        authenticator.forest = forest.CompiledForest.from_arrays(
+            {name[len('forest_'):]: array for name, array in state.items() if name.startswith('forest_')})
+        authenticator.min_score_ = meta['min_score']
+        authenticator.max_score_ = meta['max_score']
+        authenticator.samples = meta['samples']
+        authenticator.sklearn_version = meta['sklearn_version']
+        authenticator.version = version
+        authenticator._prepare()
+        return authenticator
+
+
+def fit_from_csv(path: str, subject: str) -> KeystrokeAuthenticator:
+    """Fit a model on one subject's rows of an enrollment CSV (collected_keystroke_data.csv)."""
+    df = pd.read_csv(path)
+    user_df = df[df['subject'] == subject].copy()
+    if user_df.empty:
+        raise ValueError(f"No data found for subject '{subject}' in the CSV file.")
+    authenticator = KeystrokeAuthenticator()
+    authenticator.fit(user_df)
+    return authenticator
+
+
+class ModelRegistry:
+    """
+    Per-user keystroke models saved under root, with the recently used ones
+    kept in memory up to memory_budget bytes (the size of their arrays).
+    """
+    def __init__(self, root: str, memory_budget: int = 64 * 1024 * 1024):
+        self.root = root
+        self.memory_budget = memory_budget
+        self._models: 'collections.OrderedDict[str, tuple]' = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+        # Metrics
+        self._hits = 0
+        self._misses = 0
+        self._loads = 0
+        self._evicted = 0
+        self._load_failures = 0
+        self._saves = 0
+        self._last_version = 0
+        self._last_swap_ms = None
+        self._max_swap_ms = 0.0
+
+    def path(self, user_email: str, suffix: str = '.npz') -> str:
+        """Model file for a user; emails are hashed so they never appear in file names."""
+        key = hashlib.sha256(user_email.encode('utf-8')).hexdigest()[:32]
+        return os.path.join(self.root, f"{key}{suffix}")
+
+    def enrolled(self, user_email: str) -> bool:
+        return os.path.exists(self.path(user_email))
+
+    def get(self, user_email: str) -> Optional[KeystrokeAuthenticator]:
+        """The user's model, loaded from disk on first use, or None if they are not enrolled."""
+        with self._lock:
+            entry = self._models.get(user_email)
+            if entry is not None:
+                self._models.move_to_end(user_email)
+                self._hits += 1
+                return entry[0]
+            self._misses += 1
+
+        # Read outside the lock so a slow load does not hold up other users' logins
+        loaded = self._load(user_email)
+        if loaded is None:
+            return None
+        with self._lock:
+            entry = self._models.get(user_email)
+            if entry is not None and entry[0].version >= loaded[0].version:
+                # Another request loaded it (or a newer one was saved) in the meantime
+                return entry[0]
+            self._install(user_email, *loaded)
+            return loaded[0]
+
+    def save(self, user_email: str, authenticator: KeystrokeAuthenticator) -> int:
+        """
+        Write a fitted model as the user's next version, replace the cached one, and return the version.
+        The file is renamed into place and the cached entry replaced in one step, so a reader gets either
+        the old model or the new one; swap latency is the time from this call to the new one being served.
+        """
+        started = time.perf_counter()
+        path = self.path(user_email)
+        os.makedirs(self.root, exist_ok=True)
+        with self._save_lock:
+            previous = self._read(path, header_only=True)
+            version = (previous['version'] if previous else 0) + 1
+            header = {
+                'format': FORMAT_VERSION,
+                'version': version,
+                'saved_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            }
+            with open(path + '.tmp', 'wb') as f:
+                np.savez(f, header=np.array(json.dumps(header)), **authenticator.state())
+            os.replace(path + '.tmp', path)
+
+        saved = KeystrokeAuthenticator.from_state(authenticator.state(), version)
+        with self._lock:
+            self._install(user_email, saved, saved.nbytes)
+            swap_ms = (time.perf_counter() - started) * 1000
+            self._saves += 1
+            self._last_version = version
+            self._last_swap_ms = swap_ms
+            self._max_swap_ms = max(self._max_swap_ms, swap_ms)
+        return version
+
+    def training(self, user_email: str) -> Optional[np.ndarray]:
+        """The unscaled rows the user's saved model was fitted on, or None."""
+        try:
+            with np.load(self.path(user_email), allow_pickle=False) as data:
+                return data['training'] if 'training' in data.files else None
+        except FileNotFoundError:
+            return None
+
+    def remove(self, user_email: str):
+        """Forget a user's model, on disk and in memory, along with any samples buffered for it."""
+        with self._lock:
+            entry = self._models.pop(user_email, None)
+            if entry is not None:
+                self._bytes -= entry[1]
+        for suffix in ('.npz', '.buffer'):
+            try:
+                os.remove(self.path(user_email, suffix))
+            except FileNotFoundError:
+                pass
+
+    def _read(self, path: str, header_only: bool = False) -> Optional[Dict[str, Any]]:
+        try:
+            # allow_pickle=False: a model file can only ever hold plain arrays
+            with np.load(path, allow_pickle=False) as data:
+                saved = json.loads(str(data['header']))
+                if saved.get('format') != FORMAT_VERSION:
+                    raise ValueError(f"{path} has model format {saved.get('format')}, expected {FORMAT_VERSION}")
+                if not header_only:
+                    saved['state'] = {name: data[name] for name in data.files if name != 'header'}
+        except FileNotFoundError:
+            return None
+        return saved
+
+    def _load(self, user_email: str) -> Optional[tuple]:
+        path = self.path(user_email)
+        try:
+            saved = self._read(path)
+            if saved is None:
+                return None
+            authenticator = KeystrokeAuthenticator.from_state(saved['state'], saved['version'])
+        except Exception as e:
+            print(f"Error loading keystroke model {path}: {e}")
+            with self._lock:
+                self._load_failures += 1
+            return None
+        with self._lock:
+            self._loads += 1
+        return authenticator, authenticator.nbytes
+
+    def _install(self, user_email: str, authenticator: KeystrokeAuthenticator, size: int):
+        """Cache a model, evicting the least recently used ones beyond the budget. Caller holds the lock."""
+        entry = self._models.pop(user_email, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+        self._models[user_email] = (authenticator, size)
+        self._bytes += size
+        # The newest entry always stays, even if it alone is over budget
+        while self._bytes > self.memory_budget and len(self._models) > 1:
+            _, (_, evicted_size) = self._models.popitem(last=False)
+            self._bytes -= evicted_size
+            self._evicted += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'models': len(self._models),
+                'bytes': self._bytes,
+                'memory_budget': self.memory_budget,
+                'hits': self._hits,
+                'misses': self._misses,
+                'loads': self._loads,
+                'evicted': self._evicted,
+                'load_failures': self._load_failures,
+                'saves': self._saves,
+                'last_saved_version': self._last_version,
+                'last_swap_ms': round(self._last_swap_ms, 2) if self._last_swap_ms is not None else None,
+                'max_swap_ms': round(self._max_swap_ms, 2),
+            }
@@ -0,0 +1,168 @@
+"""
+In-memory buffer of each active user's current session.
+
+GET /api/behavior/current-session defines the session as everything since
+the user's latest login_success. Answering it from SQL takes a MAX over
+their logins and a range read over every partition since, on each poll.
+LiveSessions keeps that list in memory instead. track_user_event feeds it:
+
+- login_success starts a new session, replacing the old one;
+- logout ends it, and the entry is dropped;
+- any other event is appended to the user's ring buffer, which keeps the
+  latest max_events events.
+
+A user idle for longer than the session timeout is evicted, and so is the
+least recently active user once there are more than max_users. Sessions
+that started before this process did (e.g. after a restart) are marked
+incomplete. The endpoint answers those once from SQL and calls seed(),
+which merges the SQL result with anything recorded here in the meantime.
+
+The buffer belongs to one process. Run a single app process, or turn it
+off with LIVE_SESSION_MAX_USERS=0, since each worker would only see the
+events it tracked itself.
+"""
+import bisect
+import collections
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+SESSION_START = 'login_success'
+SESSION_END = 'logout'
+
+
+def session_event(row: Sequence) -> Dict[str, Any]:
+    """The current-session response item for a user_events row (partitions.COLUMNS order)."""
+    return {
+        'id': row[0],
+        'event_type': row[2],
+        'time': row[3],
+        'page_url': row[4],
+        # The column is REAL, so SQL hands these back as floats
+        'transaction_amount': None if row[5] is None else float(row[5]),
+        'additional_data': row[7],
+    }
+
+
+class _Session:
+    __slots__ = ('start_ms', 'times', 'events', 'last_active')
+
+    def __init__(self, start_ms: Optional[int], max_events: int):
+        # start_ms is None while the login that began the session has not been seen
+        self.start_ms = start_ms
+        self.times = collections.deque(maxlen=max_events)
+        self.events = collections.deque(maxlen=max_events)
+        self.last_active = time.monotonic()
+
+    def add(self, time_ms: int, event: Dict[str, Any]):
+        if not self.times or time_ms >= self.times[-1]:
+            self.times.append(time_ms)
+            self.events.append(event)
+            return
+        # A late client-side event: keep the buffer in time order
+        merged = sorted(zip(self.times, self.events), key=lambda item: item[0])
+        position = bisect.bisect_right([t for t, _ in merged], time_ms)
+        merged.insert(position, (time_ms, event))
+        self.times.clear()
+        self.events.clear()
+        for t, e in merged:
+            self.times.append(t)
+            self.events.append(e)
+
+
+class LiveSessions:
+    """Per-user ring buffers of current-session events, bounded in length, idle time and user count."""
+    def __init__(self, max_events: int = 500, timeout_seconds: float = 1800.0, max_users: int = 10000):
+        self.max_events = max_events
+        self.timeout_seconds = timeout_seconds
+        self.max_users = max_users
+        self._sessions: 'collections.OrderedDict[str, _Session]' = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._hits = 0
+        self._misses = 0
+        self._evicted = 0
+
+    def record(self, row: Sequence):
+        """Feed one user_events row (partitions.COLUMNS order) that has been queued for writing."""
+        if self.max_users <= 0:
+            return
+        user_email, event_type, time_ms = row[1], row[2], row[-1]
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(user_email)
+            if event_type == SESSION_START:
+                if session is not None and session.start_ms is not None and time_ms < session.start_ms:
+                    return
+                session = self._sessions[user_email] = _Session(time_ms, self.max_events)
+            elif event_type == SESSION_END:
+                self._sessions.pop(user_email, None)
+                return
+            elif session is None:
+                session = self._sessions[user_email] = _Session(None, self.max_events)
+            elif session.start_ms is not None and time_ms < session.start_ms:
+                return
+            session.add(time_ms, session_event(row))
+            session.last_active = time.monotonic()
+            self._sessions.move_to_end(user_email)
+            while len(self._sessions) > self.max_users:
+                self._sessions.popitem(last=False)
+                self._evicted += 1
+
+    def current(self, user_email: str) -> Optional[List[Dict[str, Any]]]:
+        """The user's session events, oldest first, or None if only SQL can answer."""
+        with self._lock:
+            session = self._sessions.get(user_email)
+            if session is None or session.start_ms is None or self._idle(session):
+                self._misses += 1
+                return None
+            self._hits += 1
+            return list(session.events)
+
+    def seed(self, user_email: str, start_ms: int, rows: Sequence[Dict[str, Any]]):
+        """
+        Install a session read from SQL (response items with a time_ms key),
+        merged with events recorded here since. A session this process saw
+        start is newer and is kept as it is.
+        """
+        if self.max_users <= 0:
+            return
+        with self._lock:
+            existing = self._sessions.get(user_email)
+            if existing is not None and existing.start_ms is not None:
+                return
+            session = _Session(start_ms, self.max_events)
+            seen = set()
+            for row in rows:
+                event = dict(row)
+                seen.add(event['id'])
+                session.add(event.pop('time_ms'), event)
+            if existing is not None:
+                for time_ms, event in zip(existing.times, existing.events):
+                    if time_ms >= start_ms and event['id'] not in seen:
+                        session.add(time_ms, event)
+                session.last_active = existing.last_active
+            self._sessions[user_email] = session
+            self._sessions.move_to_end(user_email)
+
+    def _idle(self, session: _Session) -> bool:
+        return time.monotonic() - session.last_active > self.timeout_seconds
+
+    def _expire(self):
+        # Entries are in order of last activity, so the idle ones are at the front
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if not self._idle(session):
+                break
+            self._sessions.popitem(last=False)
+            self._evicted += 1
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'users': len(self._sessions),
+                'hits': self._hits,
+                'misses': self._misses,
+                'evicted': self._evicted,
+            }
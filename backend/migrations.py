@@ -0,0 +1,513 @@
+"""
+Versioned schema migrations for the banking database.
+
+Each Migration has a version number, DDL that is applied in one short
+transaction, and optional Backfills that rewrite existing rows in bounded
+rowid batches (one transaction per batch) so a large table never holds
+SQLite's write lock for long. Applied versions are recorded in the
+schema_version table; when the schema is current, migrate() costs a single
+version lookup.
+"""
+import sqlite3
+import time
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import activity
+import partitions
+import rollups
+
+
+class Backfill:
+    """
+    An UPDATE over existing rows, run in rowid batches. For work an UPDATE
+    cannot express, such as moving rows to another table, give statements
+    instead: each batch runs them in order with its (low, high] rowid range
+    as the two parameters.
+    """
+    def __init__(self, table: str, assignments: str = '', where: str = '1', statements: Sequence[str] = ()):
+        self.table = table
+        self.assignments = assignments
+        self.where = where
+        self.statements = statements
+
+
+class Migration:
+    """
+    One schema change: columns and statements in a transaction, then batched
+    backfills, then finish (if any) in the short transaction that records it.
+
+    A migration with backfills is recorded only after they finish, so its
+    statements must be safe to re-run (IF NOT EXISTS and the like).
+    """
+    def __init__(self, version: int, name: str, statements: Sequence[str] = (),
+                 columns: Sequence[Tuple[str, str, str]] = (), backfills: Sequence[Backfill] = (),
+                 apply: Optional[Callable[[sqlite3.Connection], None]] = None,
+                 finish: Optional[Callable[[sqlite3.Connection], None]] = None):
+        self.version = version
+        self.name = name
+        self.statements = statements
+        self.columns = columns
+        self.backfills = backfills
+        self.apply = apply
+        self.finish = finish
+
+
+BASELINE_TABLES = [
+    '''
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            email TEXT UNIQUE NOT NULL,
+            password TEXT NOT NULL,
+            first_name TEXT NOT NULL,
+            last_name TEXT NOT NULL,
+            phone TEXT NOT NULL,
+            balance REAL DEFAULT 100000.0,
+            account_number TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS user_events (
+            id TEXT PRIMARY KEY,
+            user_email TEXT NOT NULL,
+            event_type TEXT NOT NULL,
+            time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            page_url TEXT,
+            transaction_amount REAL DEFAULT 0,
+            transaction_type TEXT,
+            additional_data TEXT,
+            FOREIGN KEY (user_email) REFERENCES users (email)
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS billers (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            provider_name TEXT NOT NULL, -- e.g., 'KSEB', 'Airtel'
+            category TEXT NOT NULL, -- e.g., 'Electricity Bill', 'Mobile Recharge'
+            consumer_id TEXT NOT NULL, -- The user's specific account/phone number
+            nickname TEXT, -- e.g., 'Home Electricity', 'My Jio Number'
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS stocks (
+            symbol TEXT PRIMARY KEY,
+            name TEXT NOT NULL,
+            price REAL NOT NULL,
+            change REAL DEFAULT 0,
+            change_percent REAL DEFAULT 0,
+            volume TEXT,
+            high REAL,
+            low REAL,
+            category TEXT,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS portfolio (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            shares INTEGER NOT NULL,
+            buy_price REAL NOT NULL,
+            total_investment REAL NOT NULL,
+            purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (symbol) REFERENCES stocks (symbol)
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS transactions (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            type TEXT NOT NULL,
+            symbol TEXT,
+            shares INTEGER,
+            amount REAL NOT NULL,
+            price REAL,
+            description TEXT NOT NULL,
+            status TEXT DEFAULT 'PENDING',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            reference TEXT,
+            counterparty TEXT,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS autopay_rules (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            biller_id TEXT NOT NULL,
+            max_amount REAL NOT NULL,
+            enabled INTEGER DEFAULT 1, -- 1 for true, 0 for false
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (biller_id) REFERENCES billers (id) ON DELETE CASCADE
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS fixed_deposits (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            amount REAL NOT NULL,
+            interest_rate REAL NOT NULL,
+            tenure INTEGER NOT NULL,
+            start_date TIMESTAMP NOT NULL,
+            maturity_date TIMESTAMP NOT NULL,
+            type TEXT NOT NULL,
+            status TEXT DEFAULT 'ACTIVE',
+            interest_earned REAL DEFAULT 0,
+            maturity_amount REAL NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS beneficiaries (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            account_number TEXT NOT NULL,
+            ifsc_code TEXT,
+            bank_name TEXT,
+            account_type TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id)
+        )
+    ''',
+    '''
+        CREATE TABLE IF NOT EXISTS tax_payments (
+            id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            transaction_id TEXT NOT NULL,
+            tax_type TEXT NOT NULL, -- 'DIRECT', 'GST', 'STATE'
+            -- Direct tax fields
+            pan_tan TEXT,
+            assessment_year TEXT,
+            tax_applicable TEXT,
+            payment_type TEXT,
+            -- GST fields
+            gstin TEXT,
+            cpin TEXT,
+            cgst REAL DEFAULT 0,
+            sgst REAL DEFAULT 0,
+            igst REAL DEFAULT 0,
+            cess REAL DEFAULT 0,
+            -- State tax fields
+            state TEXT,
+            municipality TEXT,
+            service_type TEXT,
+            consumer_id TEXT,
+            -- Common fields
+            amount REAL NOT NULL,
+            status TEXT DEFAULT 'PENDING',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (transaction_id) REFERENCES transactions (id)
+        )
+    ''',
+]
+
+# Composite indexes for the per-user access paths used by the API handlers.
+# tests/test_query_plans.py fails if a handler query stops using them.
+HOT_PATH_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_transactions_user_created ON transactions (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_user_type_created ON transactions (user_id, type, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_user_events_email_type_time ON user_events (user_email, event_type, time)",
+    "CREATE INDEX IF NOT EXISTS idx_user_events_email_time ON user_events (user_email, time)",
+    "CREATE INDEX IF NOT EXISTS idx_portfolio_user_symbol ON portfolio (user_id, symbol)",
+    "CREATE INDEX IF NOT EXISTS idx_billers_user_created ON billers (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_beneficiaries_user_created ON beneficiaries (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_fixed_deposits_user_created ON fixed_deposits (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_tax_payments_user_created ON tax_payments (user_id, created_at)",
+    "CREATE INDEX IF NOT EXISTS idx_autopay_rules_user ON autopay_rules (user_id)",
+]
+
+# Text timestamps in any format SQLite understands (CURRENT_TIMESTAMP, ISO 'T'
+# strings, str(datetime)) as integer milliseconds since the Unix epoch, UTC.
+def epoch_ms_sql(column: str) -> str:
+    return f"CAST(ROUND((julianday({column}) - 2440587.5) * 86400000.0) AS INTEGER)"
+
+
+# (table, text column, integer epoch-ms column)
+EPOCH_MS_COLUMNS = [
+    ('transactions', 'created_at', 'created_at_ms'),
+    ('user_events', 'time', 'time_ms'),
+    ('fixed_deposits', 'created_at', 'created_at_ms'),
+    ('tax_payments', 'created_at', 'created_at_ms'),
+]
+
+# Rows inserted without an explicit epoch value get it from the text column
+EPOCH_MS_TRIGGERS = [
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_{ms_column} AFTER INSERT ON {table}
+        WHEN NEW.{ms_column} IS NULL
+        BEGIN
+            UPDATE {table} SET {ms_column} = {epoch_ms_sql('NEW.' + column)} WHERE rowid = NEW.rowid;
+        END
+    '''
+    for table, column, ms_column in EPOCH_MS_COLUMNS
+]
+
+# Range and ORDER BY queries on the epoch columns replace the text-timestamp indexes
+EPOCH_MS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_transactions_user_created_ms ON transactions (user_id, created_at_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_user_type_created_ms ON transactions (user_id, type, created_at_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_user_events_email_type_time_ms ON user_events (user_email, event_type, time_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_user_events_email_time_ms ON user_events (user_email, time_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_fixed_deposits_user_created_ms ON fixed_deposits (user_id, created_at_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_tax_payments_user_created_ms ON tax_payments (user_id, created_at_ms)",
+    "DROP INDEX IF EXISTS idx_transactions_user_created",
+    "DROP INDEX IF EXISTS idx_transactions_user_type_created",
+    "DROP INDEX IF EXISTS idx_user_events_email_type_time",
+    "DROP INDEX IF EXISTS idx_user_events_email_time",
+    "DROP INDEX IF EXISTS idx_fixed_deposits_user_created",
+    "DROP INDEX IF EXISTS idx_tax_payments_user_created",
+]
+
+# Email -> user id lookups for the shard router; kept in step with users by triggers
+USER_DIRECTORY = [
+    """
+        CREATE TABLE IF NOT EXISTS user_directory (
+            email TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL
+        ) WITHOUT ROWID
+    """,
+    """
+        CREATE TABLE IF NOT EXISTS shard_layout (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard_count INTEGER NOT NULL
+        )
+    """,
+    """
+        CREATE TRIGGER IF NOT EXISTS trg_users_directory_insert AFTER INSERT ON users
+        BEGIN
+            INSERT OR REPLACE INTO user_directory (email, user_id) VALUES (NEW.email, NEW.id);
+        END
+    """,
+    """
+        CREATE TRIGGER IF NOT EXISTS trg_users_directory_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM user_directory WHERE email = OLD.email AND user_id = OLD.id;
+        END
+    """,
+    "INSERT OR IGNORE INTO user_directory (email, user_id) SELECT email, id FROM users",
+]
+
+# The archiver finds old rows by timestamp alone and records how far back it has moved them
+ARCHIVE_TIER = [
+    """
+        CREATE TABLE IF NOT EXISTS archive_state (
+            table_name TEXT PRIMARY KEY,
+            archived_before_ms INTEGER NOT NULL
+        )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_transactions_created_ms ON transactions (created_at_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_user_events_time_ms ON user_events (time_ms)",
+]
+
+# Compact per-file integer user keys for the high-volume tables; the API keeps the UUIDs.
+# A key is only meaningful inside its shard file (a user gets a new one when rebalanced).
+USER_KEY_TABLES = ['transactions', 'portfolio']
+
+USER_KEYS = [
+    # Existing users are numbered in the DDL transaction, before the trigger below hands out MAX + 1
+    "UPDATE users SET user_key = rowid WHERE user_key IS NULL",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_user_key ON users (user_key)",
+    """
+        CREATE TRIGGER IF NOT EXISTS trg_users_user_key AFTER INSERT ON users
+        WHEN NEW.user_key IS NULL
+        BEGIN
+            UPDATE users SET user_key = (SELECT COALESCE(MAX(user_key), 0) + 1 FROM users) WHERE rowid = NEW.rowid;
+        END
+    """,
+] + [
+    f'''
+        CREATE TRIGGER IF NOT EXISTS trg_{table}_user_key AFTER INSERT ON {table}
+        WHEN NEW.user_key IS NULL
+        BEGIN
+            UPDATE {table} SET user_key = (SELECT user_key FROM users WHERE id = NEW.user_id) WHERE rowid = NEW.rowid;
+        END
+    '''
+    for table in USER_KEY_TABLES
+]
+
+# Per-user access paths on the integer key replace the UUID text ones
+USER_KEY_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_transactions_user_key_created_ms ON transactions (user_key, created_at_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_transactions_user_key_type_created_ms ON transactions (user_key, type, created_at_ms)",
+    "CREATE INDEX IF NOT EXISTS idx_portfolio_user_key_symbol ON portfolio (user_key, symbol)",
+    "DROP INDEX IF EXISTS idx_transactions_user_created_ms",
+    "DROP INDEX IF EXISTS idx_transactions_user_type_created_ms",
+    "DROP INDEX IF EXISTS idx_portfolio_user_symbol",
+]
+
+BASELINE_VERSION = 1
+
+# Ordered list of every schema change. Never edit an applied migration; add a new one.
+MIGRATIONS = [
+    Migration(BASELINE_VERSION, 'baseline schema', statements=BASELINE_TABLES),
+    Migration(2, 'fixed_deposits.created_at',
+              columns=[('fixed_deposits', 'created_at', 'TIMESTAMP')],
+              backfills=[Backfill('fixed_deposits', 'created_at = CURRENT_TIMESTAMP', 'created_at IS NULL')]),
+    Migration(3, 'hot-path indexes', statements=HOT_PATH_INDEXES),
+    Migration(4, 'epoch millisecond timestamps',
+              columns=[(table, ms_column, 'INTEGER') for table, _, ms_column in EPOCH_MS_COLUMNS],
+              statements=EPOCH_MS_TRIGGERS,
+              backfills=[Backfill(table, f"{ms_column} = {epoch_ms_sql(column)}",
+                                  f"{ms_column} IS NULL AND {column} IS NOT NULL")
+                         for table, column, ms_column in EPOCH_MS_COLUMNS]),
+    # Built after the backfill so the batches don't also have to maintain these indexes
+    Migration(5, 'epoch millisecond indexes', statements=EPOCH_MS_INDEXES),
+    Migration(6, 'user directory', statements=USER_DIRECTORY),
+    Migration(7, 'archive tier', statements=ARCHIVE_TIER),
+    # Sets the partitions up in the DDL transaction; the events move over in rowid batches
+    Migration(8, 'monthly user_events partitions', statements=[partitions.CATALOG_DDL],
+              apply=partitions.partition_existing_table,
+              backfills=[Backfill(partitions.UNPARTITIONED, statements=partitions.MOVE_UNPARTITIONED_BATCH)],
+              finish=partitions.drop_unpartitioned),
+    Migration(9, 'event rollups', statements=[rollups.ROLLUPS_DDL]),
+    # Counts events as they are inserted; scripts/rebuild_activity.py counts the ones already stored
+    Migration(10, 'hourly and daily user activity', statements=activity.ACTIVITY_DDL,
+              apply=activity.report_uncounted_events),
+    Migration(11, 'indexed additional_data keys', apply=partitions.add_json_columns),
+    Migration(12, 'integer user keys',
+              columns=[(table, 'user_key', 'INTEGER') for table in ['users'] + USER_KEY_TABLES],
+              statements=USER_KEYS,
+              backfills=[Backfill(table, f"user_key = (SELECT user_key FROM users WHERE users.id = {table}.user_id)",
+                                  "user_key IS NULL")
+                         for table in USER_KEY_TABLES]),
+    # Built after the backfill, like the epoch millisecond indexes
+    Migration(13, 'integer user key indexes', statements=USER_KEY_INDEXES),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def current_version(conn: sqlite3.Connection) -> int:
+    """Highest applied migration version, 0 for a database that predates versioning."""
+    try:
+        return conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0] or 0
+    except sqlite3.OperationalError:
+        return 0
+
+
+def column_exists(conn: sqlite3.Connection, table: str, column: str) -> bool:
+    return any(row[1] == column for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def run_backfill(conn: sqlite3.Connection, backfill: Backfill, batch_size: int = 5000,
+                 pause: float = 0.005) -> int:
+    """
+    Apply a Backfill one rowid range at a time, committing after each batch.
+
+    Walking rowid ranges keeps every batch an index range scan, and the
+    WHERE clause makes a re-run after a crash pick up where it stopped.
+    A table that does not exist has nothing to backfill.
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (backfill.table,)).fetchone():
+        return 0
+    max_rowid = conn.execute(f"SELECT MAX(rowid) FROM {backfill.table}").fetchone()[0]
+    if max_rowid is None:
+        return 0
+
+    updated = 0
+    low = 0
+    while low < max_rowid:
+        high = low + batch_size
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if backfill.statements:
+                # Rows counted are those the last statement touches
+                for statement in backfill.statements:
+                    count = conn.execute(statement, (low, high)).rowcount
+            else:
+                count = conn.execute(
+                    f"UPDATE {backfill.table} SET {backfill.assignments} "
+                    f"WHERE rowid > ? AND rowid <= ? AND ({backfill.where})",
+                    (low, high)).rowcount
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        updated += count
+        low = high
+        if pause:
+            # Give queued writers a chance at the lock between batches
+            time.sleep(pause)
+    return updated
+
+
+def _apply(conn: sqlite3.Connection, migration: Migration, batch_size: int) -> bool:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        # Another process may have applied it while we waited for the lock
+        if current_version(conn) >= migration.version:
+            conn.execute("ROLLBACK")
+            return False
+        for table, column, declaration in migration.columns:
+            if not column_exists(conn, table, column):
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        for statement in migration.statements:
+            conn.execute(statement)
+        if migration.apply:
+            migration.apply(conn)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    # Backfills run outside the DDL transaction so each batch commits on its own
+    for backfill in migration.backfills:
+        rows = run_backfill(conn, backfill, batch_size)
+        print(f"  backfilled {rows} rows in {backfill.table}")
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if migration.finish:
+            migration.finish(conn)
+        conn.execute("INSERT OR IGNORE INTO schema_version (version, name) VALUES (?, ?)",
+                     (migration.version, migration.name))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return True
+
+
+def migrate(database: str, batch_size: int = 5000,
+            migrations: Optional[List[Migration]] = None) -> List[int]:
+    """Apply pending migrations in order and return the versions applied."""
+    migrations = migrations if migrations is not None else MIGRATIONS
+    conn = sqlite3.connect(database, isolation_level=None)
+    try:
+        version = current_version(conn)
+        if version >= migrations[-1].version:
+            return []
+
+        conn.execute("PRAGMA busy_timeout = 30000")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+
+        applied = []
+        for migration in migrations:
+            if migration.version <= version:
+                continue
+            print(f"Applying migration {migration.version}: {migration.name}...")
+            started = time.monotonic()
+            if _apply(conn, migration, batch_size):
+                applied.append(migration.version)
+                print(f"Migration {migration.version} applied in {time.monotonic() - started:.2f}s")
+        return applied
+    finally:
+        conn.close()
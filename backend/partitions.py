@@ -0,0 +1,422 @@
+"""
+Monthly partitions for user_events.
+
+user_events is the busiest table in every shard file. As one table, its
+indexes and its random-UUID primary key grow without bound, and removing
+old events means a DELETE that walks every index. Instead, each calendar
+month (UTC) gets its own table, user_events_YYYY_MM, with its own small
+indexes. The user_event_partitions catalog records each partition's time
+range.
+
+user_events itself is a view: a UNION ALL of the partitions, kept in step
+with the catalog. Reads go through it unchanged, and SQLite pushes their
+WHERE clauses down to each partition's indexes. INSTEAD OF triggers route
+plain INSERTs into user_events to the partition for the row's time_ms, and
+DELETEs to every partition, so older scripts keep working. The app's own
+write paths call insert_events(), which groups rows by month, creates
+missing partitions and writes each month with a single executemany.
+
+Dropping a month of events is a DROP TABLE (drop_partitions_before), with no
+row-by-row DELETE and no index maintenance.
+"""
+import datetime
+import sqlite3
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import activity
+
+TABLE = 'user_events'
+
+COLUMNS = ['id', 'user_email', 'event_type', 'time', 'page_url', 'transaction_amount', 'transaction_type',
+           'additional_data', 'time_ms']
+
+# additional_data keys exposed as generated columns. They are VIRTUAL, so the JSON is only parsed
+# when a row is indexed or read; text that is not valid JSON yields NULL instead of failing the insert.
+JSON_COLUMNS = ['symbol', 'biller_id', 'fd_id', 'beneficiary_id', 'period']
+
+JSON_COLUMN_EXPRESSIONS = {
+    column: f"CASE WHEN json_valid(additional_data) THEN json_extract(additional_data, '$.{column}') END"
+    for column in JSON_COLUMNS
+}
+
+JSON_COLUMN_DECLARATIONS = {
+    column: f"TEXT GENERATED ALWAYS AS ({expression}) VIRTUAL" for column, expression in JSON_COLUMN_EXPRESSIONS.items()
+}
+
+# A pre-partitioning user_events table while the partitioning migration empties it, batch by batch
+UNPARTITIONED = f"{TABLE}_unpartitioned"
+
+# Partition DDL; {name} is the partition (or, in an archive file, the plain table) name
+PARTITION_DDL = '''
+    CREATE TABLE IF NOT EXISTS {name} (
+        id TEXT PRIMARY KEY,
+        user_email TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        page_url TEXT,
+        transaction_amount REAL DEFAULT 0,
+        transaction_type TEXT,
+        additional_data TEXT,
+        time_ms INTEGER NOT NULL,
+''' + ',\n'.join(f"        {column} {declaration}" for column, declaration in JSON_COLUMN_DECLARATIONS.items()) + '''
+    )
+'''
+
+PARTITION_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS {schema}.{name}_email_time_ms ON {name} (user_email, time_ms)",
+    "CREATE INDEX IF NOT EXISTS {schema}.{name}_email_type_time_ms ON {name} (user_email, event_type, time_ms)",
+] + [
+    # Partial, so only the events that carry the key pay for its index
+    f"CREATE INDEX IF NOT EXISTS {{schema}}.{{name}}_{column}_time_ms ON {{name}} ({column}, time_ms) "
+    f"WHERE {column} IS NOT NULL"
+    for column in JSON_COLUMNS
+]
+
+CATALOG_DDL = '''
+    CREATE TABLE IF NOT EXISTS user_event_partitions (
+        name TEXT PRIMARY KEY,
+        start_ms INTEGER NOT NULL,
+        end_ms INTEGER NOT NULL
+    )
+'''
+
+PARTITIONS_SQL = "SELECT name, start_ms, end_ms FROM user_event_partitions ORDER BY start_ms"
+
+# Events carrying one additional_data value, e.g. every stock_buy for a symbol last week; {key} is one of JSON_COLUMNS
+EVENTS_BY_KEY_TEMPLATE = '''
+    SELECT id, user_email, event_type, time, page_url, transaction_amount, additional_data, time_ms
+    FROM user_events
+    WHERE {key} = ? AND event_type = ? AND time_ms >= ? AND time_ms < ?
+    ORDER BY time_ms
+'''
+
+# Per-partition query templates used by the session endpoints; {partition} is a partition name
+LAST_EVENT_TEMPLATE = "SELECT MAX(time_ms) FROM {partition} WHERE user_email = ? AND event_type = ?"
+EVENTS_SINCE_TEMPLATE = '''
+    SELECT id, event_type, time, page_url, transaction_amount, additional_data, time_ms
+    FROM {partition}
+    WHERE user_email = ? AND time_ms >= ?
+    ORDER BY time_ms
+'''
+
+# Routing key for rows inserted through the view: time_ms, else the text time, else now
+_ROUTE_KEY = ("COALESCE(NEW.time_ms, CAST(ROUND((julianday(COALESCE(NEW.time, CURRENT_TIMESTAMP)) - 2440587.5) "
+              "* 86400000.0) AS INTEGER))")
+
+
+# ---------- Months ----------
+
+def month_start_ms(epoch_ms: int) -> int:
+    """First millisecond (UTC) of the month containing epoch_ms."""
+    moment = datetime.datetime.fromtimestamp(epoch_ms / 1000, datetime.timezone.utc)
+    return int(moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0).timestamp() * 1000)
+
+
+def next_month_ms(month_ms: int) -> int:
+    moment = datetime.datetime.fromtimestamp(month_ms / 1000, datetime.timezone.utc)
+    year, month = divmod(moment.year * 12 + moment.month, 12)
+    return int(moment.replace(year=year, month=month + 1).timestamp() * 1000)
+
+
+def add_months(month_ms: int, months: int) -> int:
+    """Start of the month `months` after (or, if negative, before) the month starting at month_ms."""
+    moment = datetime.datetime.fromtimestamp(month_ms / 1000, datetime.timezone.utc)
+    year, month = divmod(moment.year * 12 + moment.month - 1 + months, 12)
+    return int(moment.replace(year=year, month=month + 1).timestamp() * 1000)
+
+
+def partition_name(month_ms: int) -> str:
+    return f"{TABLE}_{datetime.datetime.fromtimestamp(month_ms / 1000, datetime.timezone.utc):%Y_%m}"
+
+
+# ---------- Catalog and view ----------
+
+def list_partitions(conn: sqlite3.Connection, schema: str = 'main') -> List[Tuple[str, int, int]]:
+    """(name, start_ms, end_ms) for every partition, oldest first."""
+    return [tuple(row) for row in conn.execute(PARTITIONS_SQL.replace('FROM ', f"FROM {schema}.", 1))]
+
+
+def partitions_between(conn: sqlite3.Connection, start_ms: Optional[int] = None,
+                       end_ms: Optional[int] = None) -> List[str]:
+    """Partitions overlapping [start_ms, end_ms), oldest first; None leaves that side open."""
+    return [name for name, low, high in list_partitions(conn)
+            if (start_ms is None or high > start_ms) and (end_ms is None or low < end_ms)]
+
+
+def rebuild_view(conn: sqlite3.Connection, schema: str = 'main'):
+    """Recreate the user_events view and its routing triggers from the catalog."""
+    partitions = list_partitions(conn, schema)
+    columns = ', '.join(COLUMNS)
+    conn.execute(f"DROP VIEW IF EXISTS {schema}.{TABLE}")
+    if not partitions:
+        return
+
+    # Names inside the view and triggers stay unqualified so they bind to the file they live in
+    view_columns = ', '.join(COLUMNS + JSON_COLUMNS)
+    branches = [f"SELECT {view_columns} FROM {name}" for name, _, _ in partitions]
+    sources = [name for name, _, _ in partitions]
+    if conn.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?",
+                    (UNPARTITIONED,)).fetchone():
+        # Rows still waiting to move stay visible; the table has no generated columns, so compute them
+        branches.append(f"SELECT {', '.join(COLUMNS)}, " +
+                        ', '.join(f"{expression} AS {column}" for column, expression in JSON_COLUMN_EXPRESSIONS.items()) +
+                        f" FROM {UNPARTITIONED}")
+        sources.append(UNPARTITIONED)
+    conn.execute(f"CREATE VIEW {schema}.{TABLE} AS " + " UNION ALL ".join(branches))
+
+    values = ', '.join(_ROUTE_KEY if column == 'time_ms'
+                       else 'COALESCE(NEW.time, CURRENT_TIMESTAMP)' if column == 'time'
+                       else 'COALESCE(NEW.transaction_amount, 0)' if column == 'transaction_amount'
+                       else f"NEW.{column}" for column in COLUMNS)
+    for name, low, high in partitions:
+        conn.execute(f'''
+            CREATE TRIGGER {schema}.{name}_route INSTEAD OF INSERT ON {TABLE}
+            WHEN {_ROUTE_KEY} >= {low} AND {_ROUTE_KEY} < {high}
+            BEGIN
+                INSERT INTO {name} ({columns}) VALUES ({values});
+            END
+        ''')
+    conn.execute(f'''
+        CREATE TRIGGER {schema}.{TABLE}_route_missing INSTEAD OF INSERT ON {TABLE}
+        WHEN NOT EXISTS (SELECT 1 FROM user_event_partitions
+                         WHERE start_ms <= {_ROUTE_KEY} AND end_ms > {_ROUTE_KEY})
+        BEGIN
+            SELECT RAISE(ABORT, 'no user_events partition for this time');
+        END
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER {schema}.{TABLE}_delete INSTEAD OF DELETE ON {TABLE}
+        BEGIN
+            {' '.join(f"DELETE FROM {name} WHERE id = OLD.id;" for name in sources)}
+        END
+    ''')
+
+
+def ensure_partitions(conn: sqlite3.Connection, months: Sequence[int], schema: str = 'main') -> Dict[int, str]:
+    """
+    Partition names for the given month starts, creating any that are
+    missing. Runs in the caller's transaction.
+    """
+    existing = {low: name for name, low, _ in list_partitions(conn, schema)}
+    created = False
+    for month in set(months):
+        if month in existing:
+            continue
+        name = partition_name(month)
+        conn.execute(PARTITION_DDL.format(name=f"{schema}.{name}"))
+        for statement in PARTITION_INDEXES:
+            conn.execute(statement.format(schema=schema, name=name))
+        conn.execute(f"INSERT OR IGNORE INTO {schema}.user_event_partitions (name, start_ms, end_ms) "
+                     f"VALUES (?, ?, ?)", (name, month, next_month_ms(month)))
+        existing[month] = name
+        created = True
+    if created:
+        rebuild_view(conn, schema)
+    return {month: existing[month] for month in months}
+
+
+def insert_events(conn: sqlite3.Connection, rows: Sequence[Tuple]) -> int:
+    """
+    Insert user_events rows (tuples in COLUMNS order) straight into their
+    monthly partitions, one executemany per month, and add them to the
+    hourly and daily activity counts. Rows without time_ms are stamped with
+    the current time. Runs in the caller's transaction.
+    """
+    by_month = {}
+    now_ms = int(time.time() * 1000)
+    low = high = 0
+    bucket = None
+    for row in rows:
+        if row[-1] is None:
+            row = tuple(row[:-1]) + (now_ms,)
+        # Batches are mostly one month, so only re-derive it when a row falls outside the last one
+        if not low <= row[-1] < high:
+            low = month_start_ms(row[-1])
+            high = next_month_ms(low)
+            bucket = by_month.setdefault(low, [])
+        bucket.append(row)
+
+    names = ensure_partitions(conn, list(by_month))
+    placeholders = ', '.join('?' * len(COLUMNS))
+    for month, month_rows in by_month.items():
+        conn.executemany(f"INSERT INTO {names[month]} ({', '.join(COLUMNS)}) VALUES ({placeholders})", month_rows)
+        activity.add_events(conn, month_rows)
+    return len(rows)
+
+
+def drop_partitions(conn: sqlite3.Connection, names: Sequence[str]):
+    """Drop whole partitions: a catalog update and a DROP TABLE each. Runs in the caller's transaction."""
+    for name in names:
+        conn.execute("DELETE FROM user_event_partitions WHERE name = ?", (name,))
+    if names:
+        rebuild_view(conn)
+        for name in names:
+            conn.execute(f"DROP TABLE IF EXISTS {name}")
+
+
+def drop_partitions_before(conn: sqlite3.Connection, before_ms: int) -> List[str]:
+    """Drop every partition that ends at or before before_ms. Runs in the caller's transaction."""
+    expired = [name for name, _, high in list_partitions(conn) if high <= before_ms]
+    drop_partitions(conn, expired)
+    return expired
+
+
+def copy_events(conn: sqlite3.Connection, source: str, dest: str, where: str, params: Sequence) -> int:
+    """
+    Copy the user_events rows matching where from schema source to schema
+    dest, partition by partition, creating partitions in dest as needed.
+    Runs in the caller's transaction; delete_copied_events removes the
+    originals once the copy is committed.
+    """
+    partitions = list_partitions(conn, source)
+    names = ensure_partitions(conn, [low for _, low, _ in partitions], schema=dest)
+    columns = ', '.join(COLUMNS)
+    copied = 0
+    for name, low, _ in partitions:
+        # OR REPLACE makes a re-run after an interrupted move converge instead of failing
+        copied += conn.execute(f"INSERT OR REPLACE INTO {dest}.{names[low]} ({columns}) "
+                               f"SELECT {columns} FROM {source}.{name} WHERE {where}", params).rowcount
+    return copied
+
+
+def delete_copied_events(conn: sqlite3.Connection, source: str, dest: str, where: str, params: Sequence) -> int:
+    """Delete the user_events rows matching where from schema source, only those whose id dest holds."""
+    copies = {low: name for name, low, _ in list_partitions(conn, dest)}
+    deleted = 0
+    for name, low, _ in list_partitions(conn, source):
+        if low not in copies:
+            continue
+        deleted += conn.execute(
+            f"DELETE FROM {source}.{name} WHERE {where} "
+            f"AND EXISTS (SELECT 1 FROM {dest}.{copies[low]} AS copy WHERE copy.id = {name}.id)", params).rowcount
+    return deleted
+
+
+def maintain(database: str, retention_months: int = 0, busy_timeout: int = 5000) -> List[str]:
+    """
+    Create this month's and next month's partitions ahead of time, so a month
+    rollover never puts DDL on the insert path, and drop partitions older
+    than retention_months whole months (0 keeps everything). Returns the
+    dropped partition names.
+    """
+    conn = sqlite3.connect(database, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    try:
+        current = month_start_ms(int(time.time() * 1000))
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            ensure_partitions(conn, [current, next_month_ms(current)])
+            dropped = drop_partitions_before(conn, add_months(current, -retention_months)) if retention_months > 0 else []
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+    return dropped
+
+
+# ---------- Routed reads ----------
+
+def last_event_ms(conn: sqlite3.Connection, user_email: str, event_type: str) -> Optional[int]:
+    """time_ms of a user's latest event of a type, searching the newest partition first."""
+    for name in reversed(partitions_between(conn)):
+        found = conn.execute(LAST_EVENT_TEMPLATE.format(partition=name), (user_email, event_type)).fetchone()[0]
+        if found is not None:
+            return found
+    return None
+
+
+def events_by_key(conn: sqlite3.Connection, key: str, value: str, event_type: str,
+                  start_ms: int, end_ms: int) -> List[sqlite3.Row]:
+    """Events of a type whose additional_data has key = value in [start_ms, end_ms), oldest first."""
+    if key not in JSON_COLUMNS:
+        raise ValueError(f"{key} is not an indexed additional_data key")
+    return conn.execute(EVENTS_BY_KEY_TEMPLATE.format(key=key), (value, event_type, start_ms, end_ms)).fetchall()
+
+
+def events_since(conn: sqlite3.Connection, user_email: str, since_ms: int) -> List[sqlite3.Row]:
+    """A user's events from since_ms on, oldest first, reading only the partitions that can hold them."""
+    events = []
+    for name in partitions_between(conn, since_ms):
+        events.extend(conn.execute(EVENTS_SINCE_TEMPLATE.format(partition=name), (user_email, since_ms)).fetchall())
+    return events
+
+
+# ---------- Migration ----------
+
+def partition_existing_table(conn: sqlite3.Connection):
+    """
+    Migration step: set an existing user_events table aside as
+    user_events_unpartitioned and create the monthly partitions its rows
+    need, with the view over both. Runs in the migration's transaction; the
+    rows then move in rowid batches (MOVE_UNPARTITIONED_BATCH) and
+    drop_unpartitioned removes the emptied table. Until then, reads through
+    the view see every row exactly once, wherever it is.
+    """
+    current = month_start_ms(int(time.time() * 1000))
+    kind = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (TABLE,)).fetchone()
+    if kind is None or kind[0] != 'table':
+        ensure_partitions(conn, [current])
+        return
+
+    conn.execute(f"ALTER TABLE {TABLE} RENAME TO {UNPARTITIONED}")
+
+    # Index lookups on time_ms; rows without one are routed by their text time
+    months = {current}
+    row_route_key = _ROUTE_KEY.replace('NEW.', '')
+    for oldest, newest in (
+            conn.execute(f"SELECT MIN(time_ms), MAX(time_ms) FROM {UNPARTITIONED}").fetchone(),
+            conn.execute(f"SELECT MIN({row_route_key}), MAX({row_route_key}) FROM {UNPARTITIONED} "
+                         f"WHERE time_ms IS NULL").fetchone()):
+        if oldest is None:
+            continue
+        month = month_start_ms(oldest)
+        while month <= newest:
+            months.add(month)
+            month = next_month_ms(month)
+    ensure_partitions(conn, sorted(months))
+    rebuild_view(conn)
+
+
+# One backfill batch of the partitioning migration: route a rowid range through the view, then drop it
+MOVE_UNPARTITIONED_BATCH = [
+    f"INSERT INTO {TABLE} ({', '.join(COLUMNS)}) SELECT {', '.join(COLUMNS)} FROM {UNPARTITIONED} "
+    f"WHERE rowid > ? AND rowid <= ?",
+    f"DELETE FROM {UNPARTITIONED} WHERE rowid > ? AND rowid <= ?",
+]
+
+
+def drop_unpartitioned(conn: sqlite3.Connection):
+    """
+    Migration step, after the batches: drop the emptied user_events_unpartitioned
+    and the partitions created for months that had no events. Runs in the caller's transaction.
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                        (UNPARTITIONED,)).fetchone():
+        return
+    if conn.execute(f"SELECT 1 FROM {UNPARTITIONED} LIMIT 1").fetchone():
+        raise RuntimeError(f"{UNPARTITIONED} still has rows; re-run the migration")
+    conn.execute(f"DROP TABLE {UNPARTITIONED}")
+
+    current = month_start_ms(int(time.time() * 1000))
+    empty = [name for name, low, _ in list_partitions(conn)
+             if low != current and conn.execute(f"SELECT 1 FROM {name} LIMIT 1").fetchone() is None]
+    drop_partitions(conn, empty)
+    rebuild_view(conn)
+
+
+def add_json_columns(conn: sqlite3.Connection):
+    """
+    Migration step: give partitions created before JSON_COLUMNS existed the
+    generated columns and their indexes. Runs in the migration's transaction.
+    """
+    for name, _, _ in list_partitions(conn):
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({name})")}
+        for column, declaration in JSON_COLUMN_DECLARATIONS.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {name} ADD COLUMN {column} {declaration}")
+        for statement in PARTITION_INDEXES:
+            conn.execute(statement.format(schema='main', name=name))
+    rebuild_view(conn)
@@ -0,0 +1,275 @@
+"""
+Typed data access for the banking API.
+
+Queries select an explicit column list straight into tuple-backed records
+(NamedTuple, so no per-row dict or sqlite3.Row), and every record type has
+one serializer, built once at import time, that turns it into the camelCase
+JSON the frontend expects.
+"""
+import sqlite3
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Any
+
+
+def _compile_serializer(keys: Sequence[str]) -> Callable[[tuple], Dict[str, Any]]:
+    """Map a record's fields, in order, onto JSON keys. Extra trailing fields are dropped."""
+    keys = tuple(keys)
+
+    def serialize(record):
+        return dict(zip(keys, record))
+    return serialize
+
+
+def _fetch(conn: sqlite3.Connection, record_type, sql: str, params: Iterable = ()) -> list:
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, tuple(params))
+    return list(map(record_type._make, cursor))
+
+
+def _fetch_one(conn: sqlite3.Connection, record_type, sql: str, params: Iterable = ()):
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    row = cursor.execute(sql, tuple(params)).fetchone()
+    return record_type._make(row) if row else None
+
+
+# ---------- Users ----------
+
+class User(NamedTuple):
+    id: str
+    email: str
+    first_name: str
+    last_name: str
+    phone: str
+    balance: float
+    account_number: str
+    created_at: Optional[str]
+    last_login: Optional[str]
+    password: str  # last, so serialize_user never emits it
+
+
+USER_COLUMNS = ', '.join(User._fields)
+USER_BY_ID_SQL = f"SELECT {USER_COLUMNS} FROM users WHERE id = ?"
+USER_BY_EMAIL_SQL = f"SELECT {USER_COLUMNS} FROM users WHERE email = ?"
+
+# transactions and portfolio are indexed on the integer users.user_key, not the
+# UUID text; queries take the public user id and look the key up with this.
+USER_KEY_LOOKUP = "(SELECT user_key FROM users WHERE id = ?)"
+
+serialize_user = _compile_serializer([
+    'id', 'email', 'firstName', 'lastName', 'phone', 'balance', 'accountNumber', 'createdAt', 'lastLogin'
+])
+
+
+def get_user(conn: sqlite3.Connection, user_id: str) -> Optional[User]:
+    return _fetch_one(conn, User, USER_BY_ID_SQL, (user_id,))
+
+
+def get_user_by_email(conn: sqlite3.Connection, email: str) -> Optional[User]:
+    return _fetch_one(conn, User, USER_BY_EMAIL_SQL, (email,))
+
+
+# ---------- Transactions ----------
+
+class Transaction(NamedTuple):
+    id: str
+    user_id: str
+    type: str
+    symbol: Optional[str]
+    shares: Optional[int]
+    amount: float
+    price: Optional[float]
+    description: str
+    status: str
+    created_at: str
+    completed_at: Optional[str]
+    reference: Optional[str]
+    counterparty: Optional[str]
+    created_at_ms: Optional[int]  # last, so serialize_transaction never emits it
+
+
+TRANSACTION_COLUMNS = ', '.join(Transaction._fields)
+TRANSACTIONS_SQL = f'''
+    SELECT {TRANSACTION_COLUMNS} FROM transactions
+    WHERE user_key = {USER_KEY_LOOKUP}
+    ORDER BY created_at_ms DESC LIMIT ? OFFSET ?
+'''
+TRANSACTIONS_BY_TYPE_SQL = f'''
+    SELECT {TRANSACTION_COLUMNS} FROM transactions
+    WHERE user_key = {USER_KEY_LOOKUP} AND type = ?
+    ORDER BY created_at_ms DESC LIMIT ? OFFSET ?
+'''
+# Account statements: a half-open [start, end) epoch-millisecond range
+STATEMENT_SQL = f'''
+    SELECT {TRANSACTION_COLUMNS} FROM transactions
+    WHERE user_key = {USER_KEY_LOOKUP} AND created_at_ms >= ? AND created_at_ms < ?
+    ORDER BY created_at_ms DESC LIMIT ?
+'''
+
+# Open ends of a statement range
+MIN_EPOCH_MS = -(2 ** 63)
+MAX_EPOCH_MS = 2 ** 63 - 1
+
+serialize_transaction = _compile_serializer([
+    'id', 'userId', 'type', 'symbol', 'shares', 'amount', 'price', 'description', 'status',
+    'createdAt', 'completedAt', 'reference', 'counterparty'
+])
+
+
+def list_transactions(conn: sqlite3.Connection, user_id: str, limit: int = -1, offset: int = 0,
+                      transaction_type: Optional[str] = None) -> List[Transaction]:
+    """A user's transactions, newest first. limit=-1 means no limit."""
+    if transaction_type:
+        return _fetch(conn, Transaction, TRANSACTIONS_BY_TYPE_SQL, (user_id, transaction_type, limit, offset))
+    return _fetch(conn, Transaction, TRANSACTIONS_SQL, (user_id, limit, offset))
+
+
+def list_statement_transactions(conn: sqlite3.Connection, user_id: str, start_ms: Optional[int] = None,
+                                end_ms: Optional[int] = None, limit: int = -1) -> List[Transaction]:
+    """A user's transactions in [start_ms, end_ms), newest first. A None bound leaves that end open."""
+    start_ms = MIN_EPOCH_MS if start_ms is None else start_ms
+    end_ms = MAX_EPOCH_MS if end_ms is None else end_ms
+    return _fetch(conn, Transaction, STATEMENT_SQL, (user_id, start_ms, end_ms, limit))
+
+
+# ---------- Portfolio ----------
+
+class Holding(NamedTuple):
+    id: str
+    user_id: str
+    symbol: str
+    shares: int
+    buy_price: float
+    total_investment: float
+    purchase_date: str
+    current_price: float
+    stock_name: str
+
+
+HOLDINGS_SQL = f'''
+    SELECT p.id, p.user_id, p.symbol, p.shares, p.buy_price, p.total_investment, p.purchase_date,
+           s.price, s.name
+    FROM portfolio p
+    JOIN stocks s ON p.symbol = s.symbol
+    WHERE p.user_key = {USER_KEY_LOOKUP}
+'''
+
+
+def serialize_holding(holding: Holding) -> Dict[str, Any]:
+    current_value = holding.shares * holding.current_price
+    gain_loss = current_value - holding.total_investment
+    return {
+        'id': holding.id,
+        'userId': holding.user_id,
+        'symbol': holding.symbol,
+        'shares': holding.shares,
+        'buyPrice': holding.buy_price,
+        'totalInvestment': holding.total_investment,
+        'purchaseDate': holding.purchase_date,
+        'currentPrice': holding.current_price,
+        'currentValue': current_value,
+        'gainLoss': gain_loss,
+        'gainLossPercent': (gain_loss / holding.total_investment * 100) if holding.total_investment > 0 else 0,
+        'name': holding.stock_name
+    }
+
+
+def list_holdings(conn: sqlite3.Connection, user_id: str) -> List[Holding]:
+    """A user's portfolio joined with live stock prices."""
+    return _fetch(conn, Holding, HOLDINGS_SQL, (user_id,))
+
+
+def portfolio_summary(holdings: List[Holding]) -> Dict[str, Any]:
+    total_investment = sum(h.total_investment for h in holdings)
+    total_value = sum(h.shares * h.current_price for h in holdings)
+    total_gain_loss = total_value - total_investment
+    total_gain_loss_percent = (total_gain_loss / total_investment * 100) if total_investment > 0 else 0
+    return {
+        'totalValue': round(total_value, 2),
+        'totalInvestment': round(total_investment, 2),
+        'totalGainLoss': round(total_gain_loss, 2),
+        'totalGainLossPercent': round(total_gain_loss_percent, 2),
+        'holdings': len(holdings)
+    }
+
+
+# ---------- Fixed deposits ----------
+
+class FixedDeposit(NamedTuple):
+    id: str
+    user_id: str
+    amount: float
+    interest_rate: float
+    tenure: int
+    start_date: str
+    maturity_date: str
+    type: str
+    status: str
+    interest_earned: float
+    maturity_amount: float
+    created_at: Optional[str]  # last, so serialize_fixed_deposit never emits it
+
+
+FIXED_DEPOSIT_COLUMNS = ', '.join(FixedDeposit._fields)
+FIXED_DEPOSITS_SQL = f'''
+    SELECT {FIXED_DEPOSIT_COLUMNS} FROM fixed_deposits
+    WHERE user_id = ?
+    ORDER BY created_at_ms DESC
+'''
+
+serialize_fixed_deposit = _compile_serializer([
+    'id', 'userId', 'amount', 'interestRate', 'tenure', 'startDate', 'maturityDate', 'type', 'status',
+    'interestEarned', 'maturityAmount'
+])
+
+
+def list_fixed_deposits(conn: sqlite3.Connection, user_id: str) -> List[FixedDeposit]:
+    """A user's fixed deposits, newest first."""
+    return _fetch(conn, FixedDeposit, FIXED_DEPOSITS_SQL, (user_id,))
+
+
+# ---------- Tax payments ----------
+
+class TaxPayment(NamedTuple):
+    id: str
+    user_id: str
+    transaction_id: str
+    tax_type: str
+    pan_tan: Optional[str]
+    assessment_year: Optional[str]
+    tax_applicable: Optional[str]
+    payment_type: Optional[str]
+    gstin: Optional[str]
+    cpin: Optional[str]
+    cgst: float
+    sgst: float
+    igst: float
+    cess: float
+    state: Optional[str]
+    municipality: Optional[str]
+    service_type: Optional[str]
+    consumer_id: Optional[str]
+    amount: float
+    status: str
+    created_at: str
+    payment_date: str
+    description: str
+    counterparty: Optional[str]
+
+
+# The tax pages read the raw column names, so this serializer keeps snake_case
+serialize_tax_payment = _compile_serializer(TaxPayment._fields)
+
+TAX_PAYMENTS_SQL = f'''
+    SELECT {', '.join(f'tp.{name}' for name in TaxPayment._fields[:-3])},
+           t.created_at, t.description, t.counterparty
+    FROM tax_payments tp
+    JOIN transactions t ON tp.transaction_id = t.id
+    WHERE tp.user_id = ?
+    ORDER BY tp.created_at_ms DESC
+'''
+
+
+def list_tax_payments(conn: sqlite3.Connection, user_id: str) -> List[TaxPayment]:
+    """A user's tax payments with their transaction details, newest first."""
+    return _fetch(conn, TaxPayment, TAX_PAYMENTS_SQL, (user_id,))
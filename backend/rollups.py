@@ -0,0 +1,145 @@
+"""
+Per-minute counters for high-volume, low-value events.
+
+Some events are only ever counted. GET /api/stocks used to write a full
+user_events row for 'anonymous' on every market-data poll, which made it
+the busiest write in the system, and the rows carried nothing but the
+fact that the page was hit. Anonymous events of the types listed in
+EVENT_ROLLUP_TYPES are now counted in memory instead, in one bucket per
+(minute, event_type, page_url). A logged-in user's events are always
+stored, since the behaviour profiler counts them per user and the buckets
+have no user. A background thread adds the buckets to the event_rollups
+table every flush_interval seconds with an UPSERT, so a minute of traffic
+costs one row per page however many hits it had.
+
+If a flush fails, its counts are merged back and retried on the next one.
+Counts still in memory when the process is killed are lost, which is the
+accepted price of not writing them one by one.
+"""
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+BUCKET_MS = 60000
+
+ROLLUPS_DDL = '''
+    CREATE TABLE IF NOT EXISTS event_rollups (
+        event_type TEXT NOT NULL,
+        bucket_ms INTEGER NOT NULL,
+        page_url TEXT NOT NULL DEFAULT '',
+        count INTEGER NOT NULL,
+        PRIMARY KEY (event_type, bucket_ms, page_url)
+    ) WITHOUT ROWID
+'''
+
+UPSERT_ROLLUP_SQL = '''
+    INSERT INTO event_rollups (event_type, bucket_ms, page_url, count) VALUES (?, ?, ?, ?)
+    ON CONFLICT (event_type, bucket_ms, page_url) DO UPDATE SET count = count + excluded.count
+'''
+
+PRUNE_ROLLUPS_SQL = "DELETE FROM event_rollups WHERE event_type = ? AND bucket_ms < ?"
+
+
+class RollupCounter:
+    """
+    In-memory per-minute event counts and the thread that flushes them.
+    pool is the connection pool of the file that holds event_rollups.
+    """
+    def __init__(self, pool: Any, flush_interval: float = 10.0):
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self._buckets: Dict[Tuple[str, int, str], int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+        # Metrics
+        self._counted = 0
+        self._flushes = 0
+        self._rows_written = 0
+        self._failures = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopping.clear()
+                self._thread = threading.Thread(target=self._run, name='event-rollups', daemon=True)
+                self._thread.start()
+
+    def add(self, event_type: str, page_url: Optional[str] = None, time_ms: Optional[int] = None, count: int = 1):
+        """Count an event in its minute's bucket."""
+        if self._thread is None:
+            self.start()
+        if time_ms is None:
+            time_ms = int(time.time() * 1000)
+        key = (event_type, time_ms - time_ms % BUCKET_MS, page_url or '')
+        with self._lock:
+            self._buckets[key] = self._buckets.get(key, 0) + count
+            self._counted += count
+
+    def flush(self) -> int:
+        """Write the buckets counted so far; returns the number of rows upserted."""
+        with self._flush_lock:
+            with self._lock:
+                buckets, self._buckets = self._buckets, {}
+            if not buckets:
+                return 0
+
+            conn = self.pool.connection()
+            try:
+                conn.executemany(UPSERT_ROLLUP_SQL, [key + (count,) for key, count in buckets.items()])
+                conn.commit()
+            except sqlite3.Error as e:
+                conn.rollback()
+                print(f"Error flushing {len(buckets)} event rollups: {e}")
+                with self._lock:
+                    for key, count in buckets.items():
+                        self._buckets[key] = self._buckets.get(key, 0) + count
+                    self._failures += 1
+                return 0
+            finally:
+                conn.close()
+
+            with self._lock:
+                self._flushes += 1
+                self._rows_written += len(buckets)
+            return len(buckets)
+
+    def stop(self):
+        """Stop the flusher thread and write what is left."""
+        self._stopping.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            self.flush()
+
+    def metrics(self) -> Dict[str, Any]:
+        """Pending buckets and flush statistics."""
+        with self._lock:
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'pending_buckets': len(self._buckets),
+                'counted': self._counted,
+                'flushes': self._flushes,
+                'rows_written': self._rows_written,
+                'failures': self._failures,
+            }
+
+
+def prune(database: str, event_types: Iterable[str], before_ms: int, busy_timeout: int = 5000) -> int:
+    """Delete the event types' buckets older than before_ms, the same retention raw events get."""
+    conn = sqlite3.connect(database)
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout)}")
+    try:
+        deleted = 0
+        for event_type in event_types:
+            deleted += conn.execute(PRUNE_ROLLUPS_SQL, (event_type, before_ms)).rowcount
+        conn.commit()
+        return deleted
+    finally:
+        conn.close()
@@ -1,10 +1,19 @@
 import sqlite3
 import bcrypt
-import uuid
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import ids
+from shards import ShardRouter, recorded_shard_count
+
+DATABASE = os.path.join(BACKEND_DIR, 'banking.db')
 
 def add_test_user():
-    conn = sqlite3.connect('../banking.db')
-    cursor = conn.cursor()
+    # Users go on the shard their id hashes to, with an entry in the common email directory
+    shards = ShardRouter(DATABASE, shard_count=recorded_shard_count(DATABASE))
     
     # Test user data with specific bcrypt settings
     password = ".tie5Roanl"
@@ -17,7 +26,7 @@ def add_test_user():
         raise ValueError("Invalid bcrypt hash format")
     
     user_data = {
-        'id': str(uuid.uuid4()).replace('-', ''),
+        'id': ids.new_id().replace('-', ''),
         'email': 'priyankaavijay@gmail.com',
         'password': hashed_password,
         'first_name': 'Priyankaa',
@@ -28,29 +37,36 @@ def add_test_user():
     }
     
     try:
-        # First delete existing user if present
-        cursor.execute('DELETE FROM users WHERE email = ?', (user_data['email'],))
+        # First delete existing user if present, from whichever shard holds them
+        shards.remove_user(user_data['email'])
         
         # Insert new user
-        cursor.execute('''
-            INSERT INTO users (
-                id, email, password, first_name, last_name,
-                phone, balance, account_number, created_at
-            ) VALUES (
-                :id, :email, :password, :first_name, :last_name,
-                :phone, :balance, :account_number, CURRENT_TIMESTAMP
-            )
-        ''', user_data)
-        
-        conn.commit()
-        
-        # Verify the stored hash
-        cursor.execute('SELECT password FROM users WHERE email = ?', (user_data['email'],))
-        stored_hash = cursor.fetchone()[0]
+        shards.register(user_data['email'], user_data['id'])
+        conn = shards.writer(user_data['id']).connection()
+        try:
+            conn.execute('''
+                INSERT INTO users (
+                    id, email, password, first_name, last_name,
+                    phone, balance, account_number, created_at
+                ) VALUES (
+                    :id, :email, :password, :first_name, :last_name,
+                    :phone, :balance, :account_number, CURRENT_TIMESTAMP
+                )
+            ''', user_data)
+            conn.commit()
+            
+            # Verify the stored hash
+            stored_hash = conn.execute('SELECT password FROM users WHERE id = ?', (user_data['id'],)).fetchone()[0]
+        except Exception:
+            shards.unregister(user_data['email'], user_data['id'])
+            raise
+        finally:
+            conn.close()
         print("\n=== User Creation Results ===")
         print("User added successfully!")
         print(f"Email: {user_data['email']}")
         print(f"Account Number: {user_data['account_number']}")
+        print(f"Shard: {shards.path_for(user_data['id'])}")
         print(f"Password hash format check: {stored_hash.startswith('$2b$')}")
         print(f"Hash length check: {len(stored_hash)} characters")
         print(f"Full hash: {stored_hash}")
@@ -64,8 +80,6 @@ def add_test_user():
         print("User might already exist")
     except Exception as e:
         print(f"Error: {str(e)}")
-    finally:
-        conn.close()
 
 if __name__ == "__main__":
     add_test_user()
\ No newline at end of file
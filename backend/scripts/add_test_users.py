@@ -1,10 +1,20 @@
 import sqlite3
 import bcrypt
 import uuid
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import ids
+from shards import ShardRouter, recorded_shard_count
+
+DATABASE = os.path.join(BACKEND_DIR, 'banking.db')
 
 def add_test_users():
-    conn = sqlite3.connect('../banking.db')
-    cursor = conn.cursor()
+    # Users go on the shard their id hashes to, with an entry in the common email directory
+    shards = ShardRouter(DATABASE, shard_count=recorded_shard_count(DATABASE))
     
     # Test users data
     test_users = [
@@ -32,11 +42,11 @@ def add_test_users():
     
     for user in test_users:
         try:
-            # Delete existing user if present
-            cursor.execute('DELETE FROM users WHERE email = ?', (user['email'],))
+            # Delete existing user if present, from whichever shard holds them
+            shards.remove_user(user['email'])
             
             user_data = {
-                'id': str(uuid.uuid4()).replace('-', ''),
+                'id': ids.new_id().replace('-', ''),
                 'email': user['email'],
                 'password': hashed_password,
                 'first_name': user['first_name'],
@@ -47,24 +57,31 @@ def add_test_users():
             }
             
             # Insert new user
-            cursor.execute('''
-                INSERT INTO users (
-                    id, email, password, first_name, last_name,
-                    phone, balance, account_number, created_at
-                ) VALUES (
-                    :id, :email, :password, :first_name, :last_name,
-                    :phone, :balance, :account_number, CURRENT_TIMESTAMP
-                )
-            ''', user_data)
-            
-            conn.commit()
-            
-            # Verify the stored hash
-            cursor.execute('SELECT password FROM users WHERE email = ?', (user['email'],))
-            stored_hash = cursor.fetchone()[0]
+            shards.register(user['email'], user_data['id'])
+            conn = shards.writer(user_data['id']).connection()
+            try:
+                conn.execute('''
+                    INSERT INTO users (
+                        id, email, password, first_name, last_name,
+                        phone, balance, account_number, created_at
+                    ) VALUES (
+                        :id, :email, :password, :first_name, :last_name,
+                        :phone, :balance, :account_number, CURRENT_TIMESTAMP
+                    )
+                ''', user_data)
+                conn.commit()
+                
+                # Verify the stored hash
+                stored_hash = conn.execute('SELECT password FROM users WHERE id = ?', (user_data['id'],)).fetchone()[0]
+            except Exception:
+                shards.unregister(user['email'], user_data['id'])
+                raise
+            finally:
+                conn.close()
             print(f"\n=== User Creation Results for {user['email']} ===")
             print("User added successfully!")
             print(f"Account Number: {user_data['account_number']}")
+            print(f"Shard: {shards.path_for(user_data['id'])}")
             print(f"Password hash format check: {stored_hash.startswith('$2b$')}")
             print(f"Hash length check: {len(stored_hash)} characters")
             
@@ -77,7 +94,5 @@ def add_test_users():
         except Exception as e:
             print(f"Error adding {user['email']}: {str(e)}")
 
-    conn.close()
-
 if __name__ == "__main__":
     add_test_users()
\ No newline at end of file
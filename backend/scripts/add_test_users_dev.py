@@ -1,9 +1,19 @@
 import sqlite3
 import uuid
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import ids
+from shards import ShardRouter, recorded_shard_count
+
+DATABASE = os.path.join(BACKEND_DIR, 'banking.db')
 
 def add_test_users_dev():
-    conn = sqlite3.connect('../banking.db')
-    cursor = conn.cursor()
+    # Users go on the shard their id hashes to, with an entry in the common email directory
+    shards = ShardRouter(DATABASE, shard_count=recorded_shard_count(DATABASE))
     
     # Test users data
     test_users = [
@@ -25,11 +35,11 @@ def add_test_users_dev():
     
     for user in test_users:
         try:
-            # Delete existing user if present
-            cursor.execute('DELETE FROM users WHERE email = ?', (user['email'],))
+            # Delete existing user if present, from whichever shard holds them
+            shards.remove_user(user['email'])
             
             user_data = {
-                'id': str(uuid.uuid4()).replace('-', ''),
+                'id': ids.new_id().replace('-', ''),
                 'email': user['email'],
                 'password': user['password'],  # Store password directly
                 'first_name': user['first_name'],
@@ -39,34 +49,41 @@ def add_test_users_dev():
                 'account_number': str(uuid.uuid4())[:12]
             }
             
-            cursor.execute('''
-                INSERT INTO users (id, email, password, first_name, last_name,
-                    phone, balance, account_number, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-            ''', (
-                user_data['id'], 
-                user_data['email'], 
-                user_data['password'],  # Raw password
-                user_data['first_name'],
-                user_data['last_name'],
-                user_data['phone'],
-                user_data['balance'],
-                user_data['account_number']
-            ))
+            shards.register(user['email'], user_data['id'])
+            conn = shards.writer(user_data['id']).connection()
+            try:
+                conn.execute('''
+                    INSERT INTO users (id, email, password, first_name, last_name,
+                        phone, balance, account_number, created_at)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ''', (
+                    user_data['id'], 
+                    user_data['email'], 
+                    user_data['password'],  # Raw password
+                    user_data['first_name'],
+                    user_data['last_name'],
+                    user_data['phone'],
+                    user_data['balance'],
+                    user_data['account_number']
+                ))
+                conn.commit()
+            except Exception:
+                shards.unregister(user['email'], user_data['id'])
+                raise
+            finally:
+                conn.close()
             
             print(f"\n=== User Creation Results for {user['email']} ===")
             print("User added successfully!")
             print(f"Email: {user['email']}")
             print(f"Password: {user['password']}")
             print(f"Account Number: {user_data['account_number']}")
+            print(f"Shard: {shards.path_for(user_data['id'])}")
             
         except sqlite3.IntegrityError as e:
             print(f"Error adding {user['email']}: {e}")
         except Exception as e:
             print(f"Error adding {user['email']}: {str(e)}")
 
-    conn.commit()
-    conn.close()
-
 if __name__ == "__main__":
     add_test_users_dev()
\ No newline at end of file
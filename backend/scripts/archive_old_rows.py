@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Move old transactions and events into the monthly archive files now.
+
+The app does this in the background every ARCHIVE_INTERVAL_SECONDS. This
+script runs the same pass once over every shard file, for example after
+lowering ARCHIVE_AFTER_DAYS. It is safe to run while the app is up.
+
+Only statements, statement exports and tax history read the archive files;
+/api/transactions, recent transfers and the profile show hot rows only, so
+archived rows drop out of those views.
+
+Usage:
+    python scripts/archive_old_rows.py --days 365          (from the backend directory)
+"""
+
+import argparse
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+from archive import archive_old_rows
+from shards import existing_shards
+
+DATABASE = os.path.join(BACKEND_DIR, 'banking.db')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive old transactions and events')
+    parser.add_argument('--days', type=int, default=int(os.environ.get('ARCHIVE_AFTER_DAYS', 0)),
+                        help='archive rows older than this many days (default: ARCHIVE_AFTER_DAYS)')
+    parser.add_argument('--database', default=DATABASE, help='common database file (default: banking.db)')
+    parser.add_argument('--batch-size', type=int, default=5000, help='rows moved per transaction')
+    args = parser.parse_args()
+
+    if args.days < 1:
+        parser.error('--days (or ARCHIVE_AFTER_DAYS) must be at least 1')
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+
+    cutoff_ms = int(time.time() * 1000) - args.days * 86400000
+    for shard, path in sorted(existing_shards(args.database).items()):
+        moved = archive_old_rows(path, cutoff_ms, batch_size=args.batch_size)
+        print(f"{path}: archived {moved['transactions']} transactions, {moved['user_events']} events")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Time forest.CompiledForest against the IsolationForest it was compiled from.
+
+Fits a keystroke model on one subject of the keystroke CSV and times
+decision_function on a single sample and on every sample at once, through
+sklearn and through the compiled forest. tests/test_forest.py checks that
+the two score bit-for-bit alike.
+
+Usage:
+    python scripts/bench_forest.py [--calls 500] [--csv collected_keystroke_data.csv]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import numpy as np
+import pandas as pd
+
+import keystroke
+
+CSV_FILE = os.path.join(BACKEND_DIR, 'collected_keystroke_data.csv')
+
+
+def time_calls(score, X, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        score(X)
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=500, help='timed calls per path')
+    parser.add_argument('--csv', default=CSV_FILE)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv)
+    samples = df.drop(columns=keystroke.NON_FEATURE_COLUMNS, errors='ignore').to_dict('records')
+    with contextlib.redirect_stdout(io.StringIO()):
+        fitted = keystroke.fit_from_csv(args.csv, df['subject'].iloc[0])
+
+    for name, X in [('one sample', fitted.vector(samples[0])),
+                    (f"{len(samples)} samples", np.vstack([fitted.vector(sample) for sample in samples]))]:
+        sklearn_us = time_calls(fitted.model.decision_function, X, args.calls)
+        compiled_us = time_calls(fitted.forest.decision_function, X, args.calls)
+        print(f"{name:12s} sklearn {sklearn_us:9.1f} us, compiled {compiled_us:9.1f} us "
+              f"({sklearn_us / compiled_us:.1f}x)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
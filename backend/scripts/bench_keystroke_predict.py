@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Time KeystrokeAuthenticator.predict against the DataFrame path it replaced.
+
+Fits a model on one subject of the keystroke CSV and times the old one-row
+DataFrame + StandardScaler.transform path, predict and predict_many.
+tests/test_keystroke.py checks that they return exactly the same results.
+
+Usage:
+    python scripts/bench_keystroke_predict.py [--calls 2000] [--csv collected_keystroke_data.csv]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import numpy as np
+import pandas as pd
+
+import keystroke
+
+CSV_FILE = os.path.join(BACKEND_DIR, 'collected_keystroke_data.csv')
+
+
+def reference_predict(authenticator, keystroke_data):
+    """The predict implementation before the fast path, kept here to time against."""
+    input_df = pd.DataFrame([keystroke_data])[authenticator.feature_columns]
+    input_scaled = authenticator.scaler.transform(input_df)
+    raw_score = authenticator.model.decision_function(input_scaled)[0]
+    status = "Anomaly" if raw_score < 0 else "Normal"
+    score_range = authenticator.max_score_ - authenticator.min_score_
+    normalized_score = 0.5 if score_range == 0 else (raw_score - authenticator.min_score_) / score_range
+    normalized_score = np.clip(normalized_score, 0, 1)
+    return {
+        "status": status,
+        "anomaly_confidence_percent": round((1 - normalized_score) * 100, 2),
+        "raw_score": round(raw_score, 4)
+    }
+
+
+def time_calls(predict, samples, calls):
+    started = time.perf_counter()
+    for i in range(calls):
+        predict(samples[i % len(samples)])
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=2000, help='timed predictions per path')
+    parser.add_argument('--csv', default=CSV_FILE)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv)
+    samples = df.drop(columns=keystroke.NON_FEATURE_COLUMNS, errors='ignore').to_dict('records')
+    with contextlib.redirect_stdout(io.StringIO()):
+        authenticator = keystroke.fit_from_csv(args.csv, df['subject'].iloc[0])
+
+    reference = time_calls(lambda sample: reference_predict(authenticator, sample), samples, args.calls)
+    fast = time_calls(authenticator.predict, samples, args.calls)
+    vector = time_calls(authenticator.vector, samples, args.calls)
+    print(f"DataFrame path:  {reference:8.1f} us/call")
+    print(f"predict:         {fast:8.1f} us/call  ({reference / fast:.1f}x)")
+    print(f"  of which input mapping and scaling: {vector:.1f} us")
+    started = time.perf_counter()
+    authenticator.predict_many(samples)
+    batch = (time.perf_counter() - started) / len(samples) * 1e6
+    print(f"predict_many:    {batch:8.1f} us/sample  ({len(samples)} samples, {fast / batch:.1f}x predict)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
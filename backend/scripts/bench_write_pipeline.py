@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Compare per-request commits with the group-commit write pipeline.
+
+Runs the same bill-payment style write (insert a transaction, debit the
+balance) from many threads, first with each thread committing on its own
+pooled connection and then through WritePipeline, on a scratch database.
+
+Usage:
+    python scripts/bench_write_pipeline.py [--threads 16] [--writes 200] [--synchronous FULL]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import ids
+from db import ConnectionPool
+from migrations import migrate
+from writes import WritePipeline
+
+USER_ID = 'bench-user'
+
+
+def pay(conn):
+    conn.execute('''
+        INSERT INTO transactions (id, user_id, type, amount, description, status, completed_at)
+        VALUES (?, ?, 'BILL_PAYMENT', 1, 'bench', 'COMPLETED', CURRENT_TIMESTAMP)
+    ''', (ids.new_id(), USER_ID))
+    conn.execute("UPDATE users SET balance = balance - 1 WHERE id = ?", (USER_ID,))
+
+
+def run_threads(threads, writes, work):
+    def worker():
+        for _ in range(writes):
+            work()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return threads * writes / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--writes', type=int, default=200, help='writes per thread')
+    parser.add_argument('--synchronous', default='FULL', help='PRAGMA synchronous for both runs')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        migrate(database)
+        pool = ConnectionPool(database, max_size=args.threads + 1, pragmas={'synchronous': args.synchronous})
+        conn = pool.connection()
+        conn.execute("INSERT INTO users (id, email, password, first_name, last_name, phone, account_number, balance) "
+                     "VALUES (?, 'bench@example.com', '', 'Bench', 'User', '0', '0', 1e12)", (USER_ID,))
+        conn.commit()
+        conn.close()
+
+        def direct():
+            conn = pool.connection()
+            pay(conn)
+            conn.commit()
+            conn.close()
+
+        per_request = run_threads(args.threads, args.writes, direct)
+
+        pipeline = WritePipeline(pool)
+        grouped = run_threads(args.threads, args.writes, lambda: pipeline.execute(pay))
+        pipeline.stop()
+        stats = pipeline.metrics()
+        pool.close_all()
+
+    print(f"per-request commits: {per_request:10.0f} writes/s")
+    print(f"group commit:        {grouped:10.0f} writes/s  ({grouped / per_request:.1f}x, "
+          f"avg batch {stats['batch_size_avg']}, max {stats['batch_size_max']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Export user_events into the columnar per-user store (event_store.py) now.
+
+The app runs an incremental pass every ARCHIVE_INTERVAL_SECONDS. This script
+runs one over every shard file, or with --rebuild re-exports everything,
+archived months included, for example after a shard rebalance.
+
+Usage:
+    python scripts/compact_events.py [--rebuild]          (from the backend directory)
+"""
+
+import argparse
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import event_store
+from shards import existing_shards
+
+DATABASE = os.path.join(BACKEND_DIR, 'banking.db')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compact user events into per-user columnar files')
+    parser.add_argument('--rebuild', action='store_true', help='re-export every event instead of only new ones')
+    parser.add_argument('--database', default=DATABASE, help='common database file (default: banking.db)')
+    parser.add_argument('--batch-size', type=int, default=50000, help='rows read per query')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+
+    for shard, path in sorted(existing_shards(args.database).items()):
+        started = time.monotonic()
+        if args.rebuild:
+            result = event_store.rebuild(path, batch_size=args.batch_size)
+        else:
+            result = event_store.compact(path, batch_size=args.batch_size)
+        print(f"{path}: exported {result['rows']} events for {result['users']} users "
+              f"in {time.monotonic() - started:.1f}s -> {event_store.store_path(path)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Enroll users for biometric login from a keystroke CSV.
+
+Fits a model on each subject's rows of the CSV (collected_keystroke_data.csv
+by default) and saves it in the model directory as the next version for the
+account's email. A running app picks the new version up the next time the
+user's model is loaded; restart it to replace one already in memory.
+
+Usage:
+    python scripts/enroll_keystrokes.py Pranav=pranavm2323@gmail.com [Subject=email ...]   (from the backend directory)
+"""
+
+import argparse
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import keystroke
+
+CSV_FILE = os.path.join(BACKEND_DIR, 'collected_keystroke_data.csv')
+MODEL_DIR = os.environ.get('KEYSTROKE_MODEL_DIR', os.path.join(BACKEND_DIR, 'keystroke_models'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fit and save per-user keystroke models')
+    parser.add_argument('enrollments', nargs='+', metavar='SUBJECT=EMAIL',
+                        help='CSV subject and the account email to enroll it for')
+    parser.add_argument('--csv', default=CSV_FILE, help='keystroke samples (default: collected_keystroke_data.csv)')
+    parser.add_argument('--model-dir', default=MODEL_DIR, help='model directory (default: keystroke_models)')
+    args = parser.parse_args()
+
+    registry = keystroke.ModelRegistry(args.model_dir)
+    for enrollment in args.enrollments:
+        subject, separator, email = enrollment.partition('=')
+        if not separator or not subject or not email:
+            parser.error(f"expected SUBJECT=EMAIL, got {enrollment!r}")
+        version = registry.save(email, keystroke.fit_from_csv(args.csv, subject))
+        print(f"{subject} -> {email}: saved version {version} at {registry.path(email)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+"""
+Generate a large, reproducible data set for benchmarking.
+
+Creates N users, each with a history of transactions (a realistic mix of
+bill payments, recharges, transfers, trades, fixed deposits and tax
+payments) spread over the last --days days, the portfolio, fixed deposits
+and tax payments those transactions imply, and user_events sessions
+(login, page views and actions, logout). The same --seed always produces
+the same users and history; timestamps are relative to the time of the run.
+
+Rows are bulk-loaded with executemany, in one transaction per --chunk-size
+rows and with relaxed pragmas (synchronous=OFF, an in-memory journal) while
+loading. Users are written to the shard their id hashes to, following the
+layout recorded in banking.db. Stop the app first, and run it against a copy
+of the database if you want to keep the original small.
+
+Every generated user has the password given by --password.
+
+Usage:
+    python scripts/generate_scale_data.py --users 1000                                  (from the backend directory)
+    python scripts/generate_scale_data.py --users 100000 --transactions 50 --sessions 40 --database /tmp/scale.db
+"""
+
+import argparse
+import datetime
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+from werkzeug.security import generate_password_hash
+
+from ids import format_id
+from migrations import migrate
+from partitions import insert_events
+from rollups import BUCKET_MS, UPSERT_ROLLUP_SQL
+from shards import shard_of, shard_path
+
+DATABASE = os.path.join(BACKEND_DIR, 'banking.db')
+
+# Event types the app only counts per minute (see rollups.py) instead of storing as rows, when anonymous
+ROLLUP_TYPES = {name.strip() for name in os.environ.get('EVENT_ROLLUP_TYPES', 'stocks_view').split(',') if name.strip()}
+
+# Pragmas for the duration of the load; nothing here needs to survive a crash
+LOAD_PRAGMAS = {
+    'synchronous': 'OFF',
+    'journal_mode': 'MEMORY',
+    'temp_store': 'MEMORY',
+    'cache_size': -262144,
+}
+
+# Transaction type mix (relative weights)
+TRANSACTION_MIX = {
+    'BILL_PAYMENT': 22,
+    'RECHARGE': 14,
+    'TRANSFER_OUT': 16,
+    'TRANSFER_IN': 10,
+    'BUY': 12,
+    'SELL': 8,
+    'DEPOSIT': 4,
+    'TAX_DIRECT': 2,
+    'TAX_GST': 2,
+    'TAX_STATE': 2,
+}
+
+# Events a session is made of, with relative weights, between its login and logout
+SESSION_EVENTS = {
+    'portfolio_view': 20,
+    'stocks_view': 18,
+    'account_statement_view': 12,
+    'bill_payment': 10,
+    'recharge': 8,
+    'beneficiary_transfer': 8,
+    'own_account_transfer': 3,
+    'stock_buy': 7,
+    'stock_sell': 5,
+    'fd_details_view': 4,
+    'fd_created': 2,
+    'fd_certificate_download': 1,
+    'fd_export': 1,
+    'account_statement_export': 1,
+}
+
+EVENT_PAGES = {
+    'login_success': ('/login', 'biometric'),
+    'login_failed': ('/login', 'biometric'),
+    'logout': ('/logout', 'logout'),
+    'portfolio_view': ('/portfolio', 'portfolio_view'),
+    'stocks_view': ('/stocks', 'market_data'),
+    'account_statement_view': ('/account-statement', 'statement_view'),
+    'account_statement_export': ('/account-statement/export', 'statement_export'),
+    'bill_payment': ('/bills', 'BILL_PAYMENT'),
+    'recharge': ('/recharge', 'RECHARGE'),
+    'beneficiary_transfer': ('/transfers', 'TRANSFER_OUT'),
+    'own_account_transfer': ('/transfers', 'TRANSFER_IN'),
+    'stock_buy': ('/stocks/{symbol}', 'stock_trading'),
+    'stock_sell': ('/stocks/{symbol}', 'stock_trading'),
+    'fd_created': ('/fixed-deposits', 'fd_creation'),
+    'fd_details_view': ('/fixed-deposits/{fd_id}', 'fd_details'),
+    'fd_certificate_download': ('/fixed-deposits/{fd_id}', 'fd_certificate'),
+    'fd_export': ('/fixed-deposits/export', 'fd_export'),
+}
+
+BILL_PROVIDERS = [('KSEB', 'Electricity Bill'), ('Airtel', 'Broadband'), ('Kerala Water Authority', 'Water Bill'),
+                  ('Tata Play', 'DTH'), ('Indane', 'Gas Cylinder'), ('LIC', 'Insurance Premium')]
+RECHARGE_PROVIDERS = ['Jio', 'Airtel', 'Vi', 'BSNL']
+FIRST_NAMES = ['Aarav', 'Vivaan', 'Aditya', 'Arjun', 'Sai', 'Ananya', 'Diya', 'Meera', 'Priya', 'Lakshmi',
+               'Rahul', 'Karthik', 'Nikhil', 'Sneha', 'Divya', 'Rohan', 'Kavya', 'Ishaan', 'Neha', 'Pranav']
+LAST_NAMES = ['Sharma', 'Nair', 'Iyer', 'Reddy', 'Menon', 'Patel', 'Gupta', 'Kumar', 'Singh', 'Das',
+              'Pillai', 'Rao', 'Joshi', 'Verma', 'Mehta']
+STATES = ['Kerala', 'Karnataka', 'Tamil Nadu', 'Maharashtra', 'Delhi']
+FD_RATES = {
+    'REGULAR': {12: 6.8, 24: 7.5, 36: 7.2, 60: 7.8, 120: 8.1},
+    'SENIOR': {12: 7.3, 24: 8.0, 36: 7.7, 60: 8.3, 120: 8.6},
+    'TAX_SAVING': {60: 7.2},
+}
+
+COLUMNS = {
+    'users': ['id', 'email', 'password', 'first_name', 'last_name', 'phone', 'balance', 'account_number',
+              'created_at'],
+    'transactions': ['id', 'user_id', 'type', 'symbol', 'shares', 'amount', 'price', 'description', 'status',
+                     'created_at', 'completed_at', 'reference', 'counterparty', 'created_at_ms'],
+    'portfolio': ['id', 'user_id', 'symbol', 'shares', 'buy_price', 'total_investment', 'purchase_date'],
+    'fixed_deposits': ['id', 'user_id', 'amount', 'interest_rate', 'tenure', 'start_date', 'maturity_date', 'type',
+                       'status', 'interest_earned', 'maturity_amount', 'created_at', 'created_at_ms'],
+    'tax_payments': ['id', 'user_id', 'transaction_id', 'tax_type', 'pan_tan', 'assessment_year', 'tax_applicable',
+                     'payment_type', 'gstin', 'cpin', 'cgst', 'sgst', 'igst', 'cess', 'state', 'municipality',
+                     'service_type', 'consumer_id', 'amount', 'status', 'created_at', 'created_at_ms'],
+    'user_events': ['id', 'user_email', 'event_type', 'time', 'page_url', 'transaction_amount', 'transaction_type',
+                    'additional_data', 'time_ms'],
+}
+
+
+def timestamp(epoch_ms):
+    """CURRENT_TIMESTAMP-style UTC text for an epoch-millisecond value."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(epoch_ms // 1000))
+
+
+class Generator:
+    """Produces the rows for one user at a time from a seeded random source."""
+    def __init__(self, seed, stocks, days, transactions, sessions, email_domain):
+        self.rng = random.Random(seed)
+        self.stocks = stocks
+        self.now_ms = int(time.time() * 1000)
+        self.span_ms = days * 86400000
+        self.transactions = transactions
+        self.sessions = sessions
+        self.email_domain = email_domain
+        self.transaction_types = list(TRANSACTION_MIX)
+        self.transaction_weights = list(TRANSACTION_MIX.values())
+        self.session_events = list(SESSION_EVENTS)
+        self.session_weights = list(SESSION_EVENTS.values())
+
+    def uuid(self, at_ms):
+        # A time-ordered id like ids.new_id(), for a row created at at_ms, from the seeded generator
+        bits = self.rng.getrandbits(128)
+        return format_id(at_ms, bits >> 116, bits)
+
+    def moment(self):
+        return self.now_ms - self.rng.randrange(self.span_ms)
+
+    def count(self, mean):
+        """A per-user count around mean, so users are not all the same size."""
+        return max(0, int(self.rng.expovariate(1 / mean))) if mean else 0
+
+    def user(self, number, password_hash):
+        rng = self.rng
+        user_id = self.uuid(self.now_ms - self.span_ms)
+        email = f"user{number}@{self.email_domain}"
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        rows = {table: [] for table in COLUMNS}
+        rows['users'].append((user_id, email, password_hash, first, last, f"+91-9{rng.randrange(10 ** 9):09d}",
+                              round(rng.uniform(5000, 500000), 2), f"{number:018d}",
+                              timestamp(self.now_ms - self.span_ms)))
+
+        holdings = {}
+        for _ in range(self.count(self.transactions)):
+            self._transaction(user_id, rows, holdings)
+        for (symbol, price), shares in holdings.items():
+            if shares > 0:
+                purchased_ms = self.moment()
+                rows['portfolio'].append((self.uuid(purchased_ms), user_id, symbol, shares, price,
+                                          round(shares * price, 2), timestamp(purchased_ms)))
+        for _ in range(self.count(self.sessions)):
+            self._session(email, rows)
+        return user_id, email, rows
+
+    def _transaction(self, user_id, rows, holdings):
+        rng = self.rng
+        kind = rng.choices(self.transaction_types, self.transaction_weights)[0]
+        created_ms = self.moment()
+        transaction_id = self.uuid(created_ms)
+        created = timestamp(created_ms)
+        symbol = shares = price = reference = counterparty = None
+
+        if kind == 'BILL_PAYMENT':
+            provider, category = rng.choice(BILL_PROVIDERS)
+            amount = round(rng.uniform(100, 5000), 2)
+            description = f"Bill payment for {category} ({provider})"
+            counterparty = provider
+        elif kind == 'RECHARGE':
+            provider = rng.choice(RECHARGE_PROVIDERS)
+            mobile = f"9{rng.randrange(10 ** 9):09d}"
+            amount = float(rng.choice([149, 199, 239, 299, 399, 499, 719, 2999]))
+            description = f"Prepaid Recharge - {provider} ({mobile})"
+            counterparty, reference = provider, mobile
+        elif kind == 'TRANSFER_OUT':
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            amount = -round(rng.uniform(500, 50000), 2)
+            description = f"{rng.choice(['IMPS', 'NEFT', 'RTGS'])} transfer to {name} ({rng.randrange(10000):04d})"
+            counterparty = name
+        elif kind == 'TRANSFER_IN':
+            amount = round(rng.uniform(1000, 100000), 2)
+            description = "Fund transfer to own account"
+            counterparty = 'Own Account'
+        elif kind in ('BUY', 'SELL'):
+            symbol, price = rng.choice(self.stocks)
+            shares = rng.randint(1, 50)
+            amount = round(shares * price, 2)
+            if kind == 'BUY':
+                holdings[(symbol, price)] = holdings.get((symbol, price), 0) + shares
+                description = f"Bought {shares} shares of {symbol}"
+            else:
+                description = f"Sold {shares} shares of {symbol}"
+        elif kind == 'DEPOSIT':
+            fd_type = rng.choice(list(FD_RATES))
+            tenure = rng.choice(list(FD_RATES[fd_type]))
+            rate = FD_RATES[fd_type][tenure]
+            amount = float(rng.randrange(10, 500) * 1000)
+            maturity = round(amount * (1 + rate / 400) ** (tenure / 3), 2)
+            start_ms = created_ms
+            end_ms = start_ms + tenure * 30 * 86400000
+            status = 'MATURED' if end_ms < self.now_ms else 'ACTIVE'
+            elapsed = min(1.0, (self.now_ms - start_ms) / (end_ms - start_ms))
+            rows['fixed_deposits'].append((self.uuid(created_ms), user_id, amount, rate, tenure, timestamp(start_ms),
+                                           timestamp(end_ms), fd_type, status, round((maturity - amount) * elapsed, 2),
+                                           maturity, created, created_ms))
+            description = f"Fixed Deposit created - {fd_type} for {tenure} months"
+        else:
+            amount = round(rng.uniform(1000, 200000), 2)
+            payment = [None] * 14
+            if kind == 'TAX_DIRECT':
+                pan = f"ABCDE{rng.randrange(10000):04d}F"
+                year = datetime.datetime.fromtimestamp(created_ms / 1000).year
+                payment[0:4] = [pan, f"{year}-{str(year + 1)[2:]}", 'INCOME_TAX', 'ADVANCE_TAX']
+                description = f"Direct Tax Payment - PAN: {pan}"
+                counterparty = 'Income Tax Department'
+            elif kind == 'TAX_GST':
+                gstin = f"32ABCDE{rng.randrange(10000):04d}F1Z5"
+                cgst = sgst = round(amount * 0.45, 2)
+                payment[4:10] = [gstin, f"CPIN{rng.randrange(10 ** 10):010d}", cgst, sgst, 0.0,
+                                 round(amount - cgst - sgst, 2)]
+                description = f"GST Payment - GSTIN: {gstin}"
+                counterparty = 'GST Network'
+            else:
+                state = rng.choice(STATES)
+                service = rng.choice(['Property Tax', 'Professional Tax', 'Vehicle Tax'])
+                payment[10:14] = [state, f"{state} Municipality", service, f"C{rng.randrange(10 ** 6):06d}"]
+                description = f"{service} - {state}"
+                counterparty = f"{state} Government"
+            rows['tax_payments'].append((self.uuid(created_ms), user_id, transaction_id, kind[4:], *payment[:6],
+                                         *(value or 0.0 for value in payment[6:10]), *payment[10:], amount,
+                                         'COMPLETED', created, created_ms))
+            amount = -amount
+
+        rows['transactions'].append((transaction_id, user_id, kind, symbol, shares, amount, price, description,
+                                     'COMPLETED', created, created, reference, counterparty, created_ms))
+
+    def _session(self, email, rows):
+        rng = self.rng
+        at_ms = self.moment()
+        events = ['login_success'] if rng.random() > 0.03 else ['login_failed', 'login_success']
+        events += rng.choices(self.session_events, self.session_weights, k=rng.randint(1, 12))
+        if rng.random() < 0.7:
+            events.append('logout')
+
+        for event_type in events:
+            page, transaction_type = EVENT_PAGES[event_type]
+            amount = 0.0
+            data = None
+            if event_type in ('stock_buy', 'stock_sell'):
+                symbol, price = rng.choice(self.stocks)
+                shares = rng.randint(1, 50)
+                page = page.format(symbol=symbol)
+                amount = round(shares * price, 2)
+                data = {'symbol': symbol, 'shares': shares, 'price': price}
+            elif event_type.startswith('fd_'):
+                fd_id = self.uuid(at_ms)
+                page = page.format(fd_id=fd_id)
+                if event_type == 'fd_created':
+                    amount = float(rng.randrange(10, 500) * 1000)
+                data = {'fd_id': fd_id}
+            elif event_type in ('bill_payment', 'recharge', 'beneficiary_transfer', 'own_account_transfer'):
+                amount = round(rng.uniform(100, 20000), 2)
+                data = {'beneficiary_id': self.uuid(at_ms)} if event_type == 'beneficiary_transfer' else None
+            elif event_type == 'account_statement_view':
+                data = {'period': rng.choice(['byDate', 'last6Months', 'financialYear'])}
+
+            # Market data is viewed before login in the app, so those events are anonymous
+            owner = 'anonymous' if event_type == 'stocks_view' else email
+            rows['user_events'].append((self.uuid(at_ms), owner, event_type, timestamp(at_ms), page, amount,
+                                        transaction_type, json.dumps(data) if data else None, at_ms))
+            at_ms += rng.randint(2000, 180000)
+
+
+class Loader:
+    """Buffers rows per shard file and table and writes them with executemany."""
+    def __init__(self, paths, chunk_size):
+        self.chunk_size = chunk_size
+        self.connections = []
+        self.journal_modes = []
+        for path in paths:
+            conn = sqlite3.connect(path, isolation_level=None)
+            self.journal_modes.append(conn.execute("PRAGMA journal_mode").fetchone()[0])
+            for name, value in LOAD_PRAGMAS.items():
+                conn.execute(f"PRAGMA {name} = {value}")
+            self.connections.append(conn)
+        self.buffers = [{table: [] for table in COLUMNS} for _ in paths]
+        self.directory = []
+        self.pending = 0
+        self.rollups = {}
+        self.written = {table: 0 for table in COLUMNS}
+        self.written['event_rollups'] = 0
+
+    def add(self, shard, rows):
+        for table, table_rows in rows.items():
+            if table == 'user_events':
+                for row in table_rows:
+                    if row[1] == 'anonymous' and row[2] in ROLLUP_TYPES:
+                        key = (row[2], row[-1] - row[-1] % BUCKET_MS, row[4] or '')
+                        self.rollups[key] = self.rollups.get(key, 0) + 1
+                    else:
+                        # Anonymous events belong to the common file
+                        self.buffers[0 if row[1] == 'anonymous' else shard][table].append(row)
+            else:
+                self.buffers[shard][table].extend(table_rows)
+            self.pending += len(table_rows)
+        if self.pending >= self.chunk_size:
+            self.flush()
+
+    def register(self, email, user_id):
+        """Users on shards other than 0 also need an entry in the common email directory."""
+        self.directory.append((email, user_id))
+
+    def flush(self):
+        for conn, buffers in zip(self.connections, self.buffers):
+            conn.execute("BEGIN")
+            for table, rows in buffers.items():
+                if rows and table == 'user_events':
+                    # Straight into the monthly partitions, creating the ones the history needs
+                    insert_events(conn, rows)
+                    self.written[table] += len(rows)
+                    rows.clear()
+                elif rows:
+                    columns = COLUMNS[table]
+                    conn.executemany(f"INSERT INTO {table} ({', '.join(columns)}) "
+                                     f"VALUES ({', '.join('?' * len(columns))})", rows)
+                    self.written[table] += len(rows)
+                    rows.clear()
+            if conn is self.connections[0] and self.directory:
+                conn.executemany("INSERT INTO user_directory (email, user_id) VALUES (?, ?)", self.directory)
+                self.directory.clear()
+            if conn is self.connections[0] and self.rollups:
+                conn.executemany(UPSERT_ROLLUP_SQL, [key + (count,) for key, count in self.rollups.items()])
+                self.written['event_rollups'] += len(self.rollups)
+                self.rollups.clear()
+            conn.execute("COMMIT")
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        for conn, journal_mode in zip(self.connections, self.journal_modes):
+            conn.execute("PRAGMA synchronous = FULL")
+            conn.execute(f"PRAGMA journal_mode = {journal_mode}")
+            conn.execute("ANALYZE")
+            conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a large, reproducible benchmark data set')
+    parser.add_argument('--users', type=int, required=True, help='number of users to create')
+    parser.add_argument('--transactions', type=float, default=20, help='average transactions per user (default 20)')
+    parser.add_argument('--sessions', type=float, default=10, help='average event sessions per user (default 10)')
+    parser.add_argument('--days', type=int, default=730, help='spread history over this many days (default 730)')
+    parser.add_argument('--seed', type=int, default=42, help='random seed (default 42)')
+    parser.add_argument('--start', type=int, default=0,
+                        help='number of the first user, to add another batch to a generated database')
+    parser.add_argument('--email-domain', default='scale.example', help='domain of the generated emails')
+    parser.add_argument('--password', default='Scale@123', help='password for every generated user')
+    parser.add_argument('--chunk-size', type=int, default=50000, help='rows per transaction (default 50000)')
+    parser.add_argument('--database', default=DATABASE, help='common database file (default: banking.db)')
+    args = parser.parse_args()
+
+    if args.users < 1:
+        parser.error('--users must be at least 1')
+
+    migrate(args.database)
+    conn = sqlite3.connect(args.database)
+    try:
+        stocks = conn.execute("SELECT symbol, price FROM stocks ORDER BY symbol").fetchall()
+        layout = conn.execute("SELECT shard_count FROM shard_layout WHERE id = 1").fetchone()
+        taken = conn.execute("SELECT COUNT(*) FROM user_directory WHERE email = ?",
+                             (f"user{args.start}@{args.email_domain}",)).fetchone()[0]
+    finally:
+        conn.close()
+    if not stocks:
+        parser.error(f"{args.database} has no stocks; start the app once to seed it")
+    if taken:
+        parser.error(f"user{args.start}@{args.email_domain} already exists; pass --start or --email-domain")
+
+    shard_count = layout[0] if layout else 1
+    paths = [shard_path(args.database, shard) for shard in range(shard_count)]
+    for path in paths[1:]:
+        migrate(path)
+
+    generator = Generator(args.seed + args.start, stocks, args.days, args.transactions, args.sessions,
+                          args.email_domain)
+    password_hash = generate_password_hash(args.password)
+    loader = Loader(paths, args.chunk_size)
+
+    started = time.monotonic()
+    for number in range(args.start, args.start + args.users):
+        user_id, email, rows = generator.user(number, password_hash)
+        shard = shard_of(user_id, shard_count)
+        loader.add(shard, rows)
+        if shard != 0:
+            loader.register(email, user_id)
+        if (number - args.start + 1) % 10000 == 0:
+            print(f"  {number - args.start + 1} users...")
+    loader.close()
+    elapsed = time.monotonic() - started
+
+    total = sum(loader.written.values())
+    print(f"Generated {total} rows in {elapsed:.1f}s ({total / elapsed:,.0f} rows/s) across {shard_count} shard(s):")
+    for table, count in loader.written.items():
+        print(f"  {table}: {count}")
+    print(f"Log in as user{args.start}@{args.email_domain} with password {args.password}")
+
+
+if __name__ == '__main__':
+    main()
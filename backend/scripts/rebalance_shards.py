@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Move users between shard files after changing SQLITE_SHARD_COUNT.
+
+Every user is moved, with all of their rows, to the shard their id hashes
+to for the new count. The email directory in banking.db is rebuilt and the
+new count is recorded, which the app checks at boot. Stop the app first.
+The script is safe to re-run if it is interrupted.
+
+Usage:
+    python scripts/rebalance_shards.py --shards 4          (from the backend directory)
+    python scripts/rebalance_shards.py --shards 1          (fold everything back into banking.db)
+"""
+
+import argparse
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+from shards import rebalance
+
+DATABASE = os.path.join(BACKEND_DIR, 'banking.db')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebalance users across SQLite shard files')
+    parser.add_argument('--shards', type=int, required=True, help='new shard count (SQLITE_SHARD_COUNT)')
+    parser.add_argument('--database', default=DATABASE, help='common database file (default: banking.db)')
+    args = parser.parse_args()
+
+    if args.shards < 1:
+        parser.error('--shards must be at least 1')
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+
+    rebalance(args.database, args.shards)
+    print(f"Set SQLITE_SHARD_COUNT={args.shards} before starting the app.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Recompute the hourly and daily activity tables (activity.py) from raw events.
+
+The tables are kept up to date as events are written, so this is only
+needed to backfill: after events were deleted or restored by hand, or to
+count archived months that were moved out before the tables existed. Each
+shard file is rebuilt in one transaction, from its hot partitions and its
+monthly archive files.
+
+Usage:
+    python scripts/rebuild_activity.py          (from the backend directory)
+"""
+
+import argparse
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BACKEND_DIR)
+
+import activity
+from archive import archive_files
+from migrations import migrate
+from shards import existing_shards
+
+DATABASE = os.path.join(BACKEND_DIR, 'banking.db')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild the hourly and daily activity tables')
+    parser.add_argument('--database', default=DATABASE, help='common database file (default: banking.db)')
+    parser.add_argument('--skip-archive', action='store_true', help='count only events in the hot files')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.database):
+        parser.error(f"{args.database} does not exist")
+
+    for shard, path in sorted(existing_shards(args.database).items()):
+        migrate(path)
+        started = time.monotonic()
+        archived = [] if args.skip_archive else archive_files(path, 0, int(time.time() * 1000))
+        counts = activity.rebuild(path, archived)
+        print(f"{path}: {counts['user_activity_hourly']} hourly and {counts['user_activity_daily']} daily rows "
+              f"from {len(archived)} archive file(s) in {time.monotonic() - started:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -26,12 +26,34 @@ from datetime import datetime
 # Add parent directory to path to import from backend
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+import activity
+import event_store
+from shards import ShardRouter, recorded_shard_count
+
 DATABASE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'banking.db')
 DEFAULT_BALANCE = 100000.0  # 1 lakh
 
+def user_database(email):
+    """The shard file holding a user's rows, found through the common email directory"""
+    shards = ShardRouter(DATABASE, shard_count=recorded_shard_count(DATABASE))
+    return shards.path_for(shards.user_id_for_email(email))
+
+def clear_legacy_table(cursor, table, user_id):
+    """Delete a user's rows from a table only the original banking.db has; new shard files lack it"""
+    if not has_table(cursor, table):
+        return 0
+    cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (user_id,))
+    count = cursor.fetchone()[0]
+    cursor.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
+    return count
+
+def has_table(cursor, table):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    return cursor.fetchone() is not None
+
 def get_user_by_email(email):
     """Get user information by email"""
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(user_database(email))
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
     
@@ -52,24 +74,26 @@ def reset_user_account(email):
         return False
     
     user_id = user['id']
-    print(f"✓ Found user: {user['first_name']} {user['last_name']} (ID: {user_id})")
+    user_key = user['user_key']
+    database = user_database(email)
+    print(f"✓ Found user: {user['first_name']} {user['last_name']} (ID: {user_id}) in {database}")
     
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(database)
     cursor = conn.cursor()
     
     try:
         print("\n🧹 Clearing user data...")
         
         # 1. Delete all transactions
-        cursor.execute("SELECT COUNT(*) FROM transactions WHERE user_id = ?", (user_id,))
+        cursor.execute("SELECT COUNT(*) FROM transactions WHERE user_key = ?", (user_key,))
         transaction_count = cursor.fetchone()[0]
-        cursor.execute("DELETE FROM transactions WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM transactions WHERE user_key = ?", (user_key,))
         print(f"✓ Deleted {transaction_count} transactions")
         
         # 2. Delete all stock investments (portfolio)
-        cursor.execute("SELECT COUNT(*) FROM portfolio WHERE user_id = ?", (user_id,))
+        cursor.execute("SELECT COUNT(*) FROM portfolio WHERE user_key = ?", (user_key,))
         stock_count = cursor.fetchone()[0]
-        cursor.execute("DELETE FROM portfolio WHERE user_id = ?", (user_id,))
+        cursor.execute("DELETE FROM portfolio WHERE user_key = ?", (user_key,))
         print(f"✓ Deleted {stock_count} stock investments")
         
         # 3. Delete all fixed deposits
@@ -103,27 +127,22 @@ def reset_user_account(email):
         print(f"✓ Deleted {tax_count} tax payments")
         
         # 8. Delete all bills
-        cursor.execute("SELECT COUNT(*) FROM bills WHERE user_id = ?", (user_id,))
-        bills_count = cursor.fetchone()[0]
-        cursor.execute("DELETE FROM bills WHERE user_id = ?", (user_id,))
+        bills_count = clear_legacy_table(cursor, 'bills', user_id)
         print(f"✓ Deleted {bills_count} bills")
         
         # 9. Delete all bill payments
-        cursor.execute("SELECT COUNT(*) FROM bill_payments WHERE user_id = ?", (user_id,))
-        bill_payments_count = cursor.fetchone()[0]
-        cursor.execute("DELETE FROM bill_payments WHERE user_id = ?", (user_id,))
+        bill_payments_count = clear_legacy_table(cursor, 'bill_payments', user_id)
         print(f"✓ Deleted {bill_payments_count} bill payments")
         
         # 10. Delete all user registered bills
-        cursor.execute("SELECT COUNT(*) FROM user_registered_bills WHERE user_id = ?", (user_id,))
-        registered_bills_count = cursor.fetchone()[0]
-        cursor.execute("DELETE FROM user_registered_bills WHERE user_id = ?", (user_id,))
+        registered_bills_count = clear_legacy_table(cursor, 'user_registered_bills', user_id)
         print(f"✓ Deleted {registered_bills_count} registered bills")
         
         # 11. Delete all user events (optional - for privacy)
         cursor.execute("SELECT COUNT(*) FROM user_events WHERE user_email = ?", (email,))
         events_count = cursor.fetchone()[0]
         cursor.execute("DELETE FROM user_events WHERE user_email = ?", (email,))
+        activity.remove_user(conn, email)
         print(f"✓ Deleted {events_count} user events")
         
         # 12. Reset user balance to default
@@ -137,6 +156,7 @@ def reset_user_account(email):
         
         # Commit all changes
         conn.commit()
+        event_store.remove_user(database, email)
         print(f"\n✅ Account reset completed successfully for {email}")
         print(f"📊 Summary:")
         print(f"   • Transactions cleared: {transaction_count}")
@@ -172,7 +192,7 @@ def verify_reset(email):
         return False
     
     user_id = user['id']
-    conn = sqlite3.connect(DATABASE)
+    conn = sqlite3.connect(user_database(email))
     cursor = conn.cursor()
     
     # Check all tables are empty for this user
@@ -200,6 +220,8 @@ def verify_reset(email):
     
     all_clear = True
     for table in tables_to_check:
+        if not has_table(cursor, table):
+            continue
         cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE user_id = ?", (user_id,))
         count = cursor.fetchone()[0]
         if count > 0:
@@ -0,0 +1,359 @@
+"""
+User-sharded SQLite storage.
+
+SQLite allows one writer per database file, so with every account in
+banking.db all writers in the bank queue on one lock. The shard router
+spreads users over N files by a stable hash of their user id. Each shard
+holds the user's own rows: users, transactions, portfolio, billers,
+autopay_rules, beneficiaries, fixed_deposits, tax_payments and user_events.
+Writers for users on different shards then never wait on each other.
+
+Shard 0 is banking.db itself, which is also the common file. It holds
+reference data shared by everyone (stocks) and the email -> user id
+directory used at login. Shards 1..N-1 live next to it as
+banking.shard<i>.db, ATTACH the common file as `common` and see its
+reference tables through TEMP views. Handler SQL is therefore the same on
+every shard. With the default of one shard nothing is attached and the
+layout is exactly the single banking.db.
+
+Every file carries the full schema so migrations stay uniform; on shards
+1..N-1 the local reference tables are simply shadowed and left empty.
+"""
+import glob
+import os
+import re
+import sqlite3
+import zlib
+from typing import Any, Dict, List, Optional
+
+import archive
+from db import ConnectionPool
+import partitions
+from migrations import migrate
+
+COMMON_SCHEMA = 'common'
+
+# Tables shared by every user; they live in the common file only
+REFERENCE_TABLES = ['stocks']
+
+# Per-user tables and the column that ties each row to its owner
+SHARDED_TABLES = {
+    'users': 'id',
+    'transactions': 'user_id',
+    'portfolio': 'user_id',
+    'billers': 'user_id',
+    'autopay_rules': 'user_id',
+    'beneficiaries': 'user_id',
+    'fixed_deposits': 'user_id',
+    'tax_payments': 'user_id',
+    'user_events': 'user_email',  # matched on the owner's email
+    'user_activity_hourly': 'user_email',
+    'user_activity_daily': 'user_email',
+}
+
+
+class ShardLayoutError(RuntimeError):
+    """The database files are laid out for a different shard count than configured."""
+
+
+def shard_path(database: str, shard: int) -> str:
+    """File for a shard; shard 0 is the common database itself."""
+    if shard == 0:
+        return database
+    root, ext = os.path.splitext(database)
+    return f"{root}.shard{shard}{ext}"
+
+
+def shard_of(user_id: str, shard_count: int) -> int:
+    """Stable placement of a user id; crc32 is the same in every process, unlike hash()."""
+    if shard_count == 1 or not user_id:
+        return 0
+    return zlib.crc32(user_id.encode('utf-8')) % shard_count
+
+
+class ShardRouter:
+    """
+    Connection pools (one writer and one read-only pool per shard) plus the
+    user -> shard mapping. A user_id of None means the common file.
+    """
+    def __init__(self, database: str, shard_count: int = 1, writer_size: int = 8, reader_size: int = 8,
+                 max_age: float = 3600.0, pragmas: Optional[Dict[str, Any]] = None):
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        self.database = database
+        self.shard_count = shard_count
+        self.paths = [shard_path(database, shard) for shard in range(shard_count)]
+        self.writers = []
+        self.readers = []
+        self._emails = {}
+
+        for shard, path in enumerate(self.paths):
+            options = dict(max_age=max_age, pragmas=pragmas)
+            if shard > 0:
+                options['attach'] = {COMMON_SCHEMA: database}
+                options['temp_views'] = {table: f"SELECT * FROM {COMMON_SCHEMA}.{table}"
+                                         for table in REFERENCE_TABLES}
+            self.writers.append(ConnectionPool(path, max_size=writer_size, **options))
+            self.readers.append(ConnectionPool(path, max_size=reader_size, read_only=True, **options))
+
+    @property
+    def common(self) -> ConnectionPool:
+        return self.writers[0]
+
+    def shard_for(self, user_id: Optional[str]) -> int:
+        return shard_of(user_id, self.shard_count)
+
+    def path_for(self, user_id: Optional[str] = None) -> str:
+        return self.paths[self.shard_for(user_id)]
+
+    def writer(self, user_id: Optional[str] = None) -> ConnectionPool:
+        return self.writers[self.shard_for(user_id)]
+
+    def reader(self, user_id: Optional[str] = None) -> ConnectionPool:
+        return self.readers[self.shard_for(user_id)]
+
+    def user_id_for_email(self, email: str) -> Optional[str]:
+        """Look a user up in the common directory. Only hits are cached, so new sign-ups are seen."""
+        user_id = self._emails.get(email)
+        if user_id is not None:
+            return user_id
+
+        conn = self.readers[0].connection()
+        try:
+            row = conn.execute("SELECT user_id FROM user_directory WHERE email = ?", (email,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+
+        if len(self._emails) >= 100000:
+            self._emails.clear()
+        self._emails[email] = row[0]
+        return row[0]
+
+    def shard_for_email(self, email: str) -> int:
+        """Shard holding an email's events; unknown emails (e.g. 'anonymous') go to the common file."""
+        if self.shard_count == 1:
+            return 0
+        return self.shard_for(self.user_id_for_email(email))
+
+    def register(self, email: str, user_id: str):
+        """Claim an email in the common directory; raises sqlite3.IntegrityError if it is taken."""
+        conn = self.common.connection()
+        try:
+            conn.execute("INSERT INTO user_directory (email, user_id) VALUES (?, ?)", (email, user_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def unregister(self, email: str, user_id: str):
+        conn = self.common.connection()
+        try:
+            conn.execute("DELETE FROM user_directory WHERE email = ? AND user_id = ?", (email, user_id))
+            conn.commit()
+        finally:
+            conn.close()
+        self._emails.pop(email, None)
+
+    def remove_user(self, email: str) -> Optional[str]:
+        """Remove an email's users row from its shard and free the email; returns the old user id, if any."""
+        user_id = self.user_id_for_email(email)
+        if user_id is None:
+            return None
+        conn = self.writer(user_id).connection()
+        try:
+            conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+            conn.commit()
+        finally:
+            conn.close()
+        self.unregister(email, user_id)
+        return user_id
+
+    def release_thread(self) -> int:
+        """Release every connection still bound to this thread; returns how many there were."""
+        return sum(pool.release_thread() for pool in self.writers + self.readers)
+
+    def metrics(self) -> List[Dict[str, Any]]:
+        return [
+            {'shard': shard, 'writer': writer.metrics(), 'reader': reader.metrics()}
+            for shard, (writer, reader) in enumerate(zip(self.writers, self.readers))
+        ]
+
+
+def check_layout(database: str, shard_count: int):
+    """Refuse to run against files laid out for a different shard count; a pre-sharding database counts as one."""
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("INSERT OR IGNORE INTO shard_layout (id, shard_count) VALUES (1, 1)")
+        conn.commit()
+        recorded = conn.execute("SELECT shard_count FROM shard_layout WHERE id = 1").fetchone()[0]
+    finally:
+        conn.close()
+    if recorded != shard_count:
+        raise ShardLayoutError(
+            f"{database} is laid out for {recorded} shard(s) but SQLITE_SHARD_COUNT is {shard_count}; "
+            f"run scripts/rebalance_shards.py --shards {shard_count}")
+
+
+def recorded_shard_count(database: str) -> int:
+    """Shard count the files are laid out for, for scripts that build their own ShardRouter."""
+    conn = sqlite3.connect(database)
+    try:
+        row = conn.execute("SELECT shard_count FROM shard_layout WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        # Not migrated to the sharded layout yet
+        row = None
+    finally:
+        conn.close()
+    return row[0] if row else 1
+
+
+def existing_shards(database: str) -> Dict[int, str]:
+    """Every shard file on disk for a database, including ones beyond the current count."""
+    root, ext = os.path.splitext(database)
+    found = {0: database}
+    for path in glob.glob(f"{glob.escape(root)}.shard*{ext}"):
+        match = re.search(r'\.shard(\d+)' + re.escape(ext) + '$', path)
+        if match:
+            found[int(match.group(1))] = path
+    return found
+
+
+def _columns(conn: sqlite3.Connection, schema: str, table: str) -> List[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _user_key(conn: sqlite3.Connection, schema: str, user_id: str) -> Optional[int]:
+    return conn.execute(f"SELECT user_key FROM {schema}.users WHERE id = ?", (user_id,)).fetchone()[0]
+
+
+def _primary_key(conn: sqlite3.Connection, table: str) -> List[str]:
+    return [row[1] for row in sorted(conn.execute(f"PRAGMA main.table_info({table})"), key=lambda r: r[5]) if row[5]]
+
+
+def _move_user(conn: sqlite3.Connection, user_id: str, email: str) -> int:
+    """
+    Copy one user's rows from main into the attached `dest` shard and commit,
+    then delete from main the rows dest now holds, in a second transaction.
+    """
+    moved = 0
+    copied = []
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        source_key = dest_key = None
+        for table, key in SHARDED_TABLES.items():
+            value = email if key == 'user_email' else user_id
+            if table == partitions.TABLE:
+                moved += partitions.copy_events(conn, 'main', 'dest', f"{key} = ?", (value,))
+                continue
+            dest_columns = set(_columns(conn, 'dest', table))
+            columns = [c for c in _columns(conn, 'main', table) if c in dest_columns]
+            if table == 'users' and 'user_key' in columns:
+                # User keys are per file: the destination's trigger hands out a new one
+                source_key = _user_key(conn, 'main', user_id)
+                columns.remove('user_key')
+            selected = list(columns)
+            where, params = f"{key} = ?", (value,)
+            if table != 'users' and 'user_key' in columns and dest_key is not None:
+                selected = ['?' if c == 'user_key' else c for c in columns]
+                where, params = "user_key = ?", (dest_key, source_key)
+            # OR REPLACE makes a re-run after an interrupted move converge instead of failing
+            moved += conn.execute(
+                f"INSERT OR REPLACE INTO dest.{table} ({', '.join(columns)}) "
+                f"SELECT {', '.join(selected)} FROM main.{table} WHERE {where}",
+                params).rowcount
+            copied.append((table, where, params[-1:]))
+            if table == 'users' and source_key is not None:
+                dest_key = _user_key(conn, 'dest', user_id)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    # Each file commits on its own, so the originals go only once the copy is durable in dest
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        partitions.delete_copied_events(conn, 'main', 'dest', "user_email = ?", (email,))
+        # users last, so a re-run still finds a user whose move was interrupted
+        for table, where, params in reversed(copied):
+            match = ' AND '.join(f"copy.{column} = {table}.{column}" for column in _primary_key(conn, table))
+            conn.execute(f"DELETE FROM main.{table} WHERE {where} "
+                         f"AND EXISTS (SELECT 1 FROM dest.{table} AS copy WHERE {match})", params)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return moved
+
+
+def rebalance(database: str, shard_count: int, batch_size: int = 5000, verbose: bool = True) -> Dict[str, int]:
+    """
+    Move every user onto the shard their id hashes to for shard_count shards.
+
+    Each user moves in two transactions: their rows are copied into the
+    destination file and committed there, then the rows the destination
+    holds are deleted from the source. SQLite commits each attached file on
+    its own in WAL mode, so this order is what guarantees a crash leaves at
+    worst a copy in both files, which a re-run cleans up. The users'
+    archived transactions and events move to the destination's monthly
+    archive files the same way. Run it with the app stopped. Shard files
+    beyond the new count are drained but left on disk.
+    """
+    paths = [shard_path(database, shard) for shard in range(shard_count)]
+    for path in paths:
+        migrate(path, batch_size=batch_size)
+
+    sources = existing_shards(database)
+    for path in sources.values():
+        migrate(path, batch_size=batch_size)
+    users_moved = 0
+    rows_moved = 0
+
+    for source, source_path in sorted(sources.items()):
+        conn = sqlite3.connect(source_path, isolation_level=None)
+        try:
+            users = conn.execute("SELECT id, email FROM users").fetchall()
+            by_target = {}
+            for user_id, email in users:
+                target = shard_of(user_id, shard_count)
+                if target != source:
+                    by_target.setdefault(target, []).append((user_id, email))
+
+            for target, movers in sorted(by_target.items()):
+                # Archived history first: the users stay on source until their hot rows follow, so a re-run converges
+                rows_moved += archive.move_user_archives(source_path, paths[target], movers, batch_size)
+                conn.execute("ATTACH DATABASE ? AS dest", (paths[target],))
+                try:
+                    for user_id, email in movers:
+                        rows_moved += _move_user(conn, user_id, email)
+                        users_moved += 1
+                finally:
+                    conn.execute("DETACH DATABASE dest")
+                if verbose:
+                    print(f"  shard {source} -> shard {target}: moved {len(movers)} users")
+        finally:
+            conn.close()
+
+    # Rebuild the directory from where the users now live and record the new layout
+    common = sqlite3.connect(database, isolation_level=None)
+    try:
+        common.execute("DELETE FROM user_directory")
+        for shard, path in enumerate(paths):
+            if shard == 0:
+                common.execute("INSERT OR REPLACE INTO user_directory (email, user_id) SELECT email, id FROM users")
+                continue
+            common.execute("ATTACH DATABASE ? AS src", (path,))
+            try:
+                common.execute("INSERT OR REPLACE INTO user_directory (email, user_id) SELECT email, id FROM src.users")
+            finally:
+                common.execute("DETACH DATABASE src")
+        common.execute("INSERT OR REPLACE INTO shard_layout (id, shard_count) VALUES (1, ?)", (shard_count,))
+    finally:
+        common.close()
+
+    drained = [path for shard, path in sorted(sources.items()) if shard >= shard_count]
+    if verbose:
+        print(f"Rebalanced to {shard_count} shard(s): moved {users_moved} users ({rows_moved} rows)")
+        for path in drained:
+            print(f"  {path} is no longer used and can be deleted")
+    return {'users_moved': users_moved, 'rows_moved': rows_moved, 'drained': len(drained)}
@@ -0,0 +1,91 @@
+"""
+Connections left open by a handler that raises go back to their pool.
+
+Runs the app against a scratch database with a read pool of two: without
+the teardown hook, two failing requests on their own threads would hold
+both connections and every later GET would time out waiting for one.
+"""
+
+import os
+import sys
+import threading
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    root = tmp_path_factory.mktemp('app')
+    os.environ['SQLITE_DATABASE'] = str(root / 'banking.db')
+    os.environ['SQLITE_READ_POOL_SIZE'] = '2'
+    os.environ['KEYSTROKE_MODEL_DIR'] = str(root / 'keystroke_models')
+    import app
+    assert app.DATABASE == str(root / 'banking.db')
+    app.init_db()
+
+    @app.app.route('/api/test/raise-with-open-connection')
+    def raise_with_open_connection():
+        conn = app.get_read_db()
+        conn.execute("SELECT COUNT(*) FROM stocks").fetchone()
+        raise RuntimeError('handler failed before close()')
+
+    @app.app.route('/api/test/write-then-raise')
+    def write_then_raise():
+        conn = app.get_db()
+        conn.execute("UPDATE stocks SET price = -1")
+        raise RuntimeError('handler failed mid-transaction')
+
+    yield app
+    app.shards.release_thread()
+
+
+def request_on_thread(app_module, url):
+    """Issue one request from a fresh thread, as a threaded server would."""
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(app_module.app.test_client().get(url)))
+    thread.start()
+    thread.join()
+    return responses[0]
+
+
+def test_pool_serves_requests_after_handlers_raise(app_module):
+    for _ in range(app_module.app.config['SQLITE_READ_POOL_SIZE'] + 1):
+        assert request_on_thread(app_module, '/api/test/raise-with-open-connection').status_code == 500
+
+    assert app_module.shards.reader().metrics()['in_use'] == 0
+    assert request_on_thread(app_module, '/api/stocks').status_code == 200
+
+
+def test_open_transaction_is_rolled_back(app_module):
+    assert request_on_thread(app_module, '/api/test/write-then-raise').status_code == 500
+
+    assert app_module.shards.writer().metrics()['in_use'] == 0
+    conn = app_module.get_read_db()
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM stocks WHERE price = -1").fetchone()[0] == 0
+    finally:
+        conn.close()
+
+
+
+def test_malformed_statement_date_is_a_client_error(app_module):
+    client = app_module.app.test_client()
+    login = client.post('/api/auth/login', json={'email': 'pranav1233@gmail.com', 'password': '.tie5Roanl'})
+    headers = {'Authorization': f"Bearer {login.json['token']}"}
+
+    for _ in range(app_module.app.config['SQLITE_READ_POOL_SIZE'] + 1):
+        response = client.get('/api/account-statement?period=byDate&start_date=bad&end_date=2024-01-31',
+                              headers=headers)
+        assert response.status_code == 400
+        assert 'YYYY-MM-DD' in response.json['error']
+
+    response = client.post('/api/account-statement/export', headers=headers,
+                           json={'period': 'byDate', 'start_date': 20240101, 'end_date': '2024-01-31'})
+    assert response.status_code == 400
+
+    response = client.get('/api/account-statement?period=byDate&start_date=2024-01-01&end_date=2024-01-31',
+                          headers=headers)
+    assert response.status_code == 200
@@ -0,0 +1,75 @@
+"""
+forest.CompiledForest scores bit-for-bit like the IsolationForest it was compiled from.
+"""
+
+import contextlib
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import IsolationForest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import forest
+import keystroke
+
+CSV_FILE = os.path.join(BACKEND_DIR, 'collected_keystroke_data.csv')
+
+# Feature and sample subsampling change which columns and how many samples each tree sees
+RANDOM_CONFIGS = [
+    {},
+    {'max_features': 0.5},
+    {'max_features': 0.5, 'bootstrap': True},
+    {'max_samples': 50, 'n_estimators': 37},
+]
+
+
+@pytest.fixture(scope='module')
+def samples():
+    df = pd.read_csv(CSV_FILE)
+    return df.drop(columns=keystroke.NON_FEATURE_COLUMNS, errors='ignore').to_dict('records')
+
+
+@pytest.fixture(scope='module')
+def models():
+    with contextlib.redirect_stdout(io.StringIO()):
+        return {subject: keystroke.fit_from_csv(CSV_FILE, subject)
+                for subject in pd.read_csv(CSV_FILE)['subject'].unique()}
+
+
+def assert_same_scores(model, compiled, X):
+    expected = model.decision_function(X)
+    actual = compiled.decision_function(X)
+    assert np.array_equal(expected, actual), f"max diff {np.abs(expected - actual).max():.3g}"
+
+
+@pytest.mark.parametrize('config', RANDOM_CONFIGS, ids=str)
+def test_random_forests(config):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(200, 12))
+    model = IsolationForest(random_state=42, **config).fit(X)
+    probes = rng.normal(scale=3.0, size=(200, 12))
+    assert_same_scores(model, forest.compile(model), np.vstack([X, probes]))
+
+
+def test_keystroke_models(models, samples):
+    rng = np.random.default_rng(0)
+    for authenticator in models.values():
+        X = np.vstack([authenticator.vector(sample) for sample in samples])
+        probes = rng.normal(scale=3.0, size=(200, X.shape[1]))
+        assert_same_scores(authenticator.model, authenticator.forest, np.vstack([X, probes]))
+
+
+def test_registry_round_trip(models, samples, tmp_path):
+    fitted = next(iter(models.values()))
+    keystroke.ModelRegistry(str(tmp_path)).save('parity@example.com', fitted)
+    loaded = keystroke.ModelRegistry(str(tmp_path)).get('parity@example.com')
+
+    # The loaded copy has no sklearn objects at all
+    assert loaded.model is None and loaded.scaler is None
+    assert [loaded.predict(sample) for sample in samples] == [fitted.predict(sample) for sample in samples]
@@ -0,0 +1,67 @@
+"""
+KeystrokeAuthenticator.predict returns exactly what the one-row DataFrame path it replaced returned.
+"""
+
+import contextlib
+import io
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import keystroke
+
+CSV_FILE = os.path.join(BACKEND_DIR, 'collected_keystroke_data.csv')
+
+
+def reference_predict(authenticator, keystroke_data):
+    """predict before the fast path: a one-row DataFrame, StandardScaler.transform and sklearn's decision_function."""
+    input_df = pd.DataFrame([keystroke_data])[authenticator.feature_columns]
+    input_scaled = authenticator.scaler.transform(input_df)
+    raw_score = authenticator.model.decision_function(input_scaled)[0]
+    status = "Anomaly" if raw_score < 0 else "Normal"
+    score_range = authenticator.max_score_ - authenticator.min_score_
+    normalized_score = 0.5 if score_range == 0 else (raw_score - authenticator.min_score_) / score_range
+    normalized_score = np.clip(normalized_score, 0, 1)
+    return {
+        "status": status,
+        "anomaly_confidence_percent": round((1 - normalized_score) * 100, 2),
+        "raw_score": round(raw_score, 4)
+    }
+
+
+@pytest.fixture(scope='module')
+def samples():
+    df = pd.read_csv(CSV_FILE)
+    return df.drop(columns=keystroke.NON_FEATURE_COLUMNS, errors='ignore').to_dict('records')
+
+
+@pytest.fixture(scope='module', params=['Pranav', 'Priyankaa'])
+def authenticator(request):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return keystroke.fit_from_csv(CSV_FILE, request.param)
+
+
+def test_vector_matches_scaler_transform(authenticator, samples):
+    for sample in samples:
+        expected = authenticator.scaler.transform(pd.DataFrame([sample])[authenticator.feature_columns])
+        assert np.array_equal(authenticator.vector(sample), expected)
+
+
+def test_predict_matches_dataframe_path(authenticator, samples):
+    # Every sample against every subject's model, so both statuses are covered
+    results = [authenticator.predict(sample) for sample in samples]
+    assert results == [reference_predict(authenticator, sample) for sample in samples]
+    assert {result['status'] for result in results} == {'Normal', 'Anomaly'}
+
+
+def test_predict_many_matches_predict(authenticator, samples):
+    malformed = {name: value for name, value in samples[0].items() if name != authenticator.feature_columns[0]}
+    results = authenticator.predict_many(samples + [malformed])
+    assert results[:-1] == [authenticator.predict(sample) for sample in samples]
+    assert 'error' in results[-1]
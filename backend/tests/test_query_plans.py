@@ -0,0 +1,160 @@
+"""
+Query plan regression test for the banking backend.
+
+Builds a scratch database with the app's schema, runs EXPLAIN QUERY PLAN on
+every SQL statement found in the backend source (plus the module-level
+statements that handlers and background jobs use) and fails if any of them
+falls back to a full table SCAN instead of an index search.
+
+Run it after adding or changing a query:
+    python -m pytest tests          (from the backend directory)
+"""
+
+import ast
+import importlib
+import os
+import re
+import sqlite3
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import partitions
+from migrations import migrate
+
+# Files whose SQL string literals are checked
+SOURCE_FILES = ['app.py', 'migrations.py', 'shards.py']
+
+# Modules whose module-level *_SQL constants are checked (built with f-strings at import)
+SOURCE_MODULES = ['repository', 'archive', 'partitions', 'rollups', 'event_store', 'activity']
+
+# Values for the placeholders in *_TEMPLATE constants; {partition} is filled with a real partition name
+TEMPLATE_FIELDS = {
+    'table': 'user_activity_hourly',
+    'width': 3600000,
+    'key': 'symbol',
+}
+
+# Reference tables that are small and read in full on purpose
+ALLOWED_SCAN_TABLES = {'stocks', 'user_event_partitions', 'sqlite_master'}
+
+# Statements that are deliberately full passes (boot-time checks, offline tools)
+ALLOWED_SCAN_STATEMENTS = [
+    "SELECT COUNT(*) FROM users",
+    "SELECT id, email FROM users",  # shards.rebalance
+]
+
+# Module constants that are deliberately full passes (rebuilds and backfills)
+ALLOWED_SCAN_CONSTANTS = {
+    'event_store.ARCHIVED_EVENTS_SQL',
+    'activity.AGGREGATE_TEMPLATE',
+    'activity.REBUILD_TEMPLATE',
+}
+
+SQL_PREFIXES = ('SELECT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+
+def extract_queries(path):
+    """Return every string literal in a Python file that is a complete query."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    queries = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            sql = node.value.strip()
+            if sql.upper().startswith(SQL_PREFIXES) and len(sql.split()) > 3:
+                queries.append((f"{os.path.basename(path)}:{node.lineno}", sql))
+    return queries
+
+
+def module_queries(name, partition):
+    """
+    Return the *_SQL constants defined by a backend module, and its
+    *_TEMPLATE constants filled in from TEMPLATE_FIELDS and a user_events
+    partition name.
+    """
+    module = importlib.import_module(name)
+    queries = []
+    for attr, value in sorted(vars(module).items()):
+        if attr.endswith('_SQL') and isinstance(value, str):
+            queries.append((f"{name}.{attr}", value))
+        elif attr.endswith('_TEMPLATE') and isinstance(value, str):
+            queries.append((f"{name}.{attr}", value.format(partition=partition, **TEMPLATE_FIELDS)))
+    return queries
+
+
+def explain(conn, sql):
+    params = [None] * sql.count('?')
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+
+def full_scans(plan, sql):
+    """Tables (resolved from aliases) that the plan walks in full."""
+    aliases = {}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)\s+(?:AS\s+)?(\w+)', sql, re.IGNORECASE):
+        aliases[alias] = table
+
+    scans = []
+    for detail in plan:
+        match = re.match(r'SCAN (\w+)', detail)
+        # json_each walks the bound list of ids, not a table
+        if match and match.group(1) != 'CONSTANT' and 'VIRTUAL TABLE' not in detail:
+            scans.append(aliases.get(match.group(1), match.group(1)))
+    return scans
+
+
+@pytest.fixture(scope='module')
+def conn(tmp_path_factory):
+    """A scratch database with the schema init_db would create: every migration and this month's partitions."""
+    database = str(tmp_path_factory.mktemp('plans') / 'plan_check.db')
+    migrate(database)
+    partitions.maintain(database)
+    conn = sqlite3.connect(database)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture(scope='module')
+def queries(conn):
+    queries = []
+    for name in SOURCE_FILES:
+        queries.extend(extract_queries(os.path.join(BACKEND_DIR, name)))
+    partition = conn.execute("SELECT name FROM user_event_partitions LIMIT 1").fetchone()[0]
+    for name in SOURCE_MODULES:
+        queries.extend(module_queries(name, partition))
+    return queries
+
+
+def test_statements_prepare(conn, queries):
+    errors = []
+    for location, sql in queries:
+        try:
+            explain(conn, sql)
+        except sqlite3.Error as e:
+            errors.append(f"{location}: {e}\n    {normalize(sql)}")
+    assert not errors, '\n'.join(errors)
+
+
+def test_no_full_table_scans(conn, queries):
+    allowed_statements = {normalize(sql) for sql in ALLOWED_SCAN_STATEMENTS}
+    failures = []
+    for location, sql in queries:
+        if normalize(sql) in allowed_statements or location in ALLOWED_SCAN_CONSTANTS:
+            continue
+        try:
+            plan = explain(conn, sql)
+        except sqlite3.Error:
+            continue  # reported by test_statements_prepare
+        offending = [table for table in full_scans(plan, sql) if table not in ALLOWED_SCAN_TABLES]
+        if offending:
+            failures.append(f"{location}: full scan of {', '.join(sorted(set(offending)))}\n"
+                            f"    {normalize(sql)}\n" + '\n'.join(f"      {detail}" for detail in plan))
+    assert not failures, '\n'.join(failures)
@@ -0,0 +1,103 @@
+"""
+Rebalancing shards: a moved user's archived history moves with them.
+"""
+
+import contextlib
+import io
+import os
+import sqlite3
+import sys
+import time
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import archive
+import ids
+import partitions
+from migrations import migrate
+from partitions import add_months, month_start_ms
+from shards import rebalance, shard_of, shard_path
+
+DAY_MS = 24 * 3600 * 1000
+
+
+def user_on_shard(shard):
+    while True:
+        user_id = ids.new_id()
+        if shard_of(user_id, 2) == shard:
+            return user_id
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = str(tmp_path / 'banking.db')
+    with contextlib.redirect_stdout(io.StringIO()):
+        migrate(path)
+    partitions.maintain(path)
+    return path
+
+
+def add_user(database, user_id, email, times_ms):
+    """A user with one transaction and one event at each time."""
+    conn = sqlite3.connect(database)
+    try:
+        conn.execute("INSERT INTO users (id, email, password, first_name, last_name, phone, account_number) "
+                     "VALUES (?, ?, 'x', 'Test', 'User', '0', ?)", (user_id, email, user_id[-12:]))
+        conn.executemany("INSERT INTO transactions (id, user_id, type, amount, description, created_at_ms) "
+                         "VALUES (?, ?, 'DEPOSIT', 100, 'Deposit', ?)",
+                         [(ids.new_id(), user_id, time_ms) for time_ms in times_ms])
+        partitions.insert_events(conn, [(ids.new_id(), email, 'portfolio_view', None, '/portfolio', 0, None, None, time_ms)
+                                        for time_ms in times_ms])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def archived(database, table, key, value):
+    """Rows of table for one owner across a hot file's monthly archives."""
+    count = 0
+    for path in archive.archive_files(database, 0, int(time.time() * 1000)):
+        conn = sqlite3.connect(path)
+        try:
+            if archive._columns(conn, 'main', table):
+                count += conn.execute(f"SELECT COUNT(*) FROM {table} WHERE {key} = ?", (value,)).fetchone()[0]
+        finally:
+            conn.close()
+    return count
+
+
+def statement(database, user_id):
+    conn = sqlite3.connect(database)
+    try:
+        return archive.list_statement_transactions(conn, database, user_id)
+    finally:
+        conn.close()
+
+
+def test_archived_rows_move_with_their_user(database):
+    now_ms = int(time.time() * 1000)
+    this_month = month_start_ms(now_ms)
+    old = [add_months(this_month, -3) + DAY_MS, add_months(this_month, -2) + DAY_MS]
+    mover, stayer = user_on_shard(1), user_on_shard(0)
+    add_user(database, mover, 'mover@example.com', old + [now_ms])
+    add_user(database, stayer, 'stayer@example.com', old + [now_ms])
+    archive.archive_old_rows(database, this_month)
+    assert archived(database, 'transactions', 'user_id', mover) == 2
+
+    rebalance(database, 2, verbose=False)
+    shard1 = shard_path(database, 1)
+
+    assert len(statement(shard1, mover)) == 3
+    assert archived(shard1, 'transactions', 'user_id', mover) == 2
+    assert archived(shard1, partitions.TABLE, 'user_email', 'mover@example.com') == 2
+    assert archived(database, 'transactions', 'user_id', mover) == 0
+    assert archived(database, partitions.TABLE, 'user_email', 'mover@example.com') == 0
+
+    assert len(statement(database, stayer)) == 3
+    assert archived(shard1, 'transactions', 'user_id', stayer) == 0
+
+    # Nothing left to move on a re-run
+    assert rebalance(database, 2, verbose=False)['rows_moved'] == 0
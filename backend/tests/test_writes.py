@@ -0,0 +1,82 @@
+"""
+WritePipeline timeouts: a caller that gave up never has its write applied later.
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from db import ConnectionPool
+from writes import WritePipeline
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    database = str(tmp_path / 'writes.db')
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE ledger (note TEXT)")
+    conn.close()
+    pool = ConnectionPool(database, max_size=2)
+    pipeline = WritePipeline(pool, max_batch=1)
+    yield pipeline
+    pipeline.stop()
+    pool.close_all()
+
+
+def notes(pipeline):
+    conn = sqlite3.connect(pipeline.pool.database)
+    try:
+        return [row[0] for row in conn.execute("SELECT note FROM ledger ORDER BY rowid")]
+    finally:
+        conn.close()
+
+
+def insert(note, wait=None):
+    def job(conn):
+        if wait is not None:
+            wait.wait(5)
+        conn.execute("INSERT INTO ledger (note) VALUES (?)", (note,))
+        return note
+    return job
+
+
+def test_queued_job_that_timed_out_is_never_applied(pipeline):
+    release = threading.Event()
+    blocker = pipeline.submit(insert('first', wait=release))
+
+    with pytest.raises(TimeoutError):
+        pipeline.execute(insert('gave up'), timeout=0.05)
+    release.set()
+
+    assert blocker.result(5) == 'first'
+    assert pipeline.execute(insert('after')) == 'after'
+    assert notes(pipeline) == ['first', 'after']
+
+
+def test_running_job_is_waited_for_past_the_timeout(pipeline):
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow(conn):
+        started.set()
+        release.wait(5)
+        conn.execute("INSERT INTO ledger (note) VALUES ('slow')")
+        return 'slow'
+
+    result = []
+    caller = threading.Thread(target=lambda: result.append(pipeline.execute(slow, timeout=0.05)))
+    caller.start()
+    assert started.wait(5)
+    caller.join(0.2)
+    assert caller.is_alive()  # past its timeout, still waiting for the job it cannot cancel
+    release.set()
+    caller.join(5)
+
+    assert result == ['slow']
+    assert notes(pipeline) == ['slow']
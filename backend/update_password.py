@@ -7,12 +7,17 @@ import sqlite3
 from werkzeug.security import generate_password_hash
 import os
 
+from shards import ShardRouter, existing_shards, recorded_shard_count
+
+# Database path: the common file; the user may live on another shard
+DATABASE = 'banking.db'
+
+def open_shards():
+    return ShardRouter(DATABASE, shard_count=recorded_shard_count(DATABASE))
+
 def update_demo_password():
     """Update the password for the demo user"""
     
-    # Database path
-    DATABASE = 'banking.db'
-    
     # Check if database exists
     if not os.path.exists(DATABASE):
         print(f"Error: Database file '{DATABASE}' not found!")
@@ -20,30 +25,30 @@ def update_demo_password():
         return False
     
     try:
-        # Connect to database
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        
-        # Check if user exists
-        cursor.execute("SELECT id, email FROM users WHERE email = ?", ('pranav1233@gmail.com',))
-        user = cursor.fetchone()
+        # Find the user's shard through the common email directory
+        shards = open_shards()
+        user_id = shards.user_id_for_email('pranav1233@gmail.com')
         
-        if not user:
+        if user_id is None:
             print("Error: User 'pranav1233@gmail.com' not found in database!")
             print("Available users:")
-            cursor.execute("SELECT email FROM users")
-            users = cursor.fetchall()
-            for user_email in users:
-                print(f"  - {user_email[0]}")
+            for path in existing_shards(DATABASE).values():
+                shard_conn = sqlite3.connect(path)
+                for user_email in shard_conn.execute("SELECT email FROM users"):
+                    print(f"  - {user_email[0]}")
+                shard_conn.close()
             return False
         
+        conn = shards.writer(user_id).connection()
+        cursor = conn.cursor()
+        
         # Generate new password hash
         new_password_hash = generate_password_hash('.tie5Roanl')
         
         # Update the password
         cursor.execute(
-            "UPDATE users SET password = ? WHERE email = ?",
-            (new_password_hash, 'pranav1233@gmail.com')
+            "UPDATE users SET password = ? WHERE id = ?",
+            (new_password_hash, user_id)
         )
         
         # Commit changes
@@ -55,7 +60,7 @@ def update_demo_password():
         print(f"Password hash: {new_password_hash[:50]}...")
         
         # Verify the update
-        cursor.execute("SELECT password FROM users WHERE email = ?", ('pranav1233@gmail.com',))
+        cursor.execute("SELECT password FROM users WHERE id = ?", (user_id,))
         updated_hash = cursor.fetchone()[0]
         print(f"Verified hash in database: {updated_hash[:50]}...")
         
@@ -69,10 +74,11 @@ def update_demo_password():
 def verify_password_update():
     """Verify that the password was updated correctly"""
     
-    DATABASE = 'banking.db'
-    
+    conn = None
     try:
-        conn = sqlite3.connect(DATABASE)
+        shards = open_shards()
+        user_id = shards.user_id_for_email('pranav1233@gmail.com')
+        conn = shards.reader(user_id).connection()
         cursor = conn.cursor()
         
         # Get current password hash
@@ -99,7 +105,8 @@ def verify_password_update():
         print(f"Error verifying password: {e}")
         return False
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
 if __name__ == "__main__":
     print("🔐 SecureBank Password Update Script")
@@ -0,0 +1,186 @@
+"""
+Group-commit write pipeline for money-moving operations.
+
+Every pay_bill, transfer or trade used to commit its own transaction, which
+costs one WAL sync per request. Here handlers submit their database work as a
+job to a single writer thread instead. The writer waits a few milliseconds
+for concurrent jobs to arrive and applies the whole batch in one transaction
+and one commit. Each job runs inside its own SAVEPOINT, so a job that fails
+(insufficient balance, a missing biller, a bug) is rolled back on its own
+and reports its own error while the rest of the batch still commits.
+"""
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class MutationError(Exception):
+    """A job refused its write, e.g. insufficient balance; carries the HTTP status to return."""
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+_STOP = object()
+
+
+class WritePipeline:
+    """
+    A single writer thread that batches jobs into shared transactions.
+
+    A job is a callable that takes the writer's connection and returns a
+    result. It may read and write freely but must not commit, roll back or
+    close the connection; the pipeline owns the transaction. Results are only
+    handed back once the batch has committed, so a caller never sees success
+    for a write that was not made durable.
+    """
+    def __init__(self, pool, max_batch: int = 64, max_wait: float = 0.002, queue_size: int = 1024):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self._batches = 0
+        self._jobs = 0
+        self._failed_jobs = 0
+        self._failed_commits = 0
+        self._batch_max = 0
+        self._commit_total = 0.0
+        self._commit_max = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='write-pipeline', daemon=True)
+                self._thread.start()
+
+    def submit(self, job: Callable[[sqlite3.Connection], Any]) -> Future:
+        """Queue a job and return a Future for its result (or its exception)."""
+        self.start()
+        future = Future()
+        self._queue.put((job, future))
+        return future
+
+    def execute(self, job: Callable[[sqlite3.Connection], Any], timeout: Optional[float] = 30.0) -> Any:
+        """
+        Run a job through the pipeline and wait for it; re-raises the job's own exception.
+        A job still queued after timeout seconds is cancelled, so it is never applied, and
+        TimeoutError is raised. A job the writer has already started is waited for: its
+        outcome is the one the caller gets.
+        """
+        future = self.submit(job)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if future.cancel():
+                raise
+            return future.result()
+
+    def stop(self, timeout: Optional[float] = 5.0):
+        """Apply everything already queued, then stop the writer thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def _collect(self) -> Tuple[List[Tuple[Callable, Future]], bool]:
+        """Block for one job, then gather more until the batch is full or max_wait has passed."""
+        first = self._queue.get()
+        if first is _STOP:
+            return [], True
+
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        conn = self.pool.connection()
+        try:
+            stopping = False
+            while not stopping:
+                batch, stopping = self._collect()
+                if batch:
+                    self._apply(conn, batch)
+        finally:
+            conn.close()
+
+    def _apply(self, conn: sqlite3.Connection, batch: List[Tuple[Callable, Future]]):
+        outcomes = []
+        failed = 0
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for job, future in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT job")
+                try:
+                    result = job(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO job")
+                    conn.execute("RELEASE job")
+                    failed += 1
+                    outcomes.append((future, None, e))
+                else:
+                    conn.execute("RELEASE job")
+                    outcomes.append((future, result, None))
+
+            started = time.monotonic()
+            conn.commit()
+            commit_time = time.monotonic() - started
+        except sqlite3.Error as e:
+            # The batch as a whole could not be applied, so nothing in it was written
+            if conn.in_transaction:
+                conn.rollback()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            self._record(len(batch), len(batch), 0.0, commit_failed=True)
+            return
+
+        for future, result, error in outcomes:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        self._record(len(batch), failed, commit_time)
+
+    def _record(self, size: int, failed: int, commit_time: float, commit_failed: bool = False):
+        with self._lock:
+            self._batches += 1
+            self._jobs += size
+            self._failed_jobs += failed
+            self._failed_commits += int(commit_failed)
+            self._batch_max = max(self._batch_max, size)
+            self._commit_total += commit_time
+            self._commit_max = max(self._commit_max, commit_time)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Batching and commit-latency statistics."""
+        with self._lock:
+            return {
+                'running': self._thread is not None and self._thread.is_alive(),
+                'queued': self._queue.qsize(),
+                'batches': self._batches,
+                'jobs': self._jobs,
+                'failed_jobs': self._failed_jobs,
+                'failed_commits': self._failed_commits,
+                'batch_size_avg': round(self._jobs / self._batches, 2) if self._batches else 0.0,
+                'batch_size_max': self._batch_max,
+                'commit_avg_ms': round(self._commit_total / self._batches * 1000, 3) if self._batches else 0.0,
+                'commit_max_ms': round(self._commit_max * 1000, 3),
+            }